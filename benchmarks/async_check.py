@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# Checks AsyncPLODResource against the blocking PLODResource: every method
+# bench.py has a case for is run on both, over the fixture served as in
+# bench.py, with each async transport:
+#
+#     httpx      AsyncSPARQLClient to the local endpoint
+#     threads    ThreadedClient over a LocalGraph of the same fixture
+#
+# and each of those with the result cache on too (use_cache()), running the
+# cases twice so both the misses and the hits are checked.
+#
+#     python benchmarks/async_check.py
+#     python benchmarks/async_check.py -k depicts --transport threads
+#
+# Exits with status 1 if an async method raises, or returns a result of a
+# different size from the blocking one.
+
+import argparse
+import asyncio
+import inspect
+import os
+import sys
+
+from bench import CASES, FIXTURE, serve, size
+
+import plodlib
+import plodlib.luna
+from plodlib.aio import AsyncPLODResource, AsyncSPARQLClient, ThreadedClient, httpx
+from plodlib.client import LocalGraph
+
+
+TRANSPORTS = ('httpx', 'threads')
+
+
+def make_client(transport, url, fixture):
+    if transport == 'httpx':
+        return AsyncSPARQLClient(url + '/query')
+    return ThreadedClient(LocalGraph(fixture))
+
+
+async def run_async(transport, url, fixture, cases, passes = 1):
+    # [case -> (rows, bytes) of its result, or the exception it raised] per pass.
+    # Resources are left unloaded, so methods load them (and the cache key) themselves.
+    client = make_client(transport, url, fixture)
+    found = []
+    try:
+        for _ in range(passes):
+            results = {}
+            for case, identifier, call in cases:
+                try:
+                    result = call(AsyncPLODResource(identifier, client = client))
+                    if inspect.isawaitable(result):
+                        result = await result
+                    results[case] = size(result)
+                except Exception as e:
+                    results[case] = e
+            found.append(results)
+    finally:
+        await client.aclose()
+    return found
+
+
+def run_mode(transport, cache, url, fixture, cases):
+    # {label: results} for one transport, with or without the result cache
+    if not cache:
+        return {transport: asyncio.run(run_async(transport, url, fixture, cases))[0]}
+    plodlib.use_cache()
+    try:
+        miss, hit = asyncio.run(run_async(transport, url, fixture, cases, passes = 2))
+    finally:
+        plodlib.use_cache(False)
+    return {f'{transport}, cache miss': miss, f'{transport}, cache hit': hit}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Check every AsyncPLODResource method against the blocking one.')
+    parser.add_argument('--fixture', default = FIXTURE, help = 'RDF file to serve (default: benchmarks/fixture.ttl)')
+    parser.add_argument('--transport', action = 'append', choices = TRANSPORTS, help = 'only this transport (repeatable)')
+    parser.add_argument('--no-cache', action = 'store_true', help = "don't also run with the result cache on")
+    parser.add_argument('-k', '--filter', help = 'only cases whose name contains this')
+    args = parser.parse_args(argv)
+
+    transports = args.transport or TRANSPORTS
+    if 'httpx' in transports and httpx is None:
+        parser.error('httpx is not installed; pip install httpx or use --transport threads')
+
+    # the construct / many cases have no method to call
+    cases = [c for c in CASES if c[2] is not None and (not args.filter or args.filter in c[0])]
+
+    server, url = serve(args.fixture)
+    plodlib.luna.LUNA_SEARCH_URL = url + '/luna'
+    plodlib.configure(endpoint = url + '/query')
+    plodlib.use_cache(False)
+
+    # the methods print some diagnostics; keep them out of the report
+    failures = 0
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        expected = {case: size(call(plodlib.PLODResource(identifier))) for case, identifier, call in cases}
+        found = {}
+        for transport in transports:
+            for cache in (False,) if args.no_cache else (False, True):
+                found.update(run_mode(transport, cache, url, args.fixture, cases))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        server.terminate()
+
+    for case, identifier, call in cases:
+        for mode, results in found.items():
+            result = results[case]
+            if isinstance(result, Exception):
+                problem = f'raised {type(result).__name__}: {result}'
+            elif result != expected[case]:
+                problem = f'{result[0]} rows / {result[1]} bytes, blocking gives {expected[case][0]} / {expected[case][1]}'
+            else:
+                continue
+            failures += 1
+            print(f"FAIL {case} ({mode}): {problem}")
+
+    print(f"{len(cases)} cases x {len(found)} modes, {failures} failed")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
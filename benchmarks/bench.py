@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# Benchmarks for every PLODResource method, over a fixed fixture graph.
+#
+# The fixture (default benchmarks/fixture.ttl) is served by a local SPARQL
+# endpoint in a child process, so the numbers include HTTP, JSON decoding and
+# post-processing but not the network or the remote triplestore. A LUNA
+# stand-in on the same server answers the image lookups. --backend local
+# queries the graph in process instead (LocalGraph).
+#
+# For each case: median / min / p95 latency over --repeat runs, peak memory
+# allocated during one run (tracemalloc) and the size of the result.
+#
+#     python benchmarks/bench.py --save baseline.json
+#     ... change something ...
+#     python benchmarks/bench.py --compare baseline.json
+#
+# --synthetic serves generated data (plodlib.synthetic) instead, for load tests:
+#
+#     python benchmarks/bench.py --synthetic --seed 1 --set regions=2 --set insulae=4
+#
+# --compare exits with status 1 if any case got slower or allocates more than
+# --tolerance (default 50%) above the baseline, or returns a different size of
+# result.
+
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import rdflib as rdf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import plodlib
+import plodlib.luna
+from plodlib import synthetic
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixture.ttl')
+
+# fixture identifiers -> the ones to use instead (set for --synthetic)
+NAMES = {}
+
+
+def name(identifier):
+    return NAMES.get(identifier, identifier)
+
+
+# cases: (name, identifier, what to run on the PLODResource)
+LEVELS_OF_DETAIL = ('feature', 'space', 'property', 'insula', 'region')
+
+CASES = [
+    ('construct', 'r1-i1-p1', None),
+    ('construct lazy', 'r1-i1-p1', None),
+    ('many', None, None),
+    ('conceptual_ancestors', 'dog', lambda r: r.conceptual_ancestors()),
+    ('conceptual_descendants', 'animal', lambda r: r.conceptual_descendants()),
+    ('conceptual_children', 'animal', lambda r: r.conceptual_children()),
+    ('narrower', 'animal', lambda r: r.narrower),
+    ('depicts_concepts pompeii', 'pompeii', lambda r: r.depicts_concepts()),
+    ('depicts_concepts region', 'r1', lambda r: r.depicts_concepts()),
+    ('depicts_concepts property', 'r1-i1-p1', lambda r: r.depicts_concepts()),
+    ('depicts_concepts space', 'r1-i1-p1-space-1', lambda r: r.depicts_concepts()),
+    ('depicts_concepts feature', 'r1-i1-p1-space-1-feature-1', lambda r: r.depicts_concepts()),
+] + [
+    (f'depicted_where {level}', 'animal', lambda r, level = level: r.depicted_where(level_of_detail = level))
+    for level in LEVELS_OF_DETAIL
+] + [
+    ('gather_images concept', 'dog', lambda r: r.gather_images()),
+    ('gather_images region', 'r1', lambda r: r.gather_images()),
+    ('gather_images property', 'r1-i1-p1', lambda r: r.gather_images()),
+    ('gather_images space', 'r1-i1-p1-space-1', lambda r: r.gather_images()),
+    ('gather_images feature', 'r1-i1-p1-space-1-feature-1', lambda r: r.gather_images()),
+    ('gather_images other', 'r1-i1-p1-space-1-feature-1-ac-1', lambda r: r.gather_images()),
+    ('images_from_luna', 'dog', lambda r: r.images_from_luna),
+    ('geojson stored', 'r1-i1-p1', lambda r: r.geojson),
+    ('geojson style', 'third-style', lambda r: r.geojson),
+    ('geojson space-characterization', 'garden', lambda r: r.geojson),
+    ('geojson depicted', 'dog', lambda r: r.geojson),
+    ('spatial_ancestors', 'r1-i1-p1-space-1-feature-1-ac-2', lambda r: r.spatial_ancestors()),
+    ('spatial_children', 'r1-i1', lambda r: r.spatial_children()),
+    ('spatially_within', 'r1-i1-p1-space-1', lambda r: r.spatially_within),
+    ('in_region', 'r1-i1-p1-space-1', lambda r: r.in_region),
+    ('instances_of', 'space', lambda r: r.instances_of()),
+    ('as_object', 'dog', lambda r: r.as_object()),
+    ('as_predicate', 'depicts', lambda r: r.as_predicate()),
+    ('used_as_predicate_by', 'wikidata-url', lambda r: r.used_as_predicate_by()),
+    ('get_predicate_values', 'pompeii', lambda r: r.get_predicate_values('http://www.w3.org/2000/01/rdf-schema#label')),
+    ('rdf_describe', 'r1-i1-p1', lambda r: r.rdf_describe()),
+    ('see_also', 'dog', lambda r: r.see_also()),
+    ('compare_depicts', 'r1-i1-p1', lambda r: r.compare_depicts('r1-i1-p2')),
+    ('compare_depicted', 'dog', lambda r: r.compare_depicted(name('bird'))),
+]
+
+
+def luna_answer(mid):
+    # what LUNA's fetchMediaSearch returns for one image
+    attributes = {'urlSize1': f'https://example.org/{mid}/1.jpg', 'urlSize2': f'https://example.org/{mid}/2.jpg',
+                  'image_description_english': f'image {mid}'}
+    return [{'attributes': json.dumps(attributes), 'fieldValues': json.dumps([{'value': ''}] * 3)}]
+
+
+def make_server(graph):
+    # SPARQL endpoint at /query and LUNA stand-in at /luna on a free local port
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, body, content_type):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _query(self, query_str):
+            with lock:
+                result = graph.query(query_str)
+                if result.type in ('SELECT', 'ASK'):
+                    self._send(result.serialize(format = 'json'), 'application/sparql-results+json')
+                else:
+                    self._send(result.graph.serialize(format = 'turtle').encode('utf-8'), 'text/turtle')
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            if url.path == '/luna':
+                self._send(json.dumps(luna_answer(params['mid'][0])).encode('utf-8'), 'application/json')
+            else:
+                self._query(params['query'][0])
+
+        def do_POST(self):
+            length = int(self.headers['Content-Length'])
+            self._query(parse_qs(self.rfile.read(length).decode('utf-8'))['query'][0])
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+
+
+def _serve_forever(fixture, ports):
+    graph = rdf.Graph()
+    graph.parse(fixture)
+    server = make_server(graph)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def serve(fixture):
+    # serve fixture from a child process, so its work doesn't show up in the
+    # client's timings and allocations. Returns (process, base url).
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target = _serve_forever, args = (fixture, ports), daemon = True)
+    process.start()
+    return process, f'http://127.0.0.1:{ports.get(timeout = 120)}'
+
+
+def size(result):
+    # (rows, bytes) of a method's result
+    def plain(o):
+        # a PLODResource (e.g. from many()) as what it was built from
+        return getattr(o, '_po', None) if isinstance(o, plodlib.PLODResource) else str(o)
+
+    if isinstance(result, plodlib.PLODResource):
+        result = plain(result)
+    rows = len(result) if isinstance(result, (list, dict, tuple)) else 1
+    return rows, len(json.dumps(result, default = plain))
+
+
+def synthetic_names(settings):
+    # the fixture identifiers the cases use -> their counterparts in plodlib.synthetic data
+    roots = settings.get('concept_roots', synthetic.DEFAULTS['concept_roots'])
+    return {'animal': 'concept-1', 'bird': 'concept-2', 'dog': f'concept-{roots + 1}',
+            'r1-i1-p1-space-1-feature-1-ac-2': 'r1-i1-p1-space-1-feature-1-ac-1-1'}
+
+
+def runner(name, identifier, call):
+    # a no-argument function running the case once
+    if name == 'construct':
+        return lambda: plodlib.PLODResource(identifier)
+    if name == 'construct lazy':
+        return lambda: plodlib.PLODResource(identifier, lazy = True).label
+    if name == 'many':
+        identifiers = [f'r{r}-i{i}-p{p}-space-{s}' for r in (1, 2) for i in (1, 2) for p in (1, 2) for s in (1, 2, 3)]
+        return lambda: plodlib.PLODResource.many(identifiers)
+    resource = plodlib.PLODResource(identifier)
+    return lambda: call(resource)
+
+
+def measure(run, repeat):
+    run()   # warm up
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        times.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    run()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rows, nbytes = size(result)
+    times.sort()
+    return {'median_ms': round(statistics.median(times), 3),
+            'min_ms': round(times[0], 3),
+            'p95_ms': round(times[min(len(times) - 1, int(len(times) * 0.95))], 3),
+            'peak_kb': round(peak / 1024, 1),
+            'rows': rows,
+            'bytes': nbytes}
+
+
+def compare(results, baseline, tolerance):
+    # list of regression messages
+    problems = []
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        # ignore sub-millisecond jitter
+        if now['median_ms'] > before['median_ms'] * (1 + tolerance) and now['median_ms'] - before['median_ms'] > 1:
+            problems.append(f"{name}: median {before['median_ms']} -> {now['median_ms']} ms")
+        if now['peak_kb'] > before['peak_kb'] * (1 + tolerance) and now['peak_kb'] - before['peak_kb'] > 64:
+            problems.append(f"{name}: peak allocation {before['peak_kb']} -> {now['peak_kb']} KB")
+        if (now['rows'], now['bytes']) != (before['rows'], before['bytes']):
+            problems.append(f"{name}: result changed from {before['rows']} rows / {before['bytes']} bytes "
+                            f"to {now['rows']} rows / {now['bytes']} bytes")
+    return problems
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark PLODResource methods over a fixture graph.')
+    parser.add_argument('--fixture', default = FIXTURE, help = 'RDF file to serve (default: benchmarks/fixture.ttl)')
+    parser.add_argument('--synthetic', action = 'store_true', help = 'serve data from plodlib.synthetic instead of the fixture')
+    parser.add_argument('--seed', type = int, default = 0, help = 'seed for --synthetic')
+    parser.add_argument('--scale', type = int, default = 1, help = 'scale for --synthetic')
+    parser.add_argument('--set', action = 'append', default = [], metavar = 'NAME=VALUE',
+                        help = 'a plodlib.synthetic setting, e.g. --set insulae=5 (repeatable)')
+    parser.add_argument('--backend', choices = ['http', 'local'], default = 'http',
+                        help = 'query the fixture over a local SPARQL endpoint (default) or in process')
+    parser.add_argument('--repeat', type = int, default = 20, help = 'timed runs per case')
+    parser.add_argument('--index', action = 'store_true', help = 'use the hierarchy index')
+    parser.add_argument('-k', '--filter', help = 'only cases whose name contains this')
+    parser.add_argument('--output', help = 'write the results to this JSON file')
+    parser.add_argument('--save', metavar = 'BASELINE', help = 'write the results as the new baseline')
+    parser.add_argument('--compare', metavar = 'BASELINE', help = 'compare with a saved baseline')
+    parser.add_argument('--tolerance', type = float, default = 0.5, help = 'allowed slowdown / growth, as a fraction')
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        settings = {}
+        for setting in args.set:
+            key, value = setting.split('=', 1)
+            settings[key] = type(synthetic.DEFAULTS[key])(value)
+        handle, args.fixture = tempfile.mkstemp(suffix = '.nt')
+        os.close(handle)
+        n = synthetic.write(args.fixture, seed = args.seed, scale = args.scale, **settings)
+        print(f"synthetic data: {n} triples (seed {args.seed}, scale {args.scale}, {settings or 'defaults'})")
+        NAMES.update(synthetic_names(settings))
+
+    server, url = serve(args.fixture)
+    plodlib.luna.LUNA_SEARCH_URL = url + '/luna'
+    if args.backend == 'local':
+        plodlib.use_local_graph(args.fixture)
+    else:
+        plodlib.configure(endpoint = url + '/query')
+    plodlib.use_cache(False)
+    if args.index:
+        plodlib.use_hierarchy_index()
+
+    # the methods print some diagnostics; keep them out of the report
+    results = {}
+    for case, identifier, call in CASES:
+        if args.filter and args.filter not in case:
+            continue
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            results[case] = measure(runner(case, name(identifier), call), args.repeat)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        r = results[case]
+        print(f"{case:34} {r['median_ms']:9.2f} ms  (min {r['min_ms']:.2f}, p95 {r['p95_ms']:.2f})"
+              f"  {r['peak_kb']:9.1f} KB  {r['rows']:5} rows {r['bytes']:8} bytes")
+
+    server.terminate()
+    if args.synthetic:
+        os.remove(args.fixture)
+
+    report = {'fixture': 'synthetic' if args.synthetic else os.path.basename(args.fixture),
+              'seed': args.seed, 'scale': args.scale, 'settings': args.set, 'backend': args.backend, 'index': args.index,
+              'repeat': args.repeat, 'results': results}
+    for path in (args.output, args.save):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent = 1, sort_keys = True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline['results'], args.tolerance)
+        for p in problems:
+            print('REGRESSION', p)
+        if problems:
+            return 1
+        print(f"no regressions against {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# Checks that the optional components give the same answers as the plain
+# queries, over the fixture served as in bench.py:
+#
+#     location table    use_location_table()
+#     depiction matrix  use_depiction_matrix()
+#     hierarchy index   use_hierarchy_index()
+#     cache             use_cache(), every case run twice (miss, then hit)
+#
+# Every case bench.py has, and every one of them again on an identifier that
+# isn't in the data (PLODResource.identifier is then None), is run with each
+# component on, on an eager, a lazy and an async resource, and compared with
+# the plain eager result. Lists are compared as sets of rows: the components
+# don't promise the queries' row order.
+#
+# depicts_concepts of every city, region, insula, property, space, feature
+# and concept, plain and with the location table, is also compared with
+# depicts_concepts_baseline.json, row order included (except with the
+# table). That file was recorded from the original pandas-based
+# PLODResource, before any of the components existed, against this fixture.
+#
+#     python benchmarks/consistency_check.py
+#     python benchmarks/consistency_check.py -k compare --component 'depiction matrix'
+#
+# Exits with status 1 if anything differs, or raises where the plain method
+# doesn't.
+
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import sys
+
+from bench import CASES, FIXTURE, serve
+
+import plodlib
+import plodlib.luna
+from plodlib.aio import AsyncPLODResource, AsyncSPARQLClient, ThreadedClient, httpx
+from plodlib.client import LocalGraph
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'depicts_concepts_baseline.json')
+
+UNKNOWN = 'no-such-resource'
+
+# name -> (turn it on, turn it off)
+COMPONENTS = {
+    'location table': (plodlib.use_location_table, lambda: plodlib.use_location_table(False)),
+    'depiction matrix': (plodlib.use_depiction_matrix, lambda: plodlib.use_depiction_matrix(False)),
+    'hierarchy index': (plodlib.use_hierarchy_index, lambda: plodlib.use_hierarchy_index(False)),
+    'cache': (plodlib.use_cache, lambda: plodlib.use_cache(False)),
+}
+
+# the bench cases, on their identifiers and on an unknown one; compare_* also
+# with the unknown one on the other side
+UNKNOWN_CASES = [
+    ('compare_depicts unknown other', 'r1-i1-p1', lambda r: r.compare_depicts(UNKNOWN)),
+    ('compare_depicted unknown other', 'dog', lambda r: r.compare_depicted(UNKNOWN)),
+]
+
+
+def make_cases(bench_cases):
+    cases = [c for c in bench_cases if c[2] is not None]
+    return cases + [(f'{case} unknown', UNKNOWN, call) for case, _, call in cases] + UNKNOWN_CASES
+
+
+def plain(o):
+    return getattr(o, '_po', None) if isinstance(o, plodlib.PLODResource) else str(o)
+
+
+def outcome(result, ordered = False):
+    # what to compare of a result: its JSON, with every list's items sorted
+    # unless ordered
+    if isinstance(result, Exception):
+        return f'raises {type(result).__name__}'
+
+    def canonical(o):
+        if isinstance(o, dict):
+            return {k: canonical(v) for k, v in o.items()}
+        if isinstance(o, list):
+            items = [canonical(v) for v in o]
+            return items if ordered else sorted(items, key = lambda v: json.dumps(v, sort_keys = True))
+        return o
+
+    return json.dumps(canonical(json.loads(json.dumps(plain(result) if isinstance(result, plodlib.PLODResource) else result,
+                                                      default = plain))), sort_keys = True)
+
+
+def run_blocking(cases, lazy = False):
+    results = {}
+    for case, identifier, call in cases:
+        try:
+            results[case] = call(plodlib.PLODResource(identifier, lazy = lazy))
+        except Exception as e:
+            results[case] = e
+    return results
+
+
+async def run_async(client, cases):
+    results = {}
+    for case, identifier, call in cases:
+        try:
+            result = call(AsyncPLODResource(identifier, client = client))
+            results[case] = await result if inspect.isawaitable(result) else result
+        except Exception as e:
+            results[case] = e
+    return results
+
+
+def run_modes(cases, make_client, passes):
+    # {mode: results} for eager, lazy and async resources, passes times each
+    found = {}
+    for n in range(passes):
+        suffix = ' again' if n else ''
+        found['eager' + suffix] = run_blocking(cases)
+        found['lazy' + suffix] = run_blocking(cases, lazy = True)
+
+        async def run():
+            client = make_client()
+            try:
+                return await run_async(client, cases)
+            finally:
+                await client.aclose()
+        found['async' + suffix] = asyncio.run(run())
+    return found
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Check the optional components against the plain queries, and depicts_concepts against the recorded baseline.')
+    parser.add_argument('--fixture', default = FIXTURE, help = 'RDF file to serve (default: benchmarks/fixture.ttl)')
+    parser.add_argument('--baseline', default = BASELINE, help = 'depicts_concepts results to compare with (default: benchmarks/depicts_concepts_baseline.json)')
+    parser.add_argument('--component', action = 'append', choices = list(COMPONENTS), help = 'only this component (repeatable)')
+    parser.add_argument('-k', '--filter', help = 'only cases whose name contains this')
+    args = parser.parse_args(argv)
+
+    cases = [c for c in make_cases(CASES) if not args.filter or args.filter in c[0]]
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    server, url = serve(args.fixture)
+    plodlib.luna.LUNA_SEARCH_URL = url + '/luna'
+    plodlib.configure(endpoint = url + '/query')
+    plodlib.use_cache(False)
+    if httpx is not None:
+        make_client = lambda: AsyncSPARQLClient(url + '/query')
+    else:
+        make_client = lambda: ThreadedClient(LocalGraph(args.fixture))
+
+    # the methods print some diagnostics; keep them out of the report
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        expected = run_blocking(cases)
+        found = run_modes(cases, make_client, 1)
+        for component in args.component or COMPONENTS:
+            on, off = COMPONENTS[component]
+            on()
+            try:
+                for mode, results in run_modes(cases, make_client, 2 if component == 'cache' else 1).items():
+                    found[f'{component}, {mode}'] = results
+            finally:
+                off()
+
+        depicts = [(f'depicts_concepts {i}', i, lambda r: r.depicts_concepts()) for i in baseline]
+        recorded = {'plain': run_modes(depicts, make_client, 1)}
+        plodlib.use_location_table()
+        try:
+            recorded['location table'] = run_modes(depicts, make_client, 1)
+        finally:
+            plodlib.use_location_table(False)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        server.terminate()
+
+    failures = 0
+
+    def fail(case, mode, result, wanted):
+        nonlocal failures
+        failures += 1
+        print(f"FAIL {case} ({mode}): {result[:200]}, expected {wanted[:200]}")
+
+    for case, _, _ in cases:
+        wanted = outcome(expected[case])
+        for mode, results in found.items():
+            if outcome(results[case]) != wanted:
+                fail(case, mode, outcome(results[case]), wanted)
+
+    checked = 0
+    for component, modes in recorded.items():
+        for mode, results in modes.items():
+            for identifier, rows in baseline.items():
+                result = results[f'depicts_concepts {identifier}']
+                # the location table gives the same rows, in its own order
+                ordered = component != 'location table'
+                checked += 1
+                if outcome(result, ordered) != outcome(rows, ordered):
+                    fail(f'depicts_concepts {identifier}', f'{component}, {mode}, baseline', outcome(result, ordered), outcome(rows, ordered))
+
+    print(f"{len(cases)} cases x {len(found)} modes, {checked} depicts_concepts results against the baseline, {failures} failed")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# Startup benchmark: how long `import plodlib` takes, how long until the first
+# query methods have answered, and which heavyweight modules got imported on
+# the way. Each run is a fresh interpreter.
+#
+#     python benchmarks/import_time.py --save import-baseline.json
+#     ... change something ...
+#     python benchmarks/import_time.py --compare import-baseline.json
+#
+# The query case asks the fixture endpoint (served as in bench.py) for a
+# resource, its depicts_concepts() and spatial_children(); none of that
+# should need pandas, rdflib, numpy or scipy. --compare exits with status 1
+# if a case got more than --tolerance slower than the baseline, or if one of
+# those modules is imported where it wasn't before.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from bench import FIXTURE, serve
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# imported only by the methods that need them
+HEAVY = ('pandas', 'rdflib', 'numpy', 'scipy', 'httpx', 'asyncio')
+
+IMPORT = """
+import json, sys, time
+start = time.perf_counter()
+import plodlib
+elapsed = time.perf_counter() - start
+print(json.dumps({'ms': elapsed * 1000, 'heavy': [m for m in %r if m in sys.modules]}))
+""" % (HEAVY,)
+
+QUERY = """
+import json, sys, time
+start = time.perf_counter()
+import plodlib
+plodlib.configure(endpoint = sys.argv[1])
+r = plodlib.PLODResource('r1-i1-p1')
+r.depicts_concepts()
+r.spatial_children()
+elapsed = time.perf_counter() - start
+print(json.dumps({'ms': elapsed * 1000, 'heavy': [m for m in %r if m in sys.modules]}))
+""" % (HEAVY,)
+
+
+def run_child(code, *args):
+    # (milliseconds, heavy modules imported) reported by one fresh interpreter
+    env = dict(os.environ, PYTHONPATH = ROOT)
+    out = subprocess.run([sys.executable, '-c', code, *args], env = env, capture_output = True, text = True, check = True)
+    report = json.loads(out.stdout.strip().splitlines()[-1])
+    return report['ms'], report['heavy']
+
+
+def run_cli(*args):
+    # wall time of python -m plodlib, interpreter start included
+    env = dict(os.environ, PYTHONPATH = ROOT)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-m', 'plodlib', *args], env = env, capture_output = True, check = True)
+    return (time.perf_counter() - start) * 1000, None
+
+
+def measure(run, repeat):
+    run()   # warm up (bytecode caches)
+    times, heavy = [], []
+    for _ in range(repeat):
+        ms, imported = run()
+        times.append(ms)
+        heavy = imported
+    times.sort()
+    return {'median_ms': round(statistics.median(times), 1),
+            'min_ms': round(times[0], 1),
+            'heavy': heavy}
+
+
+def compare(results, baseline, tolerance):
+    # list of regression messages
+    problems = []
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if now['median_ms'] > before['median_ms'] * (1 + tolerance) and now['median_ms'] - before['median_ms'] > 20:
+            problems.append(f"{name}: median {before['median_ms']} -> {now['median_ms']} ms")
+        added = sorted(set(now['heavy'] or ()) - set(before['heavy'] or ()))
+        if added:
+            problems.append(f"{name}: now imports {', '.join(added)}")
+    return problems
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark how long plodlib takes to import and answer a first query.')
+    parser.add_argument('--fixture', default = FIXTURE, help = 'RDF file to serve (default: benchmarks/fixture.ttl)')
+    parser.add_argument('--repeat', type = int, default = 10, help = 'fresh interpreters per case')
+    parser.add_argument('--output', help = 'write the results to this JSON file')
+    parser.add_argument('--save', metavar = 'BASELINE', help = 'write the results as the new baseline')
+    parser.add_argument('--compare', metavar = 'BASELINE', help = 'compare with a saved baseline')
+    parser.add_argument('--tolerance', type = float, default = 0.25, help = 'allowed slowdown, as a fraction')
+    args = parser.parse_args(argv)
+
+    server, url = serve(args.fixture)
+    cases = [('import plodlib', lambda: run_child(IMPORT)),
+             ('first queries', lambda: run_child(QUERY, url + '/query')),
+             ('python -m plodlib', lambda: run_cli('-e', url + '/query', 'r1-i1-p1'))]
+    results = {}
+    try:
+        for case, run in cases:
+            results[case] = r = measure(run, args.repeat)
+            heavy = '' if r['heavy'] is None else f"  imports: {', '.join(r['heavy']) or 'none of ' + ', '.join(HEAVY)}"
+            print(f"{case:20} {r['median_ms']:9.1f} ms  (min {r['min_ms']:.1f}){heavy}")
+    finally:
+        server.terminate()
+
+    report = {'python': sys.version.split()[0], 'repeat': args.repeat, 'results': results}
+    for path in (args.output, args.save):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent = 1, sort_keys = True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline['results'], args.tolerance)
+        for p in problems:
+            print('REGRESSION', p)
+        if problems:
+            return 1
+        print(f"no regressions against {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,209 +3,222 @@
 
 from string import Template
 
+import importlib
 import json
-import pandas as pd
-import requests
-
-import rdflib as rdf
-# from rdflib.plugins.parsers import TurtleParser
-from rdflib.plugins.stores import sparqlstore
-
-
-def luna_tilde_val(luna_urn):
-  if luna_urn.startswith("urn:p-lod:id:luna_img_PALP"):
-    tilde_val = "14"
-
-  if luna_urn.startswith("urn:p-lod:id:luna_img_PPM"):
-    tilde_val = "16"
-
-  return tilde_val
-
-def add_luna_info(row):
-  
-  img_src = None #default if no URLs present (probably means LUNA doesn't have image though triplestore thinks it does)
-  img_description = None
-
-  if row['urn'].startswith("urn:p-lod:id:luna_img_PALP"):
-    tilde_val = "14"
-
-  if row['urn'].startswith("urn:p-lod:id:luna_img_PPM"):
-    tilde_val = "16"
-  
-  luna_json = json.loads(requests.get(f'https://umassamherst.lunaimaging.com/luna/servlet/as/fetchMediaSearch?mid=umass~{tilde_val}~{tilde_val}~{row["l_record"]}~{row["l_media"]}&fullData=true').text)
-  
-  if len(luna_json):
-
-    img_attributes = json.loads(luna_json[0]['attributes'])
-
-    if 'image_description_english' in img_attributes.keys():
-      img_description = img_attributes['image_description_english']
-    else:
-      try:
-        if   tilde_val == '14':
-          img_description = json.loads(luna_json[0]['fieldValues'])[2]['value']
-        elif tilde_val == '16':
-          img_description = json.loads(luna_json[0]['fieldValues'])[1]['value']
-        else:
-          img_description = f"unrecognized collection {tilde_val}"
-      except:
-        img_description = "Trying to get description failed"
-    
-
-    if 'urlSize4' in img_attributes.keys(): # use size 4, sure, but only if there's nothing else
-      img_src = img_attributes['urlSize4']
-    if 'urlSize2' in img_attributes.keys(): # preferred
-      img_src = img_attributes['urlSize2']
-    elif 'urlSize3' in img_attributes.keys():
-      img_src = img_attributes['urlSize3']
-    else:
-      img_src = img_attributes['urlSize1']
-
-  row['l_img_url'] = img_src
-  row['l_current_description'] = img_description
-
-  return row
+import sys
+
+# pandas, rdflib, numpy and scipy are imported where they are first needed,
+# not here: importing plodlib and running the query methods needs none of
+# them. See benchmarks/import_time.py.
+
+from . import instrument
+from .instrument import QueryStats, add_observer, log_events, observing, remove_observer
+from .client import SPARQLClient, LocalGraph, configure, get_client, set_client, use_local_graph
+from .cache import ResultCache, cached, get_cache, use_cache
+from .materialized import MaterializedStore, get_materialized_store, use_materialized
+from .hierarchy import HierarchyIndex, MAX_VALUES, get_hierarchy_index, use_hierarchy_index, values_clause
+from .decode import PAGE_SIZE, numeric_columns, paged_records, select_records
+from .steps import AddLunaInfo, Call, Query, Select, query_method
+from .luna import LunaMetadataStore, add_luna_info, add_luna_info_to_records, fetch_luna_info, get_luna_store, luna_mid, luna_tilde_val, use_luna_store
+from .spatial import SpatialIndex, get_spatial_index, use_spatial_index
+from .locations import LocationTable, get_location_table, use_location_table
+
+# name -> module it is imported from on first access, as plodlib.name
+_LAZY = {'DepictionMatrix': 'depictions', 'get_depiction_matrix': 'depictions', 'use_depiction_matrix': 'depictions',
+         'TripleIndex': 'tripleindex', 'build_triple_index': 'tripleindex', 'use_triple_index': 'tripleindex',
+         'AsyncPLODResource': 'aio', 'AsyncSPARQLClient': 'aio', 'ThreadedClient': 'aio', 'get_async_client': 'aio'}
+
+
+def __getattr__(name):
+  if name in _LAZY:
+    return getattr(importlib.import_module('.' + _LAZY[name], __name__), name)
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def hierarchy_pattern(variable, lookup, path):
+  # VALUES block answered from the hierarchy index when one is in use, otherwise the SPARQL property path.
+  # None when the index knows there is nothing to match, so the caller can skip the query.
+  index = get_hierarchy_index()
+  if index is not None:
+    found = lookup(index)
+    if not found:
+      return None
+    if len(found) <= MAX_VALUES:
+      return values_clause(variable, found)
+  return path
 
 
 # Define a class
 class PLODResource(object):
 
-    def __init__(self,identifier = 'pompeii'):
+    def __init__(self,identifier = 'pompeii', lazy = False):
 
         # could default to 'pompeii' along with its info?
         if identifier == None:
           self.identifier = None
           return
 
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
-        
+        # lazy: don't ask the triplestore until an attribute like label, rdf_type or
+        # identifier is read. identifier is loaded like the rest (None if the
+        # resource has no triples), so query methods see what they would eagerly.
+        if lazy:
+          self._lazy = True
+          self._identifier_parameter = identifier
+          return
+
+        self._fetch(identifier)
+
+    @staticmethod
+    def _fetch_query(identifier):
         qt = Template("""
 PREFIX p-lod: <urn:p-lod:id:>
 SELECT ?p ?o WHERE { p-lod:$identifier ?p ?o . }
 """)
+        return qt.substitute(identifier = identifier)
+
+    def _fetch(self, identifier):
+        with instrument.method_call('load', identifier) as call:
+          variables, rows = get_client().select(self._fetch_query(identifier))
+          self._load(identifier, call.returned(rows))
+
+    # set by _load, so fetched on first use in lazy mode
+    _loaded_attributes = frozenset(['identifier', 'rdf_type', 'label', 'broader', 'p_in_p_url', 'wikidata_url', 'best_images', '_po'])
+
+    def __getattr__(self, name):
+        # only reached for attributes that aren't set
+        if name in PLODResource._loaded_attributes and self.__dict__.get('_lazy'):
+          self._lazy = False
+          self._fetch(self._identifier_parameter)
+          return getattr(self, name)
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    @staticmethod
+    def _many_queries(identifiers, chunk_size):
+        # one ?s ?p ?o query per chunk_size distinct identifiers
+        qt = Template("""
+PREFIX p-lod: <urn:p-lod:id:>
+SELECT ?s ?p ?o WHERE { $values ?s ?p ?o . }
+""")
+        unique = sorted(set(i for i in identifiers if i is not None))
+        return [qt.substitute(values = values_clause('s', unique[start:start + chunk_size]))
+                for start in range(0, len(unique), chunk_size)]
+
+    @classmethod
+    def _from_many(cls, identifiers, results):
+        # resources for identifiers from the rows of every _many_queries query
+        rows = {}
+        for s, p, o in results:
+          rows.setdefault(s, []).append((p, o))
+
+        resources = []
+        for identifier in identifiers:
+          r = cls.__new__(cls)
+          if identifier == None:
+            r.identifier = None
+          else:
+            r._load(identifier, rows.get(f'urn:p-lod:id:{identifier}', []))
+          resources.append(r)
+        return resources
+
+    @classmethod
+    def many(cls, identifiers, chunk_size = 200):
+        # PLODResource for each identifier, fetched with one query per chunk_size
+        # identifiers instead of one query each. Same order as identifiers.
+        identifiers = list(identifiers)
+        results = []
+        with instrument.method_call('many', None) as call:
+          for query_str in cls._many_queries(identifiers, chunk_size):
+            variables, rows = get_client().select(query_str)
+            results.extend(rows)
+          return call.returned(cls._from_many(identifiers, results))
+
+    def _load(self, identifier, po):
+        # set attributes from the (predicate, object) string pairs about identifier.
+        # Kept as a tuple of pairs; _id_df and the html table are built from it on demand.
+        self._po = tuple((p, o) for p, o in po)
+
+        def values(predicate):
+          return [o for p, o in self._po if p == predicate]
+
+        def value(predicate):
+          # one value as is, several as a list, None if there are none
+          found = values(predicate)
+          if len(found) == 0:
+            return None
+          return found[0] if len(found) == 1 else found
 
-        results = g.query(qt.substitute(identifier = identifier))
-        id_df = pd.DataFrame(results, columns = results.json['head']['vars'])
-        id_df = id_df.map(str)
-        id_df.set_index('p', inplace = True)
-    
         # type and label first
 
         self.rdf_type = None
-        try:
-          rdf_type = id_df.loc['http://www.w3.org/1999/02/22-rdf-syntax-ns#type','o']
-          if type(rdf_type) == pd.Series:
-            rdf_type = list(rdf_type.replace('urn:p-lod:id:','', regex = True))
-          else:
-            rdf_type = rdf_type.replace('urn:p-lod:id:','')
-          self.rdf_type = rdf_type
-
-        except:
-           pass
+        rdf_type = value('http://www.w3.org/1999/02/22-rdf-syntax-ns#type')
+        if isinstance(rdf_type, list):
+          self.rdf_type = [t.replace('urn:p-lod:id:','') for t in rdf_type]
+        elif rdf_type is not None:
+          self.rdf_type = rdf_type.replace('urn:p-lod:id:','')
 
-        self.label = None
-        try:
-           self.label = id_df.loc['http://www.w3.org/2000/01/rdf-schema#label','o']
-        except:
-           pass
-        
-        
-        self.broader = None
-        try:
-           self.broader = id_df.loc['urn:p-lod:id:broader','o']
-        except:
-           pass
+        self.label = value('http://www.w3.org/2000/01/rdf-schema#label')
+        self.broader = value('urn:p-lod:id:broader')
+        self.p_in_p_url = value('urn:p-lod:id:p-in-p-url')
+        self.wikidata_url = value('urn:p-lod:id:wikidata-url')
 
-        self.p_in_p_url = None
-        try:
-           self.p_in_p_url = id_df.loc['urn:p-lod:id:p-in-p-url','o']
-        except:
-           pass
-        
-        self.wikidata_url = None
-        try:
-          self.wikidata_url = id_df.loc['urn:p-lod:id:wikidata-url','o']
-        except:
-          pass
-        
         # set identifier if it exists. None otherwise. Preserve identifier as passed
         self._identifier_parameter = identifier
-        if len(id_df.index) > 0:
+        if len(self._po) > 0:
           self.identifier = identifier
         else:
           self.identifier = None
 
-        # extras
-        # if with_extras:
-        self._sparql_results_as_html_table = id_df.to_html()
-        self._id_df = id_df
+        best_images = values('urn:p-lod:id:best-image')
+        if best_images:
+          self.best_images = [b.replace('urn:p-lod:id:','') for b in best_images]
 
-        best_images = None
-        try:
-            best_images = id_df.loc['urn:p-lod:id:best-image','o']
-            if type(best_images) == pd.Series:
-              best_images = list(best_images.replace('urn:p-lod:id:','', regex = True))
-            else:
-              best_images = [best_images.replace('urn:p-lod:id:','')]
-            self.best_images = best_images
-        except:
-            pass
-        del(best_images)
-        
-    def conceptual_ancestors(self):
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
+    @property
+    def _id_df(self):
+        # the ?p ?o rows as a DataFrame indexed by predicate
+        import pandas as pd
+        return pd.DataFrame(list(self._po), columns = ['p', 'o']).set_index('p')
+
+    @property
+    def _sparql_results_as_html_table(self):
+        return self._id_df.to_html()
 
+    @cached
+    @query_method
+    def conceptual_ancestors(self):
         identifier = self.identifier
+        ancestors = hierarchy_pattern('urn', lambda index: index.ancestors(identifier, 'broader', include_self = True),
+                                      f"p-lod:{identifier} p-lod:broader* ?urn .")
 
         qt = Template("""
 PREFIX p-lod: <urn:p-lod:id:>
 SELECT DISTINCT ?urn ?label WHERE { 
-  p-lod:$identifier p-lod:broader* ?urn .
+  $ancestors
     ?urn a p-lod:concept  .
     OPTIONAL { ?urn <http://www.w3.org/2000/01/rdf-schema#label> ?label }
     }""")
-        results = g.query(qt.substitute(identifier = identifier))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-        
-        return json.loads(df.to_json(orient='records'))
+        return (yield Select(qt.substitute(ancestors = ancestors)))
 
+    @cached
+    @query_method
     def conceptual_descendants(self):
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
-
         identifier = self.identifier
+        descendants = hierarchy_pattern('urn', lambda index: index.descendants(identifier, 'broader'),
+                                        f"?urn p-lod:broader+  p-lod:{identifier}.")
+        if descendants is None:
+          return []
 
         qt = Template("""
 PREFIX p-lod: <urn:p-lod:id:>
 SELECT DISTINCT ?urn ?label WHERE {
-       ?urn p-lod:broader+  p-lod:$identifier.
+       $descendants
               
       OPTIONAL { ?urn <http://www.w3.org/2000/01/rdf-schema#label> ?label }
                       }""")
-        results = g.query(qt.substitute(identifier = identifier))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-        df = df.map(str)
-    
-        return json.loads(df.to_json(orient="records"))
+        return (yield Select(qt.substitute(descendants = descendants), as_str = True))
 
+    @cached
+    @query_method
     def conceptual_children(self):
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
-
         identifier = self.identifier
 
         qt = Template("""
@@ -214,21 +227,18 @@ SELECT DISTINCT ?urn ?label WHERE {
       ?urn p-lod:broader p-lod:$identifier .
       OPTIONAL { ?urn <http://www.w3.org/2000/01/rdf-schema#label> ?label }
                       }""")
-        results = g.query(qt.substitute(identifier = identifier))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-        df = df.map(str)
-    
-        return json.loads(df.to_json(orient="records"))
+        return (yield Select(qt.substitute(identifier = identifier), as_str = True))
 
     
+    @cached
+    @query_method
     def gather_images(self):
       # return format is urn (of image), depicts_urn, depicts_type, depicts_label, is_best_image, l_record, l_media, l_batch, l_description, geojson
-      if self.rdf_type == 'concept':
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
+      table = get_location_table()
+      if table is not None and self.rdf_type in ['concept', 'space', 'property', 'insula', 'region', 'feature']:
+        return table.gather_images(self.identifier, self.rdf_type)
 
+      if self.rdf_type == 'concept':
         identifier = self.identifier
 
         qt = Template("""
@@ -258,16 +268,9 @@ SELECT DISTINCT ?urn ?label ?best_image ?l_record ?l_media ?l_batch ?l_descripti
 
 } ORDER BY DESC(?best_image)""")
 
-        results = g.query(qt.substitute(identifier = identifier))
-        df = pd.DataFrame(results, columns = results.json['head']['vars']).map(str)
-        return json.loads(df.to_json(orient='records'))
+        return (yield Select(qt.substitute(identifier = identifier), as_str = True))
 
       elif self.rdf_type in ['space','property','insula','region']:
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
-
         identifier = self.identifier
 
         qt = Template("""
@@ -302,16 +305,9 @@ OPTIONAL { ?urn <http://www.w3.org/2000/01/rdf-schema#label> ?label}
 
 }""")
         
-        results = g.query(qt.substitute(identifier = identifier))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-        return json.loads(df.to_json(orient='records'))
+        return (yield Select(qt.substitute(identifier = identifier)))
 
       elif self.rdf_type in ['feature']:
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
-
         identifier = self.identifier
 
         qt = Template("""
@@ -342,27 +338,19 @@ UNION
 OPTIONAL { ?urn <http://www.w3.org/2000/01/rdf-schema#label> ?label}
 }""")
         
-        results = g.query(qt.substitute(identifier = identifier))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-        #return df.apply(add_luna_info, axis = 1).to_json(orient='records')
-        return json.loads(df.to_json(orient='records'))
+        #return (yield AddLunaInfo((yield Select(qt.substitute(identifier = identifier)))))
+        return (yield Select(qt.substitute(identifier = identifier)))
       else:
-        luna_df =  pd.DataFrame(json.loads(self.images_from_luna))
-        if len(luna_df):
-          return json.loads(luna_df.to_json(orient = 'records'))
-        else:
-          return []
+        return (yield Call(self, 'images_from_luna'))
       
 
     @property
+    @cached
+    @query_method
     def geojson(self):
       try:
         # if the there is geojson, use it
-        my_geojson = self._id_df.loc['urn:p-lod:id:geojson','o']
-        if isinstance(my_geojson, pd.Series):
-            my_geojson = json.loads(my_geojson[0])
-        else:
-            my_geojson = json.loads(my_geojson)
+        my_geojson = json.loads([o for p, o in self._po if p == 'urn:p-lod:id:geojson'][0])
 
       except:
         # if no geojson, try and find some. this may well develop over time
@@ -370,7 +358,7 @@ OPTIONAL { ?urn <http://www.w3.org/2000/01/rdf-schema#label> ?label}
               
         try:
           if self.rdf_type == 'pompeian-wall-painting-style':
-            as_object_list = self.as_object(add_predicate = 'geojson' , set_predicate = 'has-pompeian-wall-painting-style')
+            as_object_list = (yield Call(self, 'as_object', add_predicate = 'geojson' , set_predicate = 'has-pompeian-wall-painting-style'))
             geojson_list = [d["added"] for d in as_object_list]
             if len(geojson_list):
               my_geojson_d = {"type": "FeatureCollection", "features":[]}
@@ -386,7 +374,7 @@ OPTIONAL { ?urn <http://www.w3.org/2000/01/rdf-schema#label> ?label}
                 print("Failed to parse geojson")
 
           elif self.rdf_type == 'space-characterization':
-            as_object_list = self.as_object(add_predicate = 'geojson' , set_predicate = 'has-space-characterization')
+            as_object_list = (yield Call(self, 'as_object', add_predicate = 'geojson' , set_predicate = 'has-space-characterization'))
             geojson_list = [d["added"] for d in as_object_list]
             if len(geojson_list):
               my_geojson_d = {"type": "FeatureCollection", "features":[]}
@@ -404,7 +392,7 @@ OPTIONAL { ?urn <http://www.w3.org/2000/01/rdf-schema#label> ?label}
 
           # note that depicted_where will return an empty list so check length after calling
           else:
-            dw_d = self.depicted_where(level_of_detail='space')
+            dw_d = yield Call(self, 'depicted_where', level_of_detail='space')
             if len(dw_d):
                 my_geojson_d = {"type": "FeatureCollection", "features":[]}
                 for g in dw_d:
@@ -422,41 +410,33 @@ OPTIONAL { ?urn <http://www.w3.org/2000/01/rdf-schema#label> ?label}
       return my_geojson
     
 
-    def as_predicate(self):
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
+    def _as_predicate_query(self):
+        qt = Template("""
+        PREFIX p-lod: <urn:p-lod:id:>
+        SELECT ?subject ?object WHERE 
+        { ?subject p-lod:$identifier ?object . }""")
+        return qt.substitute(identifier = self.identifier)
 
+    @cached
+    @query_method
+    def as_predicate(self):
+        # at most 15000 rows; iter_as_predicate() gives them all
         identifier = self.identifier
         if identifier == None:
             return []
-        
-        qt = Template("""
-        PREFIX p-lod: <urn:p-lod:id:>
-        SELECT ?subject ?object WHERE 
-        { ?subject p-lod:$identifier ?object . }
-        ORDER BY ?subject ?object LIMIT 15000""")
                       
-        results = g.query(qt.substitute(identifier = identifier))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-        return json.loads(df.to_json(orient='records'))
+        return (yield Select(self._as_predicate_query() + """
+        ORDER BY ?subject ?object LIMIT 15000"""))
 
-    def as_object(self, set_predicate = None ,
-                  add_predicate = None,
-                  broader = False ):
-        
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
+    def iter_as_predicate(self, page_size = PAGE_SIZE):
+        # every as_predicate row, queried page_size rows at a time
+        if self.identifier == None:
+            return
+        yield from paged_records(self._as_predicate_query(), '?subject ?object', page_size)
 
+    def _as_object_query(self, set_predicate, add_predicate, broader):
         identifier = self.identifier
-        if identifier == None:
-            return []
-        
+
         set_predicate_str = '?predicate'
         if set_predicate:
            set_predicate_str = f'p-lod:{set_predicate}'
@@ -486,35 +466,50 @@ OPTIONAL { ?urn <http://www.w3.org/2000/01/rdf-schema#label> ?label}
                       
           $add_predicate_str 
 
-          }
-        ORDER BY ?subject ?predicate LIMIT 15000""")
-
-        
-        query_str = qt.substitute(identifier = identifier,
-                                  broader_union_str = broader_union_str,
-                                  set_predicate_str = set_predicate_str ,
-                                  add_predicate_str = add_predicate_str )
+          }""")
 
-        print(query_str)
+        return qt.substitute(identifier = identifier,
+                             broader_union_str = broader_union_str,
+                             set_predicate_str = set_predicate_str ,
+                             add_predicate_str = add_predicate_str )
 
-        results = g.query(query_str)
+    @cached
+    @query_method
+    def as_object(self, set_predicate = None ,
+                  add_predicate = None,
+                  broader = False ):
+        # at most 15000 rows; iter_as_object() gives them all
+        identifier = self.identifier
+        if identifier == None:
+            return []
+        
+        query_str = self._as_object_query(set_predicate, add_predicate, broader) + """
+        ORDER BY ?subject ?predicate LIMIT 15000"""
 
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
+        records = yield Select(query_str)
         if add_predicate == None:
-           df = df.drop('added', axis=1)
-        return json.loads(df.to_json(orient='records'))
+           for r in records:
+             del r['added']
+        return records
+
+    def iter_as_object(self, set_predicate = None, add_predicate = None, broader = False, page_size = PAGE_SIZE):
+        # every as_object row, queried page_size rows at a time
+        if self.identifier == None:
+            return
+        query_str = self._as_object_query(set_predicate, add_predicate, broader)
+        for r in paged_records(query_str, '?subject ?predicate ?added', page_size):
+          if add_predicate == None:
+            del r['added']
+          yield r
 
     ## get_predicate_values ##
+    @cached
+    @query_method
     def get_predicate_values(self,predicate = 'urn:p-lod:id:label'):
         # predicate should be a fully qualified url or urn as a string.
         # returns json array of keyed dictionaries.
 
 
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
 
         identifier = self.identifier
         if identifier == None:
@@ -525,20 +520,21 @@ PREFIX p-lod: <urn:p-lod:id:>
 SELECT ?values WHERE { p-lod:$identifier <$predicate> ?values . }
 """)
 
-        results = g.query(qt.substitute(identifier = identifier, predicate = predicate))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-        return json.loads(df['values'].to_json(orient = 'records'))
+        records = yield Select(qt.substitute(identifier = identifier, predicate = predicate))
+        return [r['values'] for r in records]
 
 
     ## depicts_concepts ##
+    @cached
+    @query_method
     def depicts_concepts(self):
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
-
         identifier = self.identifier
+        table = get_location_table()
+        if table is not None and identifier is not None:
+            return table.depicts_concepts(identifier)
+
+        components = hierarchy_pattern('component', lambda index: index.contents(identifier),
+                                       "?identifier ^p-lod:spatially-within*/^p-lod:created-on-surface-of*/^p-lod:is-part-of* ?component .")
 
         qt = Template("""
 PREFIX p-lod: <urn:p-lod:id:>
@@ -547,7 +543,7 @@ SELECT ?urn ?label (COUNT(*) AS ?count) (GROUP_CONCAT(?within_depicts ; separato
 
   BIND ( p-lod:$identifier AS ?identifier )
 
-  ?identifier ^p-lod:spatially-within*/^p-lod:created-on-surface-of*/^p-lod:is-part-of* ?component .
+  $components
   ?component a p-lod:artwork-component .
   ?component p-lod:depicts ?urn .
 
@@ -575,22 +571,18 @@ SELECT ?urn ?label (COUNT(*) AS ?count) (GROUP_CONCAT(?within_depicts ; separato
 
 } GROUP BY ?urn ?label ORDER BY ?urn""")
 
-        results = g.query(qt.substitute(identifier = identifier))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-        for c in df.columns:
-          df[c] = pd.to_numeric(df[c], errors='ignore')
-        return json.loads(df.to_json(orient = 'records'))
+        return numeric_columns((yield Select(qt.substitute(identifier = identifier, components = components))))
 
 
     ## depicted_where ##
+    @cached
+    @query_method
     def depicted_where(self, level_of_detail = 'feature'):
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
-
         identifier = self.identifier
+        table = get_location_table()
+        if table is not None and identifier is not None:
+            return table.depicted_where(identifier, level_of_detail)
+
 
         qt = Template("""
 PREFIX p-lod: <urn:p-lod:id:>
@@ -623,36 +615,25 @@ SELECT DISTINCT ?urn ?type ?label ?within ?best_image ?l_record ?l_media ?l_batc
 } ORDER BY ?within""")
 
        # identifier = what you're looking for, level_of_detail = spatial resolution at which to list results 
-        results = g.query(qt.substitute(identifier = identifier, level_of_detail = level_of_detail))
-
-        
-
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-        df = df.map(str)
-        return json.loads(df.to_json(orient='records'))
+        return (yield Select(qt.substitute(identifier = identifier, level_of_detail = level_of_detail), as_str = True))
 
+    @cached
+    @query_method
     def rdf_describe(self):
         identifier = self.identifier
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False)
-        g = rdf.Graph(store)
 
         q = f"""
 PREFIX p-lod: <urn:p-lod:id:>
 DESCRIBE p-lod:{identifier}"""
         
-        results = g.query(q)
+        results = yield Query(q)
         results = results.serialize(format='turtle').decode('utf-8')
         return results
 
+    @cached
+    @query_method
     def see_also(self):
       identifier = self.identifier
-      # Connect to the remote triplestore with read-only connection
-      store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                          context_aware = False)
-      
-      g = rdf.Graph(store)
 
       qt = Template("""
 PREFIX owl: <http://www.w3.org/2002/07/owl#>
@@ -671,21 +652,30 @@ WHERE { BIND(p-lod:$identifier AS ?s )
 }
       """)
   
-      results = g.query(qt.substitute(identifier = identifier))
+      results = yield Query(qt.substitute(identifier = identifier))
       results = results.serialize(format='turtle').decode('utf-8')
       return results
 
    ## spatial_ancestors ##
+    @cached
+    @query_method
     def spatial_ancestors(self):
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
-
         identifier = self.identifier
 
-        qt = Template("""
+        # an unknown resource (None) is left to the query, whose zero-length
+        # paths still report p-lod:None itself
+        enclosing = identifier is not None and hierarchy_pattern('urn', lambda index: index.enclosing(identifier), None)
+        if enclosing:
+          qt = Template("""
+PREFIX p-lod: <urn:p-lod:id:>
+SELECT DISTINCT ?urn ?type ?label ?geojson WHERE { 
+    $enclosing
+    OPTIONAL { ?urn a ?type }
+    OPTIONAL { ?urn p-lod:geojson ?geojson }
+    OPTIONAL { ?urn <http://www.w3.org/2000/01/rdf-schema#label> ?label }
+  }""")
+        else:
+          qt = Template("""
 PREFIX p-lod: <urn:p-lod:id:>
 SELECT DISTINCT ?urn ?type ?label ?geojson WHERE { 
   { p-lod:$identifier p-lod:is-part-of*/p-lod:created-on-surface-of* ?feature .
@@ -703,20 +693,13 @@ SELECT DISTINCT ?urn ?type ?label ?geojson WHERE {
     }
   }""")
 
-        results = g.query(qt.substitute(identifier = identifier))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-        
-        return json.loads(df.to_json(orient='records'))
+        return (yield Select(qt.substitute(identifier = identifier, enclosing = enclosing)))
 
 
 ## spatial_children ##
+    @cached
+    @query_method
     def spatial_children(self, rdf_type: str = 'all', exclude_rdf_type: str = ''):
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
-
         identifier = self.identifier
         if rdf_type == 'all':
             rdf_type = ''
@@ -736,21 +719,13 @@ SELECT DISTINCT ?urn ?type ?label ?geojson WHERE {
       OPTIONAL { ?urn <http://www.w3.org/2000/01/rdf-schema#label> ?label }
       OPTIONAL { ?urn p-lod:geojson ?geojson }
                       }""")
-        results = g.query(qt.substitute(identifier = identifier, rdf_type = rdf_type, exclude_rdf_type = exclude_rdf_type))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-        df = df.map(str)
-    
-        return json.loads(df.to_json(orient="records"))
+        return (yield Select(qt.substitute(identifier = identifier, rdf_type = rdf_type, exclude_rdf_type = exclude_rdf_type), as_str = True))
 
 ## spatially_within
     @property
+    @cached
+    @query_method
     def spatially_within(self):
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
-
         identifier = self.identifier
 
         qt = Template("""
@@ -764,20 +739,14 @@ SELECT DISTINCT ?urn ?type ?label ?geojson WHERE {
         ?urn p-lod:geojson ?geojson .
         
       } LIMIT 1""")
-        results = g.query(qt.substitute(identifier = identifier))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-        return json.loads(df.to_json(orient="records"))
+        return (yield Select(qt.substitute(identifier = identifier)))
      
 
 ## in_region ##
     @property
+    @cached
+    @query_method
     def in_region(self):
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
-
         identifier = self.identifier
 
         qt = Template("""
@@ -792,20 +761,13 @@ SELECT DISTINCT ?urn ?type ?label ?geojson WHERE {
         ?urn p-lod:geojson ?geojson .
         
       } LIMIT 1""")
-        results = g.query(qt.substitute(identifier = identifier))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-
-        return json.loads(df.to_json(orient="records"))
+        return (yield Select(qt.substitute(identifier = identifier)))
 
 
 ## instances_of ##
+    @cached
+    @query_method
     def instances_of(self):
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
-
         identifier = self.identifier
 
         qt = Template("""
@@ -822,47 +784,36 @@ SELECT ?urn ?type ?label ?geojson (COUNT(?urn) AS ?depiction_count) WHERE
     OPTIONAL { ?component p-lod:depicts ?urn ;
                a p-lod:artwork-component . }
  } GROUP BY ?urn ?type ?label ?geojson ORDER BY ?urn""")
-        results = g.query(qt.substitute(identifier = identifier))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-    
-        return json.loads(df.to_json(orient="records"))
+        return (yield Select(qt.substitute(identifier = identifier)))
 
 
 ## used_as_predicate_by ##
+    @cached
+    @query_method
     def used_as_predicate_by(self):
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
-
         identifier = self.identifier
 
         qt = Template("""
 PREFIX p-lod: <urn:p-lod:id:>
 SELECT DISTINCT ?subject ?object WHERE { ?subject p-lod:$identifier ?object}""")
-        results = g.query(qt.substitute(identifier = identifier))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-        df = df.map(str)
-    
-        return json.loads(df.to_json(orient="records"))
+        return (yield Select(qt.substitute(identifier = identifier), as_str = True))
 
 
 ## narrower ##
     @property
+    @cached
+    @query_method
     def narrower(self):
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
-
         identifier = self.identifier
+        descendants = hierarchy_pattern('urn', lambda index: index.descendants(identifier, 'broader'),
+                                        f"?urn p-lod:broader+ p-lod:{identifier} .")
+        if descendants is None:
+          return []
 
         qt = Template("""
 PREFIX p-lod: <urn:p-lod:id:>
 SELECT DISTINCT ?urn ?label ?is_depicted WHERE {
-    ?urn p-lod:broader+ p-lod:$identifier .
+    $descendants
     ?urn rdfs:label ?label .
 
      OPTIONAL { ?anything p-lod:depicts ?urn }
@@ -871,23 +822,14 @@ SELECT DISTINCT ?urn ?label ?is_depicted WHERE {
 
 """)
         
-        results = g.query(qt.substitute(identifier = identifier))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-        df = df.map(str)
-    
-        return json.loads(df.to_json(orient="records"))
+        return (yield Select(qt.substitute(descendants = descendants), as_str = True))
 
 
 ## images_from_luna ##
     @property
+    @cached
+    @query_method
     def images_from_luna(self):
-
-        # Connect to the remote triplestore with read-only connection
-        store = rdf.plugins.stores.sparqlstore.SPARQLStore(query_endpoint = "http://52.170.134.25:3030/plod_endpoint/query",
-                                           context_aware = False,
-                                           returnFormat = 'json')
-        g = rdf.Graph(store)
-
         identifier = self.identifier
 
         qt = Template("""
@@ -907,24 +849,30 @@ SELECT DISTINCT ?urn ?label ?is_depicted WHERE {
         ?urn p-lod:x-luna-batch-id ?l_batch .
         ?urn p-lod:x-luna-description ?l_description .
          }""")
-        results = g.query(qt.substitute(identifier = identifier))
-        df = pd.DataFrame(results, columns = results.json['head']['vars'])
-
-        return json.loads(df.apply(add_luna_info, axis = 1).to_json(orient='records'))
+        return (yield AddLunaInfo((yield Select(qt.substitute(identifier = identifier)))))
 
     def compare_depicts(self,right):
-      left_depicts_json = json.loads(self.depicts_concepts())
+      # answered from the depiction matrix when one is in use and holds both
+      # (depictions is only imported, with numpy, once use_depiction_matrix() has been)
+      depictions = sys.modules.get(__name__ + '.depictions')
+      matrix = depictions.get_depiction_matrix() if depictions is not None else None
+      if matrix is not None:
+        try:
+          return matrix.compare(self.identifier, right)
+        except KeyError:
+          pass
+
+      left_depicts_json = self.depicts_concepts()
 
       right_depicts_r = PLODResource(right)
-      right_depicts_json = json.loads(right_depicts_r.depicts_concepts())
+      right_depicts_json = right_depicts_r.depicts_concepts()
 
-      left_depicts_df = pd.DataFrame(left_depicts_json)
-      right_depicts_df = pd.DataFrame(right_depicts_json)
+      left_urns = set(r['urn'] for r in left_depicts_json)
+      right_urns = set(r['urn'] for r in right_depicts_json)
 
-      
-      difference_left = set(left_depicts_df['urn']).difference(set(right_depicts_df['urn']))
-      intersection = set(left_depicts_df['urn']).intersection(set(right_depicts_df['urn']))
-      difference_right = set(right_depicts_df['urn']).difference(set(left_depicts_df['urn']))
+      difference_left = left_urns.difference(right_urns)
+      intersection = left_urns.intersection(right_urns)
+      difference_right = right_urns.difference(left_urns)
 
 
       return { "left_urn": f"urn:p-lod:id:{self.identifier}",
@@ -934,17 +882,26 @@ SELECT DISTINCT ?urn ?label ?is_depicted WHERE {
                           "right_urn": f"urn:p-lod:id:{right_depicts_r.identifier}"}
 
     def compare_depicted(self, right, level_of_detail = 'space'):
+      # answered from the depiction matrix too, as for compare_depicts
+      depictions = sys.modules.get(__name__ + '.depictions')
+      matrix = depictions.get_depiction_matrix() if depictions is not None else None
+      if matrix is not None:
+        try:
+          return matrix.compare_depicted(self.identifier, right, level_of_detail)
+        except KeyError:
+          pass
+
       left_depicted = self.depicted_where(level_of_detail)
 
       right_depicted_r = PLODResource(right)
       right_depicted = right_depicted_r.depicted_where(level_of_detail)
 
-      left_depicted_df = pd.DataFrame(left_depicted)
-      right_depicted_df = pd.DataFrame(right_depicted)
+      left_urns = set(r['urn'] for r in left_depicted)
+      right_urns = set(r['urn'] for r in right_depicted)
 
-      difference_left = set(left_depicted_df['urn']).difference(set(right_depicted_df['urn']))
-      intersection = set(left_depicted_df['urn']).intersection(set(right_depicted_df['urn']))
-      difference_right = set(right_depicted_df['urn']).difference(set(left_depicted_df['urn']))
+      difference_left = left_urns.difference(right_urns)
+      intersection = left_urns.intersection(right_urns)
+      difference_right = right_urns.difference(left_urns)
 
       return { "left_urn": f"urn:p-lod:id:{self.identifier}",
                           "difference_left": list(difference_left),
@@ -960,4 +917,4 @@ SELECT DISTINCT ?urn ?label ?is_depicted WHERE {
     def __str__(self):
         return self.label
 
-    
\ No newline at end of file
+    
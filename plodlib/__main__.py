@@ -1,14 +1,37 @@
 ## for command line ###
-from . import PLODResource
+from . import PLODResource, configure, use_local_graph
+from .batch import DEFAULT_WORKERS, print_summary, run_batch
 if __name__ == "__main__":
     import argparse
+    import sys
     parser = argparse.ArgumentParser(description='Interact with the P-LOD triplestore.')
     parser.add_argument('-m', '--method')
-    parser.add_argument('arg_r')
+    parser.add_argument('-e', '--endpoint', help='SPARQL query endpoint (default: $PLOD_ENDPOINT or the P-LOD Fuseki server)')
+    parser.add_argument('--timeout', type=float, help='per-query timeout in seconds')
+    parser.add_argument('-l', '--local', action='append', metavar='FILE', help='answer queries from a local RDF dump instead of the endpoint (repeatable)')
+    parser.add_argument('-b', '--batch', metavar='FILE', help="run the calls listed in FILE ('-' for stdin), one JSON line per result; see plodlib/batch.py")
+    parser.add_argument('-w', '--workers', type=int, help=f'calls run at once in --batch mode (default {DEFAULT_WORKERS})')
+    parser.add_argument('arg_r', nargs='?')
 
     args = parser.parse_args()
+    if not args.batch and not args.arg_r:
+        parser.error('an identifier or --batch is required')
 
-    r = PLODResource(args.arg_r)
+    if args.local:
+        use_local_graph(*args.local)
+    elif args.endpoint or args.timeout or args.batch:
+        # a connection per worker
+        configure(endpoint = args.endpoint, timeout = args.timeout,
+                  pool_size = (args.workers or DEFAULT_WORKERS) if args.batch else None)
+
+    if args.batch:
+        lines = sys.stdin if args.batch == '-' else open(args.batch)
+        with lines:
+            summary = run_batch(lines, workers = args.workers or DEFAULT_WORKERS, default_method = args.method)
+        print_summary(summary)
+        sys.exit(1 if summary['failed'] else 0)
+
+    r = PLODResource(args.arg_r, lazy = True)
 
     if args.method:
         method = args.method
@@ -0,0 +1,304 @@
+# asyncio interface to P-LOD.
+#
+#     r = await AsyncPLODResource.create('pompeii')
+#     children, concepts = await asyncio.gather(r.spatial_children(), r.depicts_concepts())
+#     geojson = await r.geojson
+#
+# AsyncPLODResource has every PLODResource query method, as a coroutine. The
+# methods run the same generator bodies as the blocking ones (see steps.py),
+# so they send the same queries and return the same results, and the result
+# cache applies to both.
+#
+# Queries go to an AsyncSPARQLClient, which uses httpx when it is installed
+# (pip install plodlib[async]) and otherwise runs the blocking SPARQLClient in
+# threads. Either way at most `concurrency` queries are in flight per client.
+# A LocalGraph backend is queried in threads the same way.
+
+import asyncio
+import sys
+import weakref
+
+from .client import (DEFAULT_ENDPOINT, DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT, MAX_GET_LENGTH, PREFIXES,
+                     ACCEPT, SELECT_ACCEPT, SPARQLClient, copy_select, get_client, parse_result, parse_select)
+from . import PLODResource, instrument
+from .cache import cached
+from .decode import PAGE_SIZE, page_query, records
+from .singleflight import AsyncSingleFlight
+from .steps import arun_steps
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class AsyncSPARQLClient(object):
+
+    def __init__(self, endpoint = DEFAULT_ENDPOINT, concurrency = DEFAULT_POOL_SIZE, timeout = DEFAULT_TIMEOUT, single_flight = True):
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # as for SPARQLClient: a query already in flight is awaited, not sent again
+        self.single_flight = single_flight
+        self._selects = AsyncSingleFlight(copy = copy_select)
+        self._queries = AsyncSingleFlight()
+
+        if httpx is not None:
+            self._http = httpx.AsyncClient(headers = {'Accept': ACCEPT}, timeout = timeout,
+                                           limits = httpx.Limits(max_connections = concurrency,
+                                                                 max_keepalive_connections = concurrency))
+            self._sync = None
+        else:
+            self._http = None
+            self._sync = SPARQLClient(endpoint, pool_size = concurrency, timeout = timeout, single_flight = False)
+
+    async def _send(self, query_str, timeout, accept):
+        # response body and content type
+        if timeout is None:
+            timeout = self.timeout
+        query_str = PREFIXES + query_str
+        headers = {'Accept': accept}
+        if len(query_str) > MAX_GET_LENGTH:
+            response = await self._http.post(self.endpoint, data = {'query': query_str}, timeout = timeout, headers = headers)
+        else:
+            response = await self._http.get(self.endpoint, params = {'query': query_str}, timeout = timeout, headers = headers)
+        response.raise_for_status()
+        return response.content, response.headers.get('Content-Type')
+
+    async def query(self, query_str, timeout = None):
+        if self.single_flight:
+            return await self._queries.do(query_str, self._query, query_str, timeout)
+        return await self._query(query_str, timeout)
+
+    async def select(self, query_str, timeout = None):
+        if self.single_flight:
+            return await self._selects.do(query_str, self._select, query_str, timeout)
+        return await self._select(query_str, timeout)
+
+    async def _query(self, query_str, timeout):
+        async with self._semaphore:
+            if self._http is None:
+                return await asyncio.to_thread(self._sync.query, query_str, timeout)
+            with instrument.request('sparql', self.endpoint, query_str) as timing:
+                content, content_type = await self._send(query_str, timeout, ACCEPT)
+                timing.fetched(len(content))
+                result = parse_result(content, content_type)
+                timing.decoded(len(result))
+        return result
+
+    async def _select(self, query_str, timeout):
+        async with self._semaphore:
+            if self._http is None:
+                return await asyncio.to_thread(self._sync.select, query_str, timeout)
+            with instrument.request('sparql', self.endpoint, query_str) as timing:
+                content, content_type = await self._send(query_str, timeout, SELECT_ACCEPT)
+                timing.fetched(len(content))
+                variables, rows = parse_select(content)
+                timing.decoded(len(rows))
+        return variables, rows
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+        else:
+            self._sync.close()
+
+    def __repr__(self):
+        transport = 'httpx' if self._http is not None else 'threads'
+        return f"AsyncSPARQLClient({self.endpoint!r}, concurrency={self.concurrency}, timeout={self.timeout}, single_flight={self.single_flight}, {transport})"
+
+
+class ThreadedClient(object):
+    # any blocking client (e.g. a LocalGraph) behind the async interface,
+    # each query run in a thread, at most concurrency at once
+
+    def __init__(self, client, concurrency = DEFAULT_POOL_SIZE, single_flight = True):
+        self.client = client
+        self.endpoint = getattr(client, 'endpoint', None)
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.single_flight = single_flight
+        self._selects = AsyncSingleFlight(copy = copy_select)
+        self._queries = AsyncSingleFlight()
+
+    async def query(self, query_str, timeout = None):
+        if self.single_flight:
+            return await self._queries.do(query_str, self._query, query_str, timeout)
+        return await self._query(query_str, timeout)
+
+    async def select(self, query_str, timeout = None):
+        if self.single_flight:
+            return await self._selects.do(query_str, self._select, query_str, timeout)
+        return await self._select(query_str, timeout)
+
+    async def _query(self, query_str, timeout):
+        async with self._semaphore:
+            return await asyncio.to_thread(self.client.query, query_str, timeout)
+
+    async def _select(self, query_str, timeout):
+        async with self._semaphore:
+            return await asyncio.to_thread(self.client.select, query_str, timeout)
+
+    async def aclose(self):
+        pass
+
+    def __repr__(self):
+        return f"ThreadedClient({self.client!r}, concurrency={self.concurrency}, single_flight={self.single_flight})"
+
+
+# per event loop: (blocking client it mirrors, async client)
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    # async counterpart of get_client(), for the running event loop. Follows
+    # configure() / use_local_graph(): a new one is made when the backend changes.
+    loop = asyncio.get_running_loop()
+    client = get_client()
+    mirrored, async_client = _async_clients.get(loop, (None, None))
+    if mirrored is not client:
+        if isinstance(client, SPARQLClient):
+            async_client = AsyncSPARQLClient(client.endpoint, concurrency = client.pool_size, timeout = client.timeout,
+                                             single_flight = client.single_flight)
+        else:
+            async_client = ThreadedClient(client, single_flight = getattr(client, 'single_flight', True))
+        _async_clients[loop] = (client, async_client)
+    return async_client
+
+
+async def apaged_records(client, query_str, order_by, page_size = PAGE_SIZE, as_str = False):
+    # async version of decode.paged_records
+    offset = 0
+    while True:
+        variables, rows = await client.select(page_query(query_str, order_by, page_size, offset))
+        for r in records(variables, rows, as_str = as_str):
+            yield r
+        if len(rows) < page_size:
+            return
+        offset += page_size
+
+
+class AsyncPLODResource(PLODResource):
+    # Build with `await AsyncPLODResource.create(identifier)` or
+    # `await AsyncPLODResource.many(identifiers)`. AsyncPLODResource(identifier)
+    # alone doesn't query anything; its first method call (or `await r.load()`)
+    # fetches it. client: an AsyncSPARQLClient or ThreadedClient, default get_async_client().
+
+    def __init__(self, identifier = 'pompeii', client = None):
+        self.client = client
+        if identifier is None:
+          self.identifier = None
+        else:
+          self._lazy = True
+          self._identifier_parameter = identifier
+
+    def __getattr__(self, name):
+        # never query from attribute access; that would block the event loop
+        if name in PLODResource._loaded_attributes and self.__dict__.get('_lazy'):
+          raise AttributeError(f"'{name}' is not loaded yet, await load() first")
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def _async_client(self):
+        return self.client or get_async_client()
+
+    async def load(self):
+        if self.__dict__.get('_lazy'):
+          with instrument.method_call('load', self._identifier_parameter) as call:
+            variables, rows = await self._async_client().select(self._fetch_query(self._identifier_parameter))
+            self._lazy = False
+            self._load(self._identifier_parameter, call.returned(rows))
+        return self
+
+    @classmethod
+    async def create(cls, identifier = 'pompeii', client = None):
+        return await cls(identifier, client = client).load()
+
+    @classmethod
+    async def many(cls, identifiers, chunk_size = 200, client = None):
+        # PLODResource.many, with the chunk queries sent concurrently
+        identifiers = list(identifiers)
+        if client is None:
+          client = get_async_client()
+        with instrument.method_call('many', None) as call:
+          answers = await asyncio.gather(*[client.select(q) for q in cls._many_queries(identifiers, chunk_size)])
+          resources = call.returned(cls._from_many(identifiers, [row for variables, rows in answers for row in rows]))
+        for r in resources:
+          r.client = client
+        return resources
+
+    async def iter_as_predicate(self, page_size = PAGE_SIZE):
+        # async for row in r.iter_as_predicate(): ...
+        await self.load()
+        if self.identifier == None:
+          return
+        async for r in apaged_records(self._async_client(), self._as_predicate_query(), '?subject ?object', page_size):
+          yield r
+
+    async def iter_as_object(self, set_predicate = None, add_predicate = None, broader = False, page_size = PAGE_SIZE):
+        await self.load()
+        if self.identifier == None:
+          return
+        query_str = self._as_object_query(set_predicate, add_predicate, broader)
+        async for r in apaged_records(self._async_client(), query_str, '?subject ?predicate ?added', page_size):
+          if add_predicate == None:
+            del r['added']
+          yield r
+
+    def _depiction_matrix(self):
+        # as in PLODResource.compare_depicts: only if use_depiction_matrix() has been called
+        depictions = sys.modules.get(PLODResource.__module__ + '.depictions')
+        return depictions.get_depiction_matrix() if depictions is not None else None
+
+    async def compare_depicts(self, right):
+        matrix = self._depiction_matrix()
+        if matrix is not None:
+          await self.load()
+          try:
+            return matrix.compare(self.identifier, right)
+          except KeyError:
+            pass
+        right_r = type(self)(right, client = self.client)
+        left_depicts, right_depicts = await asyncio.gather(self.depicts_concepts(), right_r.depicts_concepts())
+        return self._compared(set(r['urn'] for r in left_depicts), set(r['urn'] for r in right_depicts), right_r)
+
+    async def compare_depicted(self, right, level_of_detail = 'space'):
+        matrix = self._depiction_matrix()
+        if matrix is not None:
+          await self.load()
+          try:
+            return matrix.compare_depicted(self.identifier, right, level_of_detail)
+          except KeyError:
+            pass
+        right_r = type(self)(right, client = self.client)
+        left_depicted, right_depicted = await asyncio.gather(self.depicted_where(level_of_detail),
+                                                             right_r.depicted_where(level_of_detail))
+        return self._compared(set(r['urn'] for r in left_depicted), set(r['urn'] for r in right_depicted), right_r)
+
+    def _compared(self, left_urns, right_urns, right_r):
+        return {"left_urn": f"urn:p-lod:id:{self.identifier}",
+                "difference_left": list(left_urns.difference(right_urns)),
+                "intersection": list(left_urns.intersection(right_urns)),
+                "difference_right": list(right_urns.difference(left_urns)),
+                "right_urn": f"urn:p-lod:id:{right_r.identifier}"}
+
+
+def _async_method(steps):
+    async def method(self, *args, **kwargs):
+        await self.load()
+        with instrument.method_call(steps.__name__, self.identifier) as call:
+            return call.returned(await arun_steps(steps(self, *args, **kwargs), self._async_client(), call))
+
+    method.__name__ = method.__qualname__ = steps.__name__
+    method.__doc__ = steps.__doc__
+    method.__wrapped__ = steps   # for the signature cached() binds arguments with
+    return cached(method)
+
+
+# an async version of every query method, and of the query properties
+# (geojson, narrower, ...), which then give an awaitable
+for _name, _attribute in list(vars(PLODResource).items()):
+    if isinstance(_attribute, property) and hasattr(_attribute.fget, 'steps'):
+        setattr(AsyncPLODResource, _name, property(_async_method(_attribute.fget.steps)))
+    elif hasattr(_attribute, 'steps'):
+        setattr(AsyncPLODResource, _name, _async_method(_attribute.steps))
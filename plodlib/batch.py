@@ -0,0 +1,116 @@
+# Many identifier / method calls in one process, for python -m plodlib --batch.
+#
+# Input has one call per line, either
+#
+#     r1-i1-p1 depicts_concepts
+#     pompeii                                   (--method, or label)
+#     {"identifier": "dog", "method": "depicted_where", "args": {"level_of_detail": "space"}}
+#
+# Calls run on `workers` threads sharing one client, and one JSON line is
+# written per call as it finishes (not in input order):
+#
+#     {"line": 3, "identifier": "dog", "method": "depicted_where", "ok": true, "seconds": 0.21, "result": [...]}
+#     {"line": 4, "identifier": "nope", "method": "label", "ok": false, "seconds": 0.05, "error": "..."}
+#
+# Input is read as the calls are handed out, so it can be a long stream.
+
+import json
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from . import PLODResource
+
+
+DEFAULT_WORKERS = 8
+
+
+def parse_line(line, default_method = None):
+    # (identifier, method, kwargs) for one input line; None for blank lines and # comments
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if line.startswith('{'):
+        call = json.loads(line)
+        return call['identifier'], call.get('method') or default_method or 'label', call.get('args') or {}
+    fields = line.split(None, 2)
+    kwargs = json.loads(fields[2]) if len(fields) > 2 else {}
+    return fields[0], fields[1] if len(fields) > 1 else default_method or 'label', kwargs
+
+
+def run_call(identifier, method, kwargs):
+    r = PLODResource(identifier, lazy = True)
+    found = getattr(r, method)
+    return found(**kwargs) if callable(found) else found
+
+
+def _plain(o):
+    # for results holding PLODResources (e.g. broader)
+    return getattr(o, 'identifier', None) if isinstance(o, PLODResource) else str(o)
+
+
+def run_batch(lines, out = sys.stdout, workers = DEFAULT_WORKERS, default_method = None):
+    # run every call in lines, writing a JSON line to out for each; returns the summary
+    started = time.perf_counter()
+    write_lock = threading.Lock()
+    times = {}      # method -> [seconds]
+    failures = {}   # method -> count
+
+    def one(number, identifier, method, kwargs):
+        start = time.perf_counter()
+        answer = {'line': number, 'identifier': identifier, 'method': method}
+        try:
+            result = run_call(identifier, method, kwargs)
+            answer.update(ok = True, seconds = round(time.perf_counter() - start, 6), result = result)
+            text = json.dumps(answer, default = _plain)
+        except Exception as e:
+            answer.update(ok = False, seconds = round(time.perf_counter() - start, 6), error = f'{type(e).__name__}: {e}')
+            text = json.dumps(answer)
+        with write_lock:
+            out.write(text + '\n')
+            out.flush()
+            times.setdefault(method, []).append(answer['seconds'])
+            if not answer['ok']:
+                failures[method] = failures.get(method, 0) + 1
+
+    # keep a bounded number of calls queued, so input is read as it's needed
+    pending = set()
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        for number, line in enumerate(lines, 1):
+            try:
+                call = parse_line(line, default_method)
+            except (ValueError, KeyError) as e:
+                call = None
+                with write_lock:
+                    out.write(json.dumps({'line': number, 'ok': False, 'seconds': 0, 'error': f'bad input line: {e}'}) + '\n')
+                    failures[None] = failures.get(None, 0) + 1
+            if call is None:
+                continue
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when = FIRST_COMPLETED)
+            pending.add(executor.submit(one, number, *call))
+
+    return summary(times, failures, time.perf_counter() - started)
+
+
+def summary(times, failures, elapsed):
+    def percentile(values, p):
+        return values[min(len(values) - 1, int(p * len(values)))]
+
+    methods = {}
+    for method, seconds in sorted(times.items()):
+        seconds = sorted(seconds)
+        methods[method] = {'calls': len(seconds), 'failed': failures.get(method, 0),
+                           'median_s': percentile(seconds, 0.5), 'p95_s': percentile(seconds, 0.95), 'max_s': seconds[-1]}
+    calls = sum(len(s) for s in times.values())
+    return {'calls': calls, 'failed': sum(failures.values()), 'bad_lines': failures.get(None, 0),
+            'elapsed_s': round(elapsed, 3), 'calls_per_s': round(calls / elapsed, 2) if elapsed else None,
+            'methods': methods}
+
+
+def print_summary(s, out = sys.stderr):
+    print(f"{s['calls']} calls, {s['failed']} failed, {s['elapsed_s']:.1f} s ({s['calls_per_s']} calls/s)", file = out)
+    for method, m in s['methods'].items():
+        print(f"  {method:28} {m['calls']:6} calls {m['failed']:5} failed   median {m['median_s'] * 1000:8.1f} ms"
+              f"   p95 {m['p95_s'] * 1000:8.1f} ms   max {m['max_s'] * 1000:8.1f} ms", file = out)
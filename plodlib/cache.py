@@ -0,0 +1,234 @@
+# Result cache for PLODResource query methods.
+#
+# Entries are keyed on (endpoint, method, identifier, arguments) and held as
+# JSON text, so a caller modifying a returned list can't change what the next
+# caller gets. The in-memory tier is an LRU bounded by total size; an optional
+# SQLite file keeps results across restarts. Nothing is cached until
+# use_cache() is called.
+#
+# Results precomputed by plodlib.materialize are looked up first, when
+# use_materialized() is in effect.
+
+import functools
+import inspect
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .client import get_client
+from .materialized import get_materialized_store
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL = 24 * 60 * 60
+
+
+class ResultCache(object):
+
+    def __init__(self, max_bytes = DEFAULT_MAX_BYTES, ttl = DEFAULT_TTL, ttls = None, path = None):
+        # ttl: default lifetime in seconds (None = until invalidated)
+        # ttls: per-method overrides, e.g. {'images_from_luna': 7 * 24 * 60 * 60}
+        # path: SQLite file for the on-disk tier
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.ttls = dict(ttls or {})
+        self.path = path
+
+        self._entries = OrderedDict()   # key -> (method, identifier, text, expires)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread = False)
+            self._db.execute("""CREATE TABLE IF NOT EXISTS results (
+                                  key TEXT PRIMARY KEY, method TEXT, identifier TEXT,
+                                  value TEXT, expires REAL)""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_identifier ON results (identifier)")
+            self._db.commit()
+
+    @staticmethod
+    def key(endpoint, method, identifier, arguments):
+        return json.dumps([endpoint, method, identifier, arguments], sort_keys = True, default = str)
+
+    def get(self, key):
+        # (True, value) on a hit, (False, None) otherwise
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                method, identifier, text, expires = entry
+                if expires is None or expires > now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return True, json.loads(text)
+                self._remove(key)
+
+            if self._db is not None:
+                row = self._db.execute("SELECT method, identifier, value, expires FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    method, identifier, text, expires = row
+                    if expires is None or expires > now:
+                        self._stats['disk_hits'] += 1
+                        self._insert(key, method, identifier, text, expires)
+                        return True, json.loads(text)
+                    self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self._db.commit()
+                    entry = row
+
+            if entry is not None:
+                self._stats['expired'] += 1
+            self._stats['misses'] += 1
+            return False, None
+
+    def set(self, key, method, identifier, value):
+        try:
+            text = json.dumps(value)
+        except (TypeError, ValueError):
+            return
+        ttl = self.ttls.get(method, self.ttl)
+        expires = None if ttl is None else time.time() + ttl
+
+        with self._lock:
+            self._insert(key, method, identifier, text, expires)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                                 (key, method, identifier, text, expires))
+                self._db.commit()
+
+    def _insert(self, key, method, identifier, text, expires):
+        self._remove(key)
+        if len(text) > self.max_bytes:
+            return
+        self._entries[key] = (method, identifier, text, expires)
+        self._bytes += len(text)
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats['evictions'] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[2])
+
+    def invalidate(self, identifier = None, method = None):
+        # drop entries for an identifier and/or method; returns how many went
+        # (from the file when there is one, since it holds every entry)
+        with self._lock:
+            doomed = [k for k, (m, i, _, _) in self._entries.items()
+                      if (identifier is None or i == identifier) and (method is None or m == method)]
+            for k in doomed:
+                self._remove(k)
+
+            if self._db is not None:
+                where, params = [], []
+                if identifier is not None:
+                    where.append("identifier = ?")
+                    params.append(identifier)
+                if method is not None:
+                    where.append("method = ?")
+                    params.append(method)
+                sql = "DELETE FROM results" + (" WHERE " + " AND ".join(where) if where else "")
+                removed = self._db.execute(sql, params).rowcount
+                self._db.commit()
+                return removed
+        return len(doomed)
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries = len(self._entries), bytes = self._bytes)
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"ResultCache({len(self._entries)} entries, {self._bytes} bytes, path={self.path!r})"
+
+
+_cache = None
+
+
+def get_cache():
+    return _cache
+
+
+def use_cache(enabled = True, **kwargs):
+    # start caching PLODResource results; kwargs go to ResultCache.
+    # use_cache(False) turns caching off again.
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = ResultCache(**kwargs) if enabled else None
+    return _cache
+
+
+def cached(function):
+    # decorator for PLODResource query methods, blocking or async
+    name = function.__name__
+    signature = inspect.signature(function)
+
+    def lookup(cache, store, self, args, kwargs):
+        # (cache key or None, found, value), from the materialized store or the cache
+        # depicted_where() and depicted_where(level_of_detail = 'feature') share an entry
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(list(bound.arguments.items())[1:])
+
+        if store is not None:
+            found, value = store.get(name, self.identifier, arguments)
+            if found or cache is None:
+                return None, found, value
+
+        # an AsyncPLODResource may carry its own client
+        client = getattr(self, 'client', None) or get_client()
+        key = cache.key(getattr(client, 'endpoint', None), name, self.identifier, arguments)
+        return (key,) + cache.get(key)
+
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def async_wrapper(self, *args, **kwargs):
+            cache, store = _cache, get_materialized_store()
+            if cache is None and store is None:
+                return await function(self, *args, **kwargs)
+            # the key needs the resolved identifier, which an AsyncPLODResource
+            # only has once loaded (reading it unloaded would block the loop)
+            await self.load()
+            key, found, value = lookup(cache, store, self, args, kwargs)
+            if found:
+                return value
+            value = await function(self, *args, **kwargs)
+            if cache is not None:
+                cache.set(key, name, self.identifier, value)
+            return value
+
+        return async_wrapper
+
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        cache, store = _cache, get_materialized_store()
+        if cache is None and store is None:
+            return function(self, *args, **kwargs)
+        key, found, value = lookup(cache, store, self, args, kwargs)
+        if found:
+            return value
+        value = function(self, *args, **kwargs)
+        if cache is not None:
+            cache.set(key, name, self.identifier, value)
+        return value
+
+    return wrapper
@@ -0,0 +1,267 @@
+# Change detection for the triplestore, so cached and materialized results can
+# be dropped only for what a republished dataset actually changed.
+#
+#     snapshot = DatasetSnapshot.take()           digests of every p-lod resource's ?p ?o rows
+#     snapshot.fingerprint                        changes whenever any of them does
+#     snapshot.save('plod.snapshot')
+#
+#     # after P-LOD is republished
+#     python -m plodlib.changes plod.snapshot --cache-path cache.sqlite --materialized plod-results.sqlite
+#
+# A resource's digest covers the rows PLODResource loads for it (SELECT ?p ?o).
+# The endpoint computes the digests, so a snapshot fetches one row per
+# resource plus the links between resources, not the whole dataset.
+# When digests differ, the results invalidated are those of the resources that
+# changed, of the p-lod resources they link to or are linked from (a concept
+# whose component moved, a space whose feature changed its label), and of every
+# hierarchy ancestor of those (the property, insula and region whose
+# depicts_concepts or gather_images include them). The first update() only
+# records a snapshot: take one when the cache or materialized file is built
+# (plodlib.materialize does).
+
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import PLODResource
+from .cache import get_cache
+from .client import get_client
+from .hierarchy import PREDICATES
+from .materialized import get_materialized_store
+
+
+PLOD = 'urn:p-lod:id:'
+
+DEFAULT_WORKERS = 8
+
+# subjects per query
+CHUNK_SIZE = 200
+
+
+def _short(urn):
+    return urn[len(PLOD):] if urn.startswith(PLOD) else None
+
+
+def digest(po):
+    # of one resource's (predicate, object) rows, in any order; what DIGESTS_QUERY
+    # has the endpoint compute
+    return hashlib.sha1(''.join(sorted(f'{p}\x1f{o}\x1e' for p, o in po)).encode('utf-8')).hexdigest()
+
+
+# digest() of every p-lod resource, computed by the endpoint, so that only one
+# row per resource comes back (SPARQL 1.1 SHA1 and GROUP_CONCAT; the ordered
+# subquery makes the concatenation the sorted rows)
+DIGESTS_QUERY = r"""
+SELECT ?s (SHA1(GROUP_CONCAT(?row; separator = "")) AS ?digest) WHERE {
+  SELECT ?s ?row WHERE {
+    ?s ?p ?o . FILTER(STRSTARTS(STR(?s), "urn:p-lod:id:"))
+    BIND(CONCAT(STR(?p), "\u001F", STR(?o), "\u001E") AS ?row)
+  } ORDER BY ?s ?row
+} GROUP BY ?s"""
+
+# the rows affected() follows: p-lod resources linking to p-lod resources
+LINKS_QUERY = """
+SELECT ?s ?p ?o WHERE {
+  ?s ?p ?o . FILTER(isIRI(?o) && STRSTARTS(STR(?s), "urn:p-lod:id:") && STRSTARTS(STR(?o), "urn:p-lod:id:"))
+}"""
+
+
+def subjects(client = None):
+    # identifiers of every p-lod resource that is the subject of a triple
+    variables, rows = (client or get_client()).select("""
+SELECT DISTINCT ?s WHERE { ?s ?p ?o . FILTER(STRSTARTS(STR(?s), "urn:p-lod:id:")) }""")
+    return sorted(i for i in (_short(s) for (s,) in rows) if i)
+
+
+def _links(rows):
+    # identifier -> [(predicate, identifier)] of its p-lod objects, from (identifier, p, o) rows
+    links = {}
+    for identifier, p, o in rows:
+        if o.startswith(PLOD):
+            links.setdefault(identifier, set()).add((_short(p) or p, _short(o)))
+    return {i: sorted(found) for i, found in links.items()}
+
+
+class DatasetSnapshot(object):
+
+    def __init__(self, digests, links, endpoint = None, taken = None):
+        self.digests = digests    # identifier -> digest
+        self.links = links        # identifier -> [(predicate, identifier)] of its p-lod objects
+        self.endpoint = endpoint
+        self.taken = taken
+        h = hashlib.blake2b(digest_size = 16)
+        for identifier in sorted(digests):
+            h.update(f'{identifier}\x1f{digests[identifier]}\x1e'.encode('utf-8'))
+        self.fingerprint = h.hexdigest()
+
+    @classmethod
+    def take(cls, client = None, workers = DEFAULT_WORKERS, chunk_size = CHUNK_SIZE, server_digests = True):
+        # the endpoint computes the digests (DIGESTS_QUERY) and only the links
+        # between p-lod resources are fetched. If it can't (no SHA1 or
+        # GROUP_CONCAT), or with server_digests = False, every row is fetched
+        # instead: one query for the subjects, then one per chunk_size of
+        # them, workers at a time.
+        client = client or get_client()
+        taken = time.time()
+        endpoint = getattr(client, 'endpoint', None)
+
+        if server_digests:
+            try:
+                variables, rows = client.select(DIGESTS_QUERY)
+                digests = {_short(s): d for s, d in rows if d}
+            except Exception:
+                digests = None
+            if digests:
+                variables, rows = client.select(LINKS_QUERY)
+                return cls(digests, _links((_short(s), p, o) for s, p, o in rows), endpoint = endpoint, taken = taken)
+
+        def fetch(query_str):
+            variables, rows = client.select(query_str)
+            return rows
+
+        po = {}
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            for rows in executor.map(fetch, PLODResource._many_queries(subjects(client), chunk_size)):
+                for s, p, o in rows:
+                    po.setdefault(_short(s), []).append((p, o))
+        return cls({i: digest(rows) for i, rows in po.items()},
+                   _links((i, p, o) for i, rows in po.items() for p, o in rows),
+                   endpoint = endpoint, taken = taken)
+
+    def save(self, path):
+        # gzipped JSON, written beside path and moved over it
+        with gzip.open(path + '.saving', 'wt', encoding = 'utf-8') as f:
+            json.dump({'endpoint': self.endpoint, 'taken': self.taken, 'fingerprint': self.fingerprint,
+                       'digests': self.digests, 'links': self.links}, f)
+        os.replace(path + '.saving', path)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt', encoding = 'utf-8') as f:
+            saved = json.load(f)
+        return cls(saved['digests'], {i: [tuple(l) for l in ls] for i, ls in saved['links'].items()},
+                   endpoint = saved['endpoint'], taken = saved['taken'])
+
+    def changed_since(self, old):
+        # identifiers added, removed or with different rows
+        return set(i for i in set(self.digests) | set(old.digests) if self.digests.get(i) != old.digests.get(i))
+
+    def affected(self, old, changed = None):
+        # the changed identifiers, the p-lod resources linked to or from them in
+        # either snapshot, and every hierarchy ancestor of all of those
+        changed = self.changed_since(old) if changed is None else set(changed)
+        both = [self.links, old.links]
+
+        found = set(changed)
+        for links in both:
+            for identifier, targets in links.items():
+                for p, o in targets:
+                    if identifier in changed:
+                        found.add(o)
+                    if o in changed:
+                        found.add(identifier)
+
+        # predicate-path ancestors over the union of old and new edges
+        stack = list(found)
+        while stack:
+            identifier = stack.pop()
+            for links in both:
+                for p, o in links.get(identifier, ()):
+                    if p in PREDICATES and o not in found:
+                        found.add(o)
+                        stack.append(o)
+        return found
+
+    def __len__(self):
+        return len(self.digests)
+
+    def __repr__(self):
+        return f'DatasetSnapshot({self.endpoint!r}, {len(self)} resources, {self.fingerprint})'
+
+
+def invalidate(identifiers, cache = None, store = None):
+    # drop cached and materialized results (default: those in use) for identifiers;
+    # returns how many went from each
+    cache = get_cache() if cache is None else cache
+    store = get_materialized_store() if store is None else store
+    counts = {'cache': 0, 'materialized': 0}
+    for identifier in sorted(identifiers):
+        if cache is not None:
+            counts['cache'] += cache.invalidate(identifier)
+        if store is not None:
+            counts['materialized'] += store.invalidate(identifier)
+    return counts
+
+
+# index module -> its accessor; a module not imported yet has no index in use
+INDEXES = (('hierarchy', 'get_hierarchy_index'), ('locations', 'get_location_table'),
+           ('spatial', 'get_spatial_index'), ('depictions', 'get_depiction_matrix'))
+
+
+def rebuild_indexes(client = None):
+    # the in-memory indexes in use are built from the whole dataset, so they are rebuilt
+    # (looked up in sys.modules, as compare_depicts does, so numpy isn't imported for nothing)
+    rebuilt = []
+    for module, accessor in INDEXES:
+        module = sys.modules.get(f'{PLODResource.__module__}.{module}')
+        index = getattr(module, accessor)() if module is not None else None
+        if index is not None:
+            index.rebuild(client)
+            rebuilt.append(type(index).__name__)
+    return rebuilt
+
+
+def update(path, client = None, cache = None, store = None, workers = DEFAULT_WORKERS):
+    # compare the dataset with the snapshot at path, invalidate what changed and
+    # save the new snapshot there. Returns {'changed', 'affected', 'cache',
+    # 'materialized', 'rebuilt', 'fingerprint'}; changed and affected are None
+    # when there was no snapshot to compare with.
+    new = DatasetSnapshot.take(client, workers = workers)
+    report = {'fingerprint': new.fingerprint, 'changed': None, 'affected': None,
+              'cache': 0, 'materialized': 0, 'rebuilt': []}
+    if os.path.exists(path):
+        old = DatasetSnapshot.load(path)
+        if old.fingerprint != new.fingerprint:
+            changed = new.changed_since(old)
+            affected = new.affected(old, changed)
+            report.update(invalidate(affected, cache, store), changed = sorted(changed), affected = sorted(affected),
+                          rebuilt = rebuild_indexes(client))
+        else:
+            report.update(changed = [], affected = [])
+    new.save(path)
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from .cache import ResultCache
+    from .client import configure, use_local_graph
+    from .materialized import MaterializedStore
+
+    parser = argparse.ArgumentParser(description = 'Invalidate cached and materialized results for what changed since a snapshot.')
+    parser.add_argument('snapshot', help = 'snapshot file, read and then replaced (created if missing)')
+    parser.add_argument('--cache-path', help = 'result cache SQLite file to invalidate in')
+    parser.add_argument('-m', '--materialized', help = 'materialized results file to invalidate in')
+    parser.add_argument('-w', '--workers', type = int, default = DEFAULT_WORKERS)
+    parser.add_argument('-e', '--endpoint', help = 'SPARQL query endpoint (default: $PLOD_ENDPOINT or the P-LOD Fuseki server)')
+    parser.add_argument('-l', '--local', action = 'append', metavar = 'FILE', help = 'read a local RDF dump (repeatable)')
+    args = parser.parse_args()
+
+    if args.local:
+        use_local_graph(*args.local)
+    else:
+        configure(endpoint = args.endpoint, pool_size = args.workers)
+
+    cache = ResultCache(path = args.cache_path) if args.cache_path else None
+    store = MaterializedStore(args.materialized) if args.materialized else None
+    report = update(args.snapshot, cache = cache, store = store, workers = args.workers)
+    if report['changed'] is None:
+        print(f"no earlier snapshot; recorded {report['fingerprint']}", file = sys.stderr)
+    else:
+        print(f"{len(report['changed'])} resources changed, {len(report['affected'])} affected; "
+              f"{report['cache']} cached and {report['materialized']} materialized results dropped", file = sys.stderr)
@@ -0,0 +1,237 @@
+# Query backends for PLODResource.
+#
+# Every PLODResource method sends its query through the client returned by
+# get_client(). By default that is a SPARQLClient talking to the remote P-LOD
+# endpoint; it keeps one requests.Session per process so HTTP connections are
+# reused (keep-alive) instead of being opened for each query. use_local_graph()
+# swaps in a LocalGraph, which answers the same queries from an RDF dump loaded
+# into memory.
+
+import json
+import os
+import threading
+from io import BytesIO
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import instrument
+from .singleflight import SingleFlight
+
+
+DEFAULT_ENDPOINT = os.environ.get('PLOD_ENDPOINT', "http://52.170.134.25:3030/plod_endpoint/query")
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 60
+
+# rdflib's SPARQLStore prepended the graph's namespace bindings to every query.
+# Some templates (narrower) rely on rdfs: being declared that way, so keep doing it.
+PREFIXES = """PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+PREFIX owl: <http://www.w3.org/2002/07/owl#>
+PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
+"""
+
+# json for SELECT/ASK, turtle for DESCRIBE/CONSTRUCT. Fuseki picks per query form.
+ACCEPT = "application/sparql-results+json, text/turtle;q=0.9, application/rdf+xml;q=0.8"
+SELECT_ACCEPT = "application/sparql-results+json"
+
+# queries longer than this are sent as a form POST rather than in the URL
+MAX_GET_LENGTH = 2000
+
+
+def copy_select(answer):
+    # a (variables, rows) select answer that can be changed without affecting the original
+    variables, rows = answer
+    return list(variables), [list(row) for row in rows]
+
+
+def parse_result(content, content_type = None):
+    # response body -> rdflib Result, by the Content-Type the endpoint answered with
+    from rdflib.query import Result
+    content_type = (content_type or 'application/sparql-results+json').split(';')[0]
+    return Result.parse(BytesIO(content), content_type = content_type)
+
+
+def parse_select(content):
+    # SPARQL JSON results -> (variable names, rows of plain strings, None for unbound)
+    results = json.loads(content)
+    variables = results['head']['vars']
+    rows = []
+    for binding in results['results']['bindings']:
+        if not binding:
+            # rdflib drops all-unbound rows (e.g. an aggregate over nothing); so do we
+            continue
+        row = []
+        for v in variables:
+            term = binding.get(v)
+            row.append(None if term is None else term['value'])
+        rows.append(row)
+    return variables, rows
+
+
+class SPARQLClient(object):
+    # single_flight: threads sending a query that is already on its way to the
+    # endpoint wait for that answer instead of sending it again
+
+    def __init__(self, endpoint = DEFAULT_ENDPOINT, pool_size = DEFAULT_POOL_SIZE, timeout = DEFAULT_TIMEOUT, single_flight = True):
+        self.endpoint = endpoint
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.single_flight = single_flight
+        self._selects = SingleFlight(copy = copy_select)
+        self._queries = SingleFlight()
+
+        # pool_block keeps at most pool_size connections open to the endpoint,
+        # extra threads wait for a free connection instead of opening new ones.
+        adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size, pool_block = True)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Accept': ACCEPT})
+
+    def _send(self, query_str, timeout, headers = None):
+        if timeout is None:
+            timeout = self.timeout
+
+        query_str = PREFIXES + query_str
+        if len(query_str) > MAX_GET_LENGTH:
+            response = self.session.post(self.endpoint, data = {'query': query_str}, timeout = timeout, headers = headers)
+        else:
+            response = self.session.get(self.endpoint, params = {'query': query_str}, timeout = timeout, headers = headers)
+        response.raise_for_status()
+        return response
+
+    def query(self, query_str, timeout = None):
+        # returns an rdflib Result, same as Graph(SPARQLStore(...)).query()
+        if self.single_flight:
+            return self._queries.do(query_str, self._query, query_str, timeout)
+        return self._query(query_str, timeout)
+
+    def select(self, query_str, timeout = None):
+        # SELECT results as (variable names, rows), each row a list of plain
+        # strings with None for unbound. No rdflib terms are built.
+        if self.single_flight:
+            return self._selects.do(query_str, self._select, query_str, timeout)
+        return self._select(query_str, timeout)
+
+    def _query(self, query_str, timeout):
+        with instrument.request('sparql', self.endpoint, query_str) as timing:
+            response = self._send(query_str, timeout)
+            timing.fetched(len(response.content))
+            result = parse_result(response.content, response.headers.get('Content-Type'))
+            timing.decoded(len(result))
+        return result
+
+    def _select(self, query_str, timeout):
+        with instrument.request('sparql', self.endpoint, query_str) as timing:
+            response = self._send(query_str, timeout, headers = {'Accept': SELECT_ACCEPT})
+            timing.fetched(len(response.content))
+            variables, rows = parse_select(response.content)
+            timing.decoded(len(rows))
+        return variables, rows
+
+    def close(self):
+        self.session.close()
+
+    def __repr__(self):
+        return f"SPARQLClient({self.endpoint!r}, pool_size={self.pool_size}, timeout={self.timeout}, single_flight={self.single_flight})"
+
+
+class LocalGraph(object):
+    # Answers the PLODResource queries from an in-memory rdflib graph, e.g. a
+    # Turtle or N-Triples dump of P-LOD. Same query() interface as SPARQLClient.
+
+    def __init__(self, *sources, graph = None, format = None, single_flight = True, endpoint = None):
+        # endpoint: name for the graph in cache keys and events (default: from the sources)
+        if graph is None:
+            import rdflib as rdf
+            graph = rdf.Graph()
+        for source in sources:
+            graph.parse(source, format = format)
+
+        self.graph = graph
+        self.sources = [str(source) for source in sources]
+        self.endpoint = endpoint or ('local:' + ','.join(self.sources) if self.sources else f'local:{id(graph):x}')
+        # rdflib's SPARQL parser isn't thread-safe; one query at a time
+        self._lock = threading.Lock()
+        # queries waiting for the lock behind the same query share its answer
+        self.single_flight = single_flight
+        self._selects = SingleFlight(copy = copy_select)
+        self._queries = SingleFlight()
+
+    def query(self, query_str, timeout = None):
+        # timeout accepted for interface compatibility; local queries are not interrupted
+        if self.single_flight:
+            return self._queries.do(query_str, self._query, query_str)
+        return self._query(query_str)
+
+    def select(self, query_str, timeout = None):
+        # same (variable names, rows) shape as SPARQLClient.select
+        if self.single_flight:
+            return self._selects.do(query_str, self._select, query_str)
+        return self._select(query_str)
+
+    def _query(self, query_str):
+        with self._lock, instrument.request('sparql', self.endpoint, query_str) as timing:
+            result = self.graph.query(PREFIXES + query_str)
+            timing.fetched()
+            timing.decoded(len(result))
+        return result
+
+    def _select(self, query_str):
+        with self._lock, instrument.request('sparql', self.endpoint, query_str) as timing:
+            results = self.graph.query(PREFIXES + query_str)
+            results.bindings   # evaluates the query
+            timing.fetched()
+            variables = [str(v) for v in results.vars]
+            rows = [[None if term is None else str(term) for term in row] for row in results]
+            timing.decoded(len(rows))
+        return variables, rows
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return f"LocalGraph({self.endpoint!r}, {len(self.graph)} triples)"
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # process-wide client, created on first use
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SPARQLClient()
+    return _client
+
+
+def set_client(client):
+    # make client (a SPARQLClient, LocalGraph or anything with compatible
+    # query() and select() methods) the backend used by every PLODResource
+    global _client
+    with _client_lock:
+        old, _client = _client, client
+    if old is not None and old is not client:
+        old.close()
+    return client
+
+
+def configure(endpoint = None, pool_size = None, timeout = None, single_flight = None):
+    # use the remote endpoint. Arguments left as None keep their current value.
+    old = _client if isinstance(_client, SPARQLClient) else None
+    if single_flight is None:
+        single_flight = old.single_flight if old else True
+    return set_client(SPARQLClient(endpoint = endpoint or (old.endpoint if old else DEFAULT_ENDPOINT),
+                                   pool_size = pool_size or (old.pool_size if old else DEFAULT_POOL_SIZE),
+                                   timeout = timeout or (old.timeout if old else DEFAULT_TIMEOUT),
+                                   single_flight = single_flight))
+
+
+def use_local_graph(*sources, graph = None, format = None):
+    # load one or more RDF dumps (or use an existing rdflib graph) and answer
+    # every query from it instead of the remote endpoint
+    return set_client(LocalGraph(*sources, graph = graph, format = format))
@@ -0,0 +1,238 @@
+# Whole-site crawl and export: from pompeii down through spatial_children,
+# calling depicts_concepts, geojson, spatial_ancestors and gather_images for
+# every unit reached, many at once.
+#
+#     python -m plodlib.crawl -o pompeii.ndjson --workers 16 --timeout 300
+#     python -m plodlib.crawl -o pompeii.ndjson --processes -i plod.index     each worker process maps the index
+#
+# One JSON line is appended per node as it finishes:
+#
+#     {"identifier": "r1-i1", "parent": "r1", "depth": 2, "ok": true, "seconds": 1.9,
+#      "children": ["r1-i1-p1", ...], "results": {"depicts_concepts": [...], ...}, "errors": {}}
+#
+# The output is also the checkpoint. Run the same command again after an
+# interruption and every node with an ok line is skipped; the crawl carries
+# on from their children. Failed nodes, and nodes given up on after
+# --timeout seconds, are retried. A node reached from several parents is
+# visited once. A node that times out is left running in its worker (threads
+# and processes can't be interrupted), so the per-query timeout is set to the
+# same value to bound it.
+
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from . import PLODResource
+
+
+ROOT = 'pompeii'
+
+# method -> keyword arguments; properties (geojson) take none
+METHODS = {'depicts_concepts': {}, 'geojson': {}, 'spatial_ancestors': {}, 'gather_images': {}}
+
+DEFAULT_WORKERS = 8
+
+# seconds a node may take before it is given up on
+DEFAULT_TIMEOUT = 300
+
+# seconds between checks for nodes past their timeout
+POLL = 1.0
+
+
+def _plain(o):
+    # results holding PLODResources (e.g. broader)
+    return getattr(o, 'identifier', None) if isinstance(o, PLODResource) else str(o)
+
+
+def _call(resource, method, kwargs):
+    found = getattr(resource, method)
+    return found(**kwargs) if callable(found) else found
+
+
+def visit(identifier, parent, depth, methods = METHODS):
+    # (JSON line, children, ok) for one node. Runs in a worker, so it returns
+    # the line as text: nothing unpicklable crosses back from a process.
+    start = time.perf_counter()
+    r = PLODResource(identifier, lazy = True)
+    line = {'identifier': identifier, 'parent': parent, 'depth': depth}
+    children, results, errors = None, {}, {}
+    try:
+        children = list(dict.fromkeys(c['urn'].replace('urn:p-lod:id:', '') for c in r.spatial_children()))
+    except Exception as e:
+        errors['spatial_children'] = f'{type(e).__name__}: {e}'
+    for method, kwargs in methods.items():
+        try:
+            results[method] = _call(r, method, kwargs)
+        except Exception as e:
+            errors[method] = f'{type(e).__name__}: {e}'
+    ok = not errors
+    line.update(ok = ok, seconds = round(time.perf_counter() - start, 3), children = children, results = results, errors = errors)
+    return json.dumps(line, default = _plain), children or [], ok
+
+
+def read_checkpoint(path):
+    # {identifier: last line written for it} from an earlier run's output;
+    # a line cut off by an interruption is ignored
+    lines = {}
+    try:
+        with open(path) as f:
+            for text in f:
+                try:
+                    line = json.loads(text)
+                except ValueError:
+                    continue
+                lines[line['identifier']] = line
+    except FileNotFoundError:
+        pass
+    return lines
+
+
+def _ensure_newline(path):
+    # so appending after a cut-off line starts a new one
+    try:
+        with open(path, 'rb') as f:
+            f.seek(-1, 2)
+            last = f.read(1)
+    except (FileNotFoundError, OSError):
+        return
+    if last != b'\n':
+        with open(path, 'a') as f:
+            f.write('\n')
+
+
+def crawl(path, roots = (ROOT,), methods = METHODS, workers = DEFAULT_WORKERS, timeout = DEFAULT_TIMEOUT,
+          max_depth = None, executor = None, log = sys.stderr):
+    # crawl from roots, appending a line per node to the file at path and
+    # resuming from what it already holds. executor: a ThreadPoolExecutor
+    # (default, with workers threads) or a ProcessPoolExecutor whose workers
+    # have a backend configured. Returns counts of what happened.
+    started = time.time()
+    earlier = read_checkpoint(path)
+    done = set(i for i, line in earlier.items() if line.get('ok'))
+
+    # (identifier, parent, depth) still to visit: the roots, the children of
+    # finished nodes, and earlier failures
+    frontier = deque()
+    queued = set(done)
+
+    def enqueue(identifier, parent, depth):
+        if identifier not in queued and (max_depth is None or depth <= max_depth):
+            queued.add(identifier)
+            frontier.append((identifier, parent, depth))
+
+    for root in roots:
+        enqueue(root, None, 0)
+    for identifier, line in earlier.items():
+        if line.get('ok'):
+            for child in line.get('children') or ():
+                enqueue(child, identifier, line['depth'] + 1)
+        else:
+            enqueue(identifier, line.get('parent'), line.get('depth', 0))
+
+    counts = {'skipped': len(done), 'visited': 0, 'failed': 0, 'timed_out': 0}
+    if log:
+        print(f"{len(done)} nodes already done, {len(frontier)} to visit", file = log)
+
+    _ensure_newline(path)
+    owned = executor is None
+    executor = executor or ThreadPoolExecutor(max_workers = workers)
+    pending = {}    # future -> (identifier, parent, depth)
+    running = {}    # future -> when it was first seen running
+    try:
+        with open(path, 'a') as out:
+            def write(text):
+                out.write(text + '\n')
+                out.flush()
+
+            while frontier or pending:
+                while frontier and len(pending) < workers:
+                    identifier, parent, depth = frontier.popleft()
+                    pending[executor.submit(visit, identifier, parent, depth, methods)] = (identifier, parent, depth)
+
+                finished, _ = wait(pending, timeout = POLL, return_when = FIRST_COMPLETED)
+                for future in finished:
+                    identifier, parent, depth = pending.pop(future)
+                    running.pop(future, None)
+                    try:
+                        text, children, ok = future.result()
+                    except Exception as e:
+                        # the worker itself failed (e.g. a process died)
+                        text, children, ok = json.dumps({'identifier': identifier, 'parent': parent, 'depth': depth, 'ok': False,
+                                                         'errors': {'crawl': f'{type(e).__name__}: {e}'}}), [], False
+                    write(text)
+                    counts['visited' if ok else 'failed'] += 1
+                    for child in children:
+                        enqueue(child, identifier, depth + 1)
+
+                now = time.monotonic()
+                for future, (identifier, parent, depth) in list(pending.items()):
+                    if future.running():
+                        running.setdefault(future, now)
+                    if future in running and now - running[future] > timeout:
+                        # give up on it; it is retried on the next run
+                        del pending[future], running[future]
+                        write(json.dumps({'identifier': identifier, 'parent': parent, 'depth': depth, 'ok': False,
+                                          'errors': {'crawl': f'timed out after {timeout} s'}}))
+                        counts['timed_out'] += 1
+
+                if log and finished:
+                    total = counts['visited'] + counts['failed'] + counts['timed_out']
+                    if total % 100 < len(finished):
+                        print(f"  {total} visited, {len(frontier)} waiting, {len(pending)} running", file = log)
+    finally:
+        if owned:
+            # don't wait for nodes given up on
+            executor.shutdown(wait = False, cancel_futures = True)
+
+    counts['elapsed_s'] = round(time.time() - started, 1)
+    return counts
+
+
+def _configure_backend(endpoint, timeout, local, index, pool_size):
+    from .client import configure, use_local_graph
+    if index:
+        # numpy and rdflib, only when crawling an index
+        from .tripleindex import use_triple_index
+        use_triple_index(index)
+    elif local:
+        use_local_graph(*local)
+    else:
+        configure(endpoint = endpoint, timeout = timeout, pool_size = pool_size)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Crawl P-LOD from a root through spatial_children, exporting each node as a JSON line.')
+    parser.add_argument('-o', '--output', required = True, help = 'NDJSON file to append to; also the checkpoint resumed from')
+    parser.add_argument('-r', '--root', action = 'append', help = f'identifier to start from (repeatable, default {ROOT})')
+    parser.add_argument('-m', '--method', action = 'append', help = f"method to call on every node (repeatable, default {', '.join(METHODS)})")
+    parser.add_argument('-w', '--workers', type = int, default = DEFAULT_WORKERS)
+    parser.add_argument('--processes', action = 'store_true', help = 'run workers as processes rather than threads')
+    parser.add_argument('-t', '--timeout', type = float, default = DEFAULT_TIMEOUT, help = 'seconds before a node is given up on')
+    parser.add_argument('--max-depth', type = int, help = 'levels below the root to go')
+    parser.add_argument('-e', '--endpoint', help = 'SPARQL query endpoint (default: $PLOD_ENDPOINT or the P-LOD Fuseki server)')
+    parser.add_argument('-l', '--local', action = 'append', metavar = 'FILE', help = 'crawl a local RDF dump (repeatable)')
+    parser.add_argument('-i', '--index', metavar = 'DIR', help = 'crawl a triple index built by python -m plodlib.tripleindex')
+    args = parser.parse_args()
+
+    backend = (args.endpoint, args.timeout, args.local, args.index, args.workers)
+    if args.processes:
+        executor = ProcessPoolExecutor(max_workers = args.workers, initializer = _configure_backend,
+                                       initargs = backend[:4] + (1,))
+    else:
+        _configure_backend(*backend)
+        executor = None
+
+    methods = {m: {} for m in args.method} if args.method else METHODS
+    try:
+        counts = crawl(args.output, roots = args.root or [ROOT], methods = methods, workers = args.workers,
+                       timeout = args.timeout, max_depth = args.max_depth, executor = executor)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait = False, cancel_futures = True)
+    print(f"{counts['visited']} visited, {counts['failed']} failed, {counts['timed_out']} timed out, "
+          f"{counts['skipped']} already done, {counts['elapsed_s']} s", file = sys.stderr)
+    sys.exit(1 if counts['failed'] or counts['timed_out'] else 0)
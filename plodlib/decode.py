@@ -0,0 +1,69 @@
+# SPARQL SELECT results straight to the list of dicts PLODResource returns.
+#
+# The methods used to go rdflib Result -> DataFrame (-> .map(str)) -> to_json ->
+# json.loads. The backends' select() now hands over plain (vars, rows) and
+# these helpers produce the same records directly:
+#   records(...)                  what df.to_json(orient='records') gave: str, or None for unbound
+#   records(..., as_str = True)   what df.map(str) first gave: unbound becomes 'None'
+#   numeric_columns(records)      what pd.to_numeric(column, errors='ignore') gave
+
+from .client import get_client
+
+
+def records(variables, rows, as_str = False):
+    if as_str:
+        return [dict(zip(variables, ['None' if v is None else v for v in row])) for row in rows]
+    return [dict(zip(variables, row)) for row in rows]
+
+
+def select_records(query_str, as_str = False):
+    variables, rows = get_client().select(query_str)
+    return records(variables, rows, as_str = as_str)
+
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def numeric_columns(records):
+    # a column becomes numeric only if every bound, non-empty value in it parses
+    # as a number. As with pandas, a column of numbers with gaps (unbound or '')
+    # becomes float and the gaps None; so does a column of nothing but gaps.
+    if not records:
+        return records
+    for column in records[0]:
+        values = [r[column] for r in records]
+        try:
+            numbers = [None if v is None or v == '' else _number(v) for v in values]
+        except (TypeError, ValueError):
+            continue
+        if None in numbers or any(isinstance(n, float) for n in numbers):
+            numbers = [None if n is None else float(n) for n in numbers]
+        for r, n in zip(records, numbers):
+            r[column] = n
+    return records
+
+
+# rows per query when paging through a result
+PAGE_SIZE = 5000
+
+
+def page_query(query_str, order_by, page_size, offset):
+    # one page of query_str. order_by must cover every projected variable so
+    # pages don't overlap or skip rows when values tie.
+    return f"{query_str}\nORDER BY {order_by} LIMIT {page_size} OFFSET {offset}"
+
+
+def paged_records(query_str, order_by, page_size = PAGE_SIZE, as_str = False):
+    # records of query_str, fetched and yielded a page at a time; only one
+    # page is held in memory
+    offset = 0
+    while True:
+        page = select_records(page_query(query_str, order_by, page_size, offset), as_str = as_str)
+        yield from page
+        if len(page) < page_size:
+            return
+        offset += page_size
@@ -0,0 +1,342 @@
+# Concept x spatial unit depiction matrix.
+#
+# Which concepts are depicted in which spaces, properties and features (and
+# how many artwork components depict them there), read once from the backend
+# and held as a sparse matrix. Comparing units then needs no queries, and
+# similarity against every unit is one vectorized pass:
+#
+#     matrix = use_depiction_matrix()
+#     matrix.most_similar('r1-i1-p1-space-1', k = 10)          spaces most like this one
+#     matrix.similarity('r1-i1-p1', 'r1-i1-p2', metric = 'cosine')
+#     matrix.compare('r1-i1-p1', 'r1-i1-p2')                   same shape as compare_depicts
+#     matrix.compare_depicted('dog', 'bird', level = 'space')  same shape as compare_depicted
+#     matrix.top_pairs(k = 20, level = 'space')                most alike pairs of spaces
+#
+# A unit contains what PLODResource.depicts_concepts() counts for it: every
+# artwork component that is part of / on the surface of / spatially within it.
+# Storage is numpy CSR arrays; scipy.sparse is used for the block products
+# of pairwise() and top_pairs() when it is installed.
+
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+from .client import get_client
+from .hierarchy import HierarchyIndex, get_hierarchy_index
+
+try:
+    import scipy.sparse as sparse
+except ImportError:
+    sparse = None
+
+
+PLOD = 'urn:p-lod:id:'
+
+LEVELS = ('space', 'property', 'feature')
+
+METRICS = ('jaccard', 'cosine')
+
+# rows per block when comparing every unit with every other
+BLOCK_SIZE = 256
+
+
+def _short(urn):
+    return urn[len(PLOD):] if urn.startswith(PLOD) else urn
+
+
+class DepictionMatrix(object):
+
+    def __init__(self, client = None, levels = LEVELS):
+        self.levels = tuple(levels)
+        self._lock = threading.Lock()
+        self.rebuild(client)
+
+    def rebuild(self, client = None):
+        # (re)read depictions and spatial units from client, or the active backend
+        if client is None:
+            client = get_client()
+        endpoint = getattr(client, 'endpoint', None)
+
+        index = get_hierarchy_index()
+        if index is None or index.endpoint != endpoint:
+            index = HierarchyIndex(client)
+
+        types = ' '.join(f'p-lod:{level}' for level in self.levels)
+        variables, unit_rows = client.select(f"""
+PREFIX p-lod: <urn:p-lod:id:>
+SELECT ?unit ?type WHERE {{ VALUES ?type {{ {types} }} ?unit a ?type . }} ORDER BY ?unit""")
+        units, unit_types = [], []
+        for unit, rdf_type in unit_rows:
+            unit = _short(unit)
+            if not units or units[-1] != unit:
+                units.append(unit)
+                unit_types.append(_short(rdf_type))
+        unit_position = {u: i for i, u in enumerate(units)}
+
+        variables, rows = client.select("""
+PREFIX p-lod: <urn:p-lod:id:>
+SELECT ?component ?concept WHERE { ?component a p-lod:artwork-component . ?component p-lod:depicts ?concept . }""")
+        concepts = sorted(set(_short(concept) for component, concept in rows))
+        concept_position = {c: i for i, c in enumerate(concepts)}
+
+        concept_column, unit_column = [], []
+        for component, concept in rows:
+            c = concept_position[_short(concept)]
+            for unit in index.enclosing(_short(component)):
+                u = unit_position.get(unit)
+                if u is not None:
+                    concept_column.append(c)
+                    unit_column.append(u)
+
+        # for compare_depicted, where each concept is depicted as depicted_where
+        # finds it: by any component, along is-part-of+/created-on-surface-of/spatially-within*
+        unit_levels = defaultdict(set)
+        for unit, rdf_type in unit_rows:
+            unit_levels[_short(unit)].add(_short(rdf_type))
+        variables, rows = client.select("""
+PREFIX p-lod: <urn:p-lod:id:>
+SELECT ?part ?feature WHERE { ?part p-lod:created-on-surface-of ?feature . }""")
+        surfaces = defaultdict(set)
+        for part, feature in rows:
+            surfaces[_short(part)].add(_short(feature))
+        variables, rows = client.select("""
+PREFIX p-lod: <urn:p-lod:id:>
+SELECT ?component ?concept WHERE { ?component p-lod:depicts ?concept . }""")
+        depicted, where = defaultdict(set), {}
+        for component, concept in rows:
+            component = _short(component)
+            if component not in where:
+                where[component] = set(u for part in index.ancestors(component, 'is-part-of') for f in surfaces.get(part, ())
+                                       for u in index.ancestors(f, 'spatially-within', include_self = True) if u in unit_levels)
+            depicted[_short(concept)] |= where[component]
+        # concepts reached through has-pompeian-wall-painting-style are left to the query
+        variables, rows = client.select("""
+PREFIX p-lod: <urn:p-lod:id:>
+SELECT DISTINCT ?style WHERE { ?feature p-lod:has-pompeian-wall-painting-style ?style . }""")
+        styles = frozenset(_short(style) for (style,) in rows)
+
+        # (concept, unit) pairs -> counts, concept-major
+        n_units = len(units)
+        keys, counts = np.unique(np.array(concept_column, dtype = np.int64) * max(n_units, 1)
+                                 + np.array(unit_column, dtype = np.int64), return_counts = True)
+        by_concept = (np.bincount(keys // max(n_units, 1), minlength = len(concepts)), keys % max(n_units, 1), counts)
+        order = np.lexsort((keys // max(n_units, 1), keys % max(n_units, 1)))
+        by_unit = (np.bincount(keys[order] % max(n_units, 1), minlength = n_units), keys[order] // max(n_units, 1), counts[order])
+
+        state = {'units': units,
+                 # for depicted_units(): concepts under concepts (broader),
+                 # concept -> units it is depicted in, unit -> its levels
+                 'hierarchy': index,
+                 'depicted': {c: frozenset(units) for c, units in depicted.items()},
+                 'unit_levels': dict(unit_levels),
+                 'styles': styles,
+                 'unit_types': np.array(unit_types, dtype = object),
+                 'unit_position': unit_position,
+                 'concepts': concepts,
+                 'concept_position': concept_position,
+                 # CSR: concept -> units, unit -> concepts
+                 'concept_indptr': np.concatenate([[0], np.cumsum(by_concept[0])]),
+                 'concept_units': by_concept[1],
+                 'concept_counts': by_concept[2],
+                 'unit_indptr': np.concatenate([[0], np.cumsum(by_unit[0])]),
+                 'unit_concepts': by_unit[1],
+                 'unit_counts': by_unit[2]}
+        # per unit: number of distinct concepts, and norm of the count vector
+        state['sizes'] = np.diff(state['unit_indptr'])
+        state['norms'] = np.sqrt(np.bincount(keys[order] % max(n_units, 1), weights = counts[order].astype(float) ** 2,
+                                             minlength = n_units))
+
+        with self._lock:
+            self.endpoint = endpoint
+            self._state = state
+        return self
+
+    @property
+    def units(self):
+        return self._state['units']
+
+    @property
+    def concepts(self):
+        return self._state['concepts']
+
+    @property
+    def shape(self):
+        # (concepts, units)
+        return len(self._state['concepts']), len(self._state['units'])
+
+    def _unit(self, identifier):
+        # None is an unknown PLODResource's identifier
+        try:
+            return self._state['unit_position'][_short(identifier) if identifier is not None else None]
+        except KeyError:
+            raise KeyError(f"{identifier} is not a {'/'.join(self.levels)} in the depiction matrix") from None
+
+    def _row(self, u):
+        # (concept positions, counts) for unit position u
+        s = self._state
+        start, end = s['unit_indptr'][u], s['unit_indptr'][u + 1]
+        return s['unit_concepts'][start:end], s['unit_counts'][start:end]
+
+    def to_sparse(self):
+        # scipy.sparse csr_matrix, concepts x units
+        if sparse is None:
+            raise ImportError("to_sparse() needs scipy")
+        s = self._state
+        return sparse.csr_matrix((s['concept_counts'], s['concept_units'], s['concept_indptr']), shape = self.shape)
+
+    def concepts_of(self, unit):
+        # {concept: number of components depicting it} for a unit
+        concepts, counts = self._row(self._unit(unit))
+        return {self._state['concepts'][c]: int(n) for c, n in zip(concepts, counts)}
+
+    def units_depicting(self, concept, level = None):
+        # {unit: number of components} for every unit depicting concept
+        s = self._state
+        c = s['concept_position'].get(_short(concept))
+        if c is None:
+            return {}
+        start, end = s['concept_indptr'][c], s['concept_indptr'][c + 1]
+        units, counts = s['concept_units'][start:end], s['concept_counts'][start:end]
+        if level is not None:
+            keep = s['unit_types'][units] == level
+            units, counts = units[keep], counts[keep]
+        return {s['units'][u]: int(n) for u, n in zip(units, counts)}
+
+    def depicted_units(self, concept, level):
+        # units of level where concept, or a concept under it, is depicted, as
+        # PLODResource.depicted_where() finds them
+        s = self._state
+        if level not in self.levels:
+            raise KeyError(f"the depiction matrix has no {level} units")
+        if concept is None:
+            raise KeyError("an unknown resource is not in the depiction matrix")
+        concept = _short(concept)
+        if concept in s['styles']:
+            raise KeyError(f"{concept} is a wall painting style")
+        concepts = [c for c in s['hierarchy'].descendants(concept, include_self = True) if c in s['depicted']]
+        if not concepts:
+            raise KeyError(f"{concept} is not depicted in the depiction matrix")
+        return set(u for c in concepts for u in s['depicted'][c] if level in s['unit_levels'][u])
+
+    def _scores(self, u, metric):
+        # similarity of unit position u to every unit, as one array
+        if metric not in METRICS:
+            raise ValueError(f"metric must be one of {METRICS}")
+        s = self._state
+        concepts, counts = self._row(u)
+        starts, ends = s['concept_indptr'][concepts], s['concept_indptr'][concepts + 1]
+        lengths = ends - starts
+        positions = np.concatenate([np.arange(a, b) for a, b in zip(starts, ends)]) if len(concepts) else np.array([], dtype = np.int64)
+        others = s['concept_units'][positions]
+        n = len(s['units'])
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            if metric == 'jaccard':
+                shared = np.bincount(others, minlength = n)
+                scores = shared / (s['sizes'][u] + s['sizes'] - shared)
+            else:
+                dot = np.bincount(others, weights = np.repeat(counts, lengths) * s['concept_counts'][positions], minlength = n)
+                scores = dot / (s['norms'][u] * s['norms'])
+        return np.nan_to_num(scores)
+
+    def similarity(self, left, right, metric = 'jaccard'):
+        return float(self._scores(self._unit(left), metric)[self._unit(right)])
+
+    def most_similar(self, unit, k = 10, metric = 'jaccard', level = None):
+        # the k units whose depictions are most like unit's, best first.
+        # level: type of unit to consider, default unit's own type
+        s = self._state
+        u = self._unit(unit)
+        scores = self._scores(u, metric)
+        candidates = np.flatnonzero((s['unit_types'] == (level or s['unit_types'][u])) & (scores > 0))
+        candidates = candidates[candidates != u]
+        best = candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+        return [{'urn': PLOD + s['units'][v], 'type': PLOD + s['unit_types'][v], 'score': float(scores[v])} for v in best]
+
+    def compare(self, left, right):
+        # concepts only left depicts, both depict, only right depicts
+        left_concepts = set(self.concepts_of(left))
+        right_concepts = set(self.concepts_of(right))
+        return {"left_urn": PLOD + _short(left),
+                "difference_left": sorted(PLOD + c for c in left_concepts - right_concepts),
+                "intersection": sorted(PLOD + c for c in left_concepts & right_concepts),
+                "difference_right": sorted(PLOD + c for c in right_concepts - left_concepts),
+                "right_urn": PLOD + _short(right)}
+
+    def compare_depicted(self, left, right, level = 'space'):
+        # units of level only left is depicted in, both are, only right is
+        left_units = self.depicted_units(left, level)
+        right_units = self.depicted_units(right, level)
+        return {"left_urn": PLOD + _short(left),
+                "difference_left": sorted(PLOD + u for u in left_units - right_units),
+                "intersection": sorted(PLOD + u for u in left_units & right_units),
+                "difference_right": sorted(PLOD + u for u in right_units - left_units),
+                "right_urn": PLOD + _short(right)}
+
+    def _block_scores(self, rows, columns, metric):
+        # rows x columns similarity array for unit positions
+        if sparse is None:
+            return np.vstack([self._scores(u, metric)[columns] for u in rows]) if len(rows) else np.zeros((0, len(columns)))
+        if metric not in METRICS:
+            raise ValueError(f"metric must be one of {METRICS}")
+        s = self._state
+        units = sparse.csr_matrix((s['unit_counts'], s['unit_concepts'], s['unit_indptr']), shape = (len(s['units']), len(s['concepts'])))
+        a, b = units[rows], units[columns]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            if metric == 'jaccard':
+                a.data[:] = 1
+                b.data[:] = 1
+                shared = (a @ b.T).toarray()
+                scores = shared / (s['sizes'][rows][:, None] + s['sizes'][columns][None, :] - shared)
+            else:
+                scores = (a @ b.T).toarray() / np.outer(s['norms'][rows], s['norms'][columns])
+        return np.nan_to_num(scores)
+
+    def pairwise(self, units = None, metric = 'jaccard', level = None):
+        # (unit identifiers, square array of their similarities); default every unit of level
+        s = self._state
+        if units is None:
+            positions = np.flatnonzero(s['unit_types'] == level) if level else np.arange(len(s['units']))
+        else:
+            positions = np.array([self._unit(u) for u in units], dtype = np.int64)
+        return [s['units'][u] for u in positions], self._block_scores(positions, positions, metric)
+
+    def top_pairs(self, k = 10, metric = 'jaccard', level = 'space'):
+        # the k most alike pairs of units of level, best first, compared a block at a time
+        s = self._state
+        positions = np.flatnonzero(s['unit_types'] == level) if level else np.arange(len(s['units']))
+        best = []   # (score, left, right)
+        for start in range(0, len(positions), BLOCK_SIZE):
+            rows = positions[start:start + BLOCK_SIZE]
+            scores = self._block_scores(rows, positions, metric)
+            # each pair once: only columns after the row
+            scores[np.arange(len(rows))[:, None] + start >= np.arange(len(positions))[None, :]] = 0
+            flat = scores.ravel()
+            top = np.flatnonzero(flat > 0)
+            if len(top) > k:
+                top = top[np.argpartition(-flat[top], k - 1)[:k]]
+            best.extend((float(flat[i]), rows[i // len(positions)], positions[i % len(positions)]) for i in top)
+            best.sort(key = lambda b: (-b[0], b[1], b[2]))
+            del best[k:]
+        return [{'left_urn': PLOD + s['units'][a], 'right_urn': PLOD + s['units'][b], 'score': score} for score, a, b in best]
+
+    def __repr__(self):
+        return f'DepictionMatrix({self.endpoint!r}, {self.shape[0]} concepts x {self.shape[1]} units, {len(self._state["concept_units"])} non-zero)'
+
+
+_matrix = None
+
+
+def get_depiction_matrix():
+    return _matrix
+
+
+def use_depiction_matrix(enabled = True, client = None, levels = LEVELS):
+    # build the matrix from client (default: the active backend). compare_depicts
+    # and compare_depicted then answer from it for the units and concepts it
+    # holds. Call again, or
+    # get_depiction_matrix().rebuild(), after the data changes.
+    global _matrix
+    _matrix = DepictionMatrix(client, levels = levels) if enabled else None
+    return _matrix
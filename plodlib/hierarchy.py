@@ -0,0 +1,141 @@
+# In-process index of the P-LOD hierarchies.
+#
+# broader, spatially-within, is-part-of and created-on-surface-of are read once
+# from the active backend and their ancestor/descendant closures kept in
+# memory. With an index in use (use_hierarchy_index()), PLODResource answers
+# the transitive part of conceptual_ancestors, conceptual_descendants, narrower,
+# spatial_ancestors and depicts_concepts from it and only asks the triplestore
+# for labels, types and the like.
+
+import threading
+from collections import defaultdict
+
+from .client import get_client
+
+
+PLOD = 'urn:p-lod:id:'
+
+PREDICATES = ('broader', 'spatially-within', 'is-part-of', 'created-on-surface-of')
+
+# above this many identifiers a VALUES block is no cheaper than the property path
+MAX_VALUES = 2000
+
+
+def _short(urn):
+    return urn[len(PLOD):] if urn.startswith(PLOD) else None
+
+
+def values_clause(variable, identifiers):
+    # VALUES ?variable { <urn:p-lod:id:a> <urn:p-lod:id:b> ... }
+    terms = ' '.join(f'<{PLOD}{i}>' for i in sorted(identifiers))
+    return f'VALUES ?{variable} {{ {terms} }}'
+
+
+class HierarchyIndex(object):
+
+    def __init__(self, client = None):
+        self._lock = threading.Lock()
+        self.rebuild(client)
+
+    def rebuild(self, client = None):
+        # (re)read the hierarchy edges from client, or the active backend
+        if client is None:
+            client = get_client()
+
+        parents = {p: defaultdict(set) for p in PREDICATES}
+        predicates = ' '.join(f'p-lod:{p}' for p in PREDICATES)
+        variables, rows = client.select(f"""
+PREFIX p-lod: <urn:p-lod:id:>
+SELECT ?s ?p ?o WHERE {{ VALUES ?p {{ {predicates} }} ?s ?p ?o . }}""")
+        for s, p, o in rows:
+            s, p, o = _short(s), _short(p), _short(o)
+            if s is not None and o is not None:
+                parents[p][s].add(o)
+
+        variables, rows = client.select("""
+PREFIX p-lod: <urn:p-lod:id:>
+SELECT ?s WHERE { ?s a p-lod:feature . }""")
+        features = frozenset(_short(row[0]) for row in rows) - {None}
+
+        ancestors = {p: self._closure(parents[p]) for p in PREDICATES}
+        descendants = {}
+        for p in PREDICATES:
+            d = defaultdict(set)
+            for node, above in ancestors[p].items():
+                for a in above:
+                    d[a].add(node)
+            descendants[p] = {k: frozenset(v) for k, v in d.items()}
+
+        with self._lock:
+            self.endpoint = getattr(client, 'endpoint', None)
+            self._ancestors = ancestors
+            self._descendants = descendants
+            self.features = features
+        return self
+
+    @staticmethod
+    def _closure(parents):
+        # node -> every node reachable by following parents one or more times.
+        # Iterative and cycle-safe; P-LOD hierarchies are shallow.
+        closure = {}
+        for node in parents:
+            seen = set()
+            stack = list(parents[node])
+            while stack:
+                n = stack.pop()
+                if n not in seen:
+                    seen.add(n)
+                    stack.extend(parents.get(n, ()))
+            closure[node] = frozenset(seen)
+        return closure
+
+    def ancestors(self, identifier, predicate = 'broader', include_self = False):
+        # p-lod:identifier p-lod:predicate+ ?urn  (predicate* with include_self)
+        found = self._ancestors[predicate].get(identifier, frozenset())
+        return found | {identifier} if include_self else found
+
+    def descendants(self, identifier, predicate = 'broader', include_self = False):
+        # ?urn p-lod:predicate+ p-lod:identifier  (predicate* with include_self)
+        found = self._descendants[predicate].get(identifier, frozenset())
+        return found | {identifier} if include_self else found
+
+    def is_under(self, identifier, ancestor, predicate = 'broader'):
+        return ancestor in self._ancestors[predicate].get(identifier, ())
+
+    def enclosing(self, identifier):
+        # everything spatial_ancestors reports: identifier spatially-within* ?urn,
+        # plus the same for every feature it is part of / created on the surface of
+        units = set(self.ancestors(identifier, 'spatially-within', include_self = True))
+        for part in self.ancestors(identifier, 'is-part-of', include_self = True):
+            for feature in self.ancestors(part, 'created-on-surface-of', include_self = True):
+                if feature in self.features:
+                    units |= self.ancestors(feature, 'spatially-within', include_self = True)
+        return frozenset(units)
+
+    def contents(self, identifier):
+        # ?c is-part-of*/created-on-surface-of*/spatially-within* identifier
+        found = set()
+        for unit in self.descendants(identifier, 'spatially-within', include_self = True):
+            for surface in self.descendants(unit, 'created-on-surface-of', include_self = True):
+                found |= self.descendants(surface, 'is-part-of', include_self = True)
+        return frozenset(found)
+
+    def __repr__(self):
+        sizes = ', '.join(f'{p}: {len(self._ancestors[p])}' for p in PREDICATES)
+        return f'HierarchyIndex({self.endpoint!r}, {sizes})'
+
+
+_index = None
+
+
+def get_hierarchy_index():
+    return _index
+
+
+def use_hierarchy_index(enabled = True, client = None):
+    # build an index from client (default: the active backend) and use it for
+    # every PLODResource. use_hierarchy_index(False) goes back to property paths.
+    # Call again, or get_hierarchy_index().rebuild(), after the data changes.
+    global _index
+    _index = HierarchyIndex(client) if enabled else None
+    return _index
@@ -0,0 +1,258 @@
+# Instrumentation: observers called for every SPARQL query, LUNA lookup and
+# PLODResource method call.
+#
+#     def slow(event):
+#         if event['kind'] == 'method' and event['total_s'] > 1:
+#             print(event['method'], event['identifier'], event['total_s'])
+#     plodlib.add_observer(slow)
+#
+#     stats = plodlib.QueryStats()
+#     with plodlib.observing(stats):
+#         PLODResource('r1').depicts_concepts()
+#     stats.snapshot()            {'depicts_concepts': {'calls': 1, 'queries': 1, ...}, ...}
+#
+#     plodlib.add_observer(plodlib.log_events())      to the 'plodlib' logger
+#
+# An observer is any callable taking one event, a dict:
+#
+#   kind 'sparql'   one query sent to the backend:
+#                   endpoint, query (without the PREFIXES every query gets),
+#                   network_s (sending and waiting for the answer; for a
+#                   LocalGraph, evaluating it), decode_s (parsing the answer),
+#                   rows, bytes (size of the answer; None for a LocalGraph)
+#   kind 'luna'     one LUNA lookup: the same keys, query is the LUNA media id
+#   kind 'method'   one PLODResource method call (or 'load' / 'many' for
+#                   fetching resources): total_s, process_s (time in the
+#                   method's own code: building queries, DataFrames, merging
+#                   results), and the queries, network_s, decode_s and bytes of
+#                   every query and lookup it made, nested method calls included.
+#                   rows is the length of the returned list (1 for anything else).
+#
+# Every event also has method and identifier (of the method call it happened
+# in, None outside one) and error (repr of the exception, None if it worked).
+# Results served from the result cache make no events. Lookups run
+# concurrently, so their network_s can add up to more than total_s.
+#
+# With no observers nothing is timed or recorded.
+
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+
+_observers = ()
+_observers_lock = threading.Lock()
+
+# the method call queries are made in
+_current = contextvars.ContextVar('plodlib_method_call', default = None)
+
+
+def add_observer(observer):
+    global _observers
+    with _observers_lock:
+        _observers = _observers + (observer,)
+    return observer
+
+
+def remove_observer(observer):
+    global _observers
+    with _observers_lock:
+        _observers = tuple(o for o in _observers if o is not observer)
+
+
+@contextmanager
+def observing(observer):
+    # observer for the duration of a with block
+    add_observer(observer)
+    try:
+        yield observer
+    finally:
+        remove_observer(observer)
+
+
+def _notify(event):
+    for observer in _observers:
+        try:
+            observer(event)
+        except Exception:
+            # a broken observer mustn't break the query it was told about
+            pass
+
+
+class _Quiet(object):
+    # stands in for _Request and _MethodCall when nothing is observing
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def fetched(self, nbytes = None):
+        pass
+
+    def decoded(self, rows):
+        pass
+
+    def processed(self, seconds):
+        pass
+
+    def returned(self, result):
+        return result
+
+
+_quiet = _Quiet()
+
+
+class _Request(object):
+
+    def __init__(self, kind, endpoint, query):
+        call = _current.get()
+        self.call = call
+        self.event = {'kind': kind, 'method': call and call.event['method'], 'identifier': call and call.event['identifier'],
+                      'endpoint': endpoint, 'query': query, 'network_s': 0.0, 'decode_s': 0.0,
+                      'rows': None, 'bytes': None, 'error': None}
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.fetched_at = None
+        return self
+
+    def fetched(self, nbytes = None):
+        # the answer has arrived; decoding starts
+        self.fetched_at = time.perf_counter()
+        self.event['bytes'] = nbytes
+
+    def decoded(self, rows):
+        self.event['rows'] = rows
+
+    def __exit__(self, exc_type, exc, traceback):
+        end = time.perf_counter()
+        fetched = self.fetched_at or end
+        self.event['network_s'] = fetched - self.start
+        self.event['decode_s'] = end - fetched
+        if exc is not None:
+            self.event['error'] = repr(exc)
+        if self.call is not None:
+            self.call.add(self.event)
+        _notify(self.event)
+        return False
+
+
+def request(kind, endpoint, query):
+    # context manager timing one query or lookup:
+    #
+    #     with request('sparql', endpoint, query_str) as r:
+    #         response = send(...)
+    #         r.fetched(len(response.content))
+    #         rows = decode(response)
+    #         r.decoded(len(rows))
+    return _Request(kind, endpoint, query) if _observers else _quiet
+
+
+class _MethodCall(object):
+
+    def __init__(self, method, identifier):
+        self.event = {'kind': 'method', 'method': method, 'identifier': identifier,
+                      'total_s': 0.0, 'process_s': 0.0, 'queries': 0, 'network_s': 0.0, 'decode_s': 0.0,
+                      'rows': None, 'bytes': 0, 'error': None}
+        self._lock = threading.Lock()
+
+    def add(self, event):
+        # a query or lookup made during this call (possibly from another thread)
+        with self._lock:
+            self.event['queries'] += event.get('queries', 1)
+            self.event['network_s'] += event['network_s']
+            self.event['decode_s'] += event['decode_s']
+            self.event['bytes'] += event['bytes'] or 0
+
+    def processed(self, seconds):
+        self.event['process_s'] += seconds
+
+    def returned(self, result):
+        self.event['rows'] = 0 if result is None else len(result) if isinstance(result, (list, tuple)) else 1
+        return result
+
+    def __enter__(self):
+        self.parent = _current.get()
+        self._token = _current.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.event['total_s'] = time.perf_counter() - self.start
+        _current.reset(self._token)
+        if exc is not None:
+            self.event['error'] = repr(exc)
+        if self.parent is not None:
+            self.parent.add(self.event)
+        _notify(self.event)
+        return False
+
+
+def method_call(method, identifier):
+    # context manager around one method call; the queries made inside it are
+    # attributed to it
+    return _MethodCall(method, identifier) if _observers else _quiet
+
+
+class QueryStats(object):
+    # observer keeping Prometheus-style counters per method (or, for queries
+    # made outside any method, per event kind)
+
+    FIELDS = ('calls', 'errors', 'queries', 'rows', 'bytes', 'total_s', 'process_s', 'network_s', 'decode_s')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def __call__(self, event):
+        if event['method'] is not None and event['kind'] != 'method':
+            # counted in the method's own event
+            return
+        name = event['method'] or event['kind']
+        with self._lock:
+            counters = self._counters.setdefault(name, dict.fromkeys(self.FIELDS, 0))
+            counters['calls'] += 1
+            counters['errors'] += event['error'] is not None
+            counters['queries'] += event.get('queries', 1)
+            counters['rows'] += event['rows'] or 0
+            counters['bytes'] += event['bytes'] or 0
+            for field in ('total_s', 'process_s'):
+                counters[field] += event.get(field, 0.0)
+            counters['network_s'] += event['network_s']
+            counters['decode_s'] += event['decode_s']
+
+    def snapshot(self):
+        # {method: counters}
+        with self._lock:
+            return {name: dict(counters) for name, counters in self._counters.items()}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+    def __repr__(self):
+        return f"QueryStats({len(self._counters)} methods)"
+
+
+def log_events(logger = None, level = logging.DEBUG):
+    # an observer logging each event on one line, by default to the 'plodlib' logger
+    logger = logger or logging.getLogger('plodlib')
+
+    def log(event):
+        if not logger.isEnabledFor(level):
+            return
+        if event['kind'] == 'method':
+            logger.log(level, "%s(%s) %.1f ms (process %.1f ms, %d queries, network %.1f ms, decode %.1f ms) %s rows %d bytes%s",
+                       event['method'], event['identifier'], event['total_s'] * 1000, event['process_s'] * 1000,
+                       event['queries'], event['network_s'] * 1000, event['decode_s'] * 1000, event['rows'], event['bytes'],
+                       f" failed: {event['error']}" if event['error'] else '')
+        else:
+            logger.log(level, "%s %s(%s) network %.1f ms, decode %.1f ms, %s rows, %s bytes%s\n%s",
+                       event['kind'], event['method'], event['identifier'], event['network_s'] * 1000, event['decode_s'] * 1000,
+                       event['rows'], event['bytes'], f" failed: {event['error']}" if event['error'] else '', event['query'])
+
+    return log
@@ -0,0 +1,315 @@
+# Denormalized location table: every artwork component with the feature it
+# is on and every spatial unit enclosing that feature, plus the concepts it
+# depicts and its best images.
+#
+# depicts_concepts, depicted_where and gather_images all walk the same
+# is-part-of / created-on-surface-of / spatially-within chain on every call.
+# With a table in use they filter and group the table instead, and send no
+# queries:
+#
+#     table = plodlib.use_location_table()
+#     table.locate('r1-i1-p1-space-1-feature-1-ac-2')     component -> feature, space, property, insula, region
+#     table.to_frame()                                    the whole table as a DataFrame
+#
+# The answers are the ones the SPARQL queries give, row for row. Only the
+# order of rows the queries leave unordered, and of the values inside
+# depicts_concepts' within_spatial_units_depict, can differ.
+# Build it from the data once (several queries, one per predicate) and call
+# rebuild() after the data changes.
+
+import itertools
+import threading
+from collections import defaultdict
+
+from .client import get_client
+from .decode import numeric_columns, records
+from .hierarchy import HierarchyIndex, get_hierarchy_index
+
+
+PLOD = 'urn:p-lod:id:'
+RDF_TYPE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+RDFS_LABEL = 'http://www.w3.org/2000/01/rdf-schema#label'
+
+# the spatial levels, innermost first
+LEVELS = ('feature', 'space', 'property', 'insula', 'region')
+
+LUNA_FIELDS = ('x-luna-record-id', 'x-luna-media-id', 'x-luna-batch-id', 'x-luna-description', 'x-luna-url-3')
+
+# predicate -> what the table keeps of it
+FACTS = {RDF_TYPE: 'types', RDFS_LABEL: 'labels',
+         PLOD + 'spatially-within': 'within', PLOD + 'geojson': 'geojson',
+         PLOD + 'created-on-surface-of': 'surfaces', PLOD + 'depicts': 'depicts',
+         PLOD + 'best-image': 'best_images', PLOD + 'has-pompeian-wall-painting-style': 'styles'}
+
+
+def _short(urn):
+    return urn[len(PLOD):] if urn.startswith(PLOD) else urn
+
+
+def _urn(identifier):
+    return identifier if identifier.startswith(('http:', 'https:', 'urn:')) else PLOD + identifier
+
+
+class LocationTable(object):
+
+    def __init__(self, client = None):
+        self._lock = threading.Lock()
+        self.rebuild(client)
+
+    def rebuild(self, client = None):
+        # (re)read the table from client, or the active backend
+        if client is None:
+            client = get_client()
+        endpoint = getattr(client, 'endpoint', None)
+
+        index = get_hierarchy_index()
+        if index is None or index.endpoint != endpoint:
+            index = HierarchyIndex(client)
+
+        # kind -> short subject -> [values as the queries return them]
+        facts = {kind: defaultdict(list) for kind in FACTS.values()}
+        for predicate, kind in FACTS.items():
+            variables, rows = client.select(f"SELECT ?s ?o WHERE {{ ?s <{predicate}> ?o . }}")
+            for s, o in rows:
+                facts[kind][_short(s)].append(o)
+
+        # image -> every combination of its LUNA fields; an image missing one has none
+        luna = {}
+        for field in LUNA_FIELDS:
+            variables, rows = client.select(f"SELECT ?s ?o WHERE {{ ?s <{PLOD}{field}> ?o . }}")
+            values = defaultdict(list)
+            for s, o in rows:
+                values[_short(s)].append(o)
+            luna[field] = values
+        images = {}
+        for image in luna[LUNA_FIELDS[0]]:
+            if all(image in luna[field] for field in LUNA_FIELDS):
+                images[image] = list(itertools.product(*(luna[field][image] for field in LUNA_FIELDS)))
+
+        # is-part-of+ and spatially-within* come from the index; created-on-surface-of
+        # is used one step at a time, as the queries do
+        types = {s: set(_short(t) for t in ts) for s, ts in facts['types'].items()}
+        surfaces = {s: [_short(o) for o in os] for s, os in facts['surfaces'].items()}
+
+        def surfaces_of(parts):
+            return [f for p in parts for f in surfaces.get(p, ())]
+
+        # component -> (feature, reached through is-part-of+) for every is-part-of*/created-on-surface-of
+        components = set(facts['depicts']) | set(facts['best_images']) | set(surfaces)
+        located = {}
+        for c in components:
+            found = [(f, False) for f in surfaces.get(c, ())]
+            found += [(f, True) for f in surfaces_of(sorted(index.ancestors(c, 'is-part-of')))]
+            if found:
+                located[c] = found
+
+        # feature -> components on it through is-part-of+ (gather_images for a feature)
+        by_surface = defaultdict(set)
+        for c, found in located.items():
+            for f, through_part in found:
+                if through_part:
+                    by_surface[f].add(c)
+
+        # image -> features it depicts
+        depicted_features = defaultdict(list)
+        for s, os in facts['depicts'].items():
+            if s in images:
+                depicted_features[s] = [_short(o) for o in os if 'feature' in types.get(_short(o), ())]
+
+        # concept -> components depicting it or something narrower
+        depicting = defaultdict(set)
+        for c, os in facts['depicts'].items():
+            for o in os:
+                o = _short(o)
+                for concept in index.ancestors(o, 'broader', include_self = True):
+                    depicting[concept].add(c)
+
+        with self._lock:
+            self.endpoint = endpoint
+            self._index = index
+            self._facts = facts
+            self._types = types
+            self._images = images
+            self._located = located
+            self._by_surface = by_surface
+            self._depicted_features = depicted_features
+            self._depicting = depicting
+        return self
+
+    # the table itself
+
+    def _enclosing(self, feature):
+        # {level: [units]} for the feature and everything it is spatially within
+        found = defaultdict(list)
+        for unit in sorted(self._index.ancestors(feature, 'spatially-within', include_self = True)):
+            for level in LEVELS:
+                if level in self._types.get(unit, ()):
+                    found[level].append(unit)
+        return found
+
+    def locate(self, component):
+        # one row per feature the component (or a component it is part of) is on:
+        # {'component', 'feature', 'space', 'property', 'insula', 'region', 'concepts', 'best_images'}
+        component = _short(component)
+        concepts = sorted(_short(o) for o in self._facts['depicts'].get(component, ()))
+        best_images = sorted(_short(o) for o in self._facts['best_images'].get(component, ()))
+        rows = []
+        for feature in sorted(set(f for f, _ in self._located.get(component, ()))):
+            enclosing = self._enclosing(feature)
+            row = {'component': component}
+            for level in LEVELS:
+                row[level] = enclosing[level][0] if enclosing[level] else None
+            row['feature'] = feature
+            row.update(concepts = concepts, best_images = best_images)
+            rows.append(row)
+        return rows
+
+    def rows(self):
+        # every artwork component's locate() rows
+        components = sorted(c for c in self._located if 'artwork-component' in self._types.get(c, ()))
+        return [row for c in components for row in self.locate(c)]
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame(self.rows(), columns = ['component'] + list(LEVELS) + ['concepts', 'best_images'])
+
+    # helpers for the methods
+
+    def _values(self, kind, subject):
+        # values of a fact, [None] if there are none (an OPTIONAL that didn't match)
+        return self._facts[kind].get(subject) or [None]
+
+    def _image_rows(self, image):
+        # LUNA field combinations x labels, for an image that has every field
+        return [(fields, label) for fields in self._images.get(image, ()) for label in self._values('labels', image)]
+
+    def _part_features(self, component):
+        # is-part-of+/created-on-surface-of
+        return [f for f, through_part in self._located.get(component, ()) if through_part]
+
+    # the methods, answered from the table
+
+    def depicts_concepts(self, identifier):
+        if identifier is None:
+            # an unknown resource: the queries match nothing
+            return []
+        identifier = _short(identifier)
+        types = self._types.get(identifier, set())
+        contents = sorted(self._index.contents(identifier))
+
+        groups = {}   # (urn, label) -> within values, None where the OPTIONALs didn't match
+        for c in contents:
+            if 'artwork-component' not in self._types.get(c, ()):
+                continue
+            surfaces = [f for f, _ in self._located.get(c, ())]
+            if 'property' in types:
+                within = [_urn(s) for f in surfaces for s in sorted(self._index.ancestors(f, 'spatially-within'))
+                          if 'space' in self._types.get(s, ()) and self._index.is_under(s, identifier, 'spatially-within')]
+            elif 'space' in types:
+                within = [_urn(f) for f in surfaces
+                          if 'feature' in self._types.get(f, ()) and self._index.is_under(f, identifier, 'spatially-within')]
+            elif 'feature' in types:
+                within = self._facts['best_images'].get(c, []) if identifier in surfaces else []
+            else:
+                within = []
+            for urn in self._facts['depicts'].get(c, ()):
+                for label in self._values('labels', _short(urn)):
+                    groups.setdefault((urn, label), []).extend(within or [None])
+
+        return numeric_columns([{'urn': urn, 'label': label, 'count': str(len(within)),
+                                 'within_spatial_units_depict': '||'.join(w for w in within if w is not None)}
+                                for (urn, label), within in sorted(groups.items(), key = lambda g: g[0][0])])
+
+    def depicted_where(self, identifier, level_of_detail = 'feature'):
+        if identifier is None:
+            return []
+        identifier = _short(identifier)
+        components = set(self._depicting.get(identifier, ()))
+        for feature, styles in self._facts['styles'].items():
+            if PLOD + identifier in styles:
+                # ^has-pompeian-wall-painting-style/^created-on-surface-of/^is-part-of+
+                components |= set(c for c, found in self._located.items() for f, through_part in found if through_part and f == feature)
+
+        variables = ['urn', 'type', 'label', 'within', 'best_image', 'l_record', 'l_media', 'l_batch',
+                     'l_description', 'l_img_url', 'geojson']
+        seen, rows = set(), []
+        for c in sorted(components):
+            # OPTIONAL: only best images with every LUNA field, else one row without
+            images = [(b, fields) for b in sorted(self._facts['best_images'].get(c, ()))
+                      for fields in self._images.get(_short(b), ())] or [(None, (None,) * len(LUNA_FIELDS))]
+            for feature in self._part_features(c):
+                for unit in sorted(self._index.ancestors(feature, 'spatially-within', include_self = True)):
+                    if level_of_detail not in self._types.get(unit, ()):
+                        continue
+                    for t, label, within, geojson in itertools.product(
+                            self._values('types', unit), self._values('labels', unit),
+                            self._values('within', unit), self._values('geojson', unit)):
+                        for image, fields in images:
+                            row = (_urn(unit), t, label, within, image) + tuple(fields) + (geojson,)
+                            if row not in seen:
+                                seen.add(row)
+                                rows.append(row)
+
+        # ORDER BY ?within: unbound first
+        rows.sort(key = lambda r: (r[3] is not None, r[3] or ''))
+        return records(variables, rows, as_str = True)
+
+    def gather_images(self, identifier, rdf_type):
+        # gather_images for a concept, space, property, insula, region or feature
+        if identifier is None:
+            return []
+        identifier = _short(identifier)
+        seen, rows = set(), []
+
+        def add(row):
+            if row not in seen:
+                seen.add(row)
+                rows.append(row)
+
+        if rdf_type == 'concept':
+            variables = ['urn', 'label', 'best_image', 'l_record', 'l_media', 'l_batch', 'l_description', 'l_img_url', 'feature']
+            for c in sorted(self._depicting.get(identifier, ())):
+                features = [PLOD + f for f in self._part_features(c) if 'feature' in self._types.get(f, ())] or [None]
+                for b in self._facts['best_images'].get(c, ()):
+                    for fields, label in self._image_rows(_short(b)):
+                        for feature in features:
+                            add((b, label, 'true') + tuple(fields) + (feature,))
+            return records(variables, rows, as_str = True)
+
+        # (image, feature) pairs
+        pairs = []
+        if rdf_type == 'feature':
+            pairs += [(i, identifier) for i, features in self._depicted_features.items() if identifier in features]
+            pairs += [(_short(b), identifier) for c in sorted(self._by_surface.get(identifier, ()))
+                      for b in self._facts['best_images'].get(c, ())]
+        else:
+            pairs += [(i, f) for i, features in self._depicted_features.items() for f in features
+                      if self._index.is_under(f, identifier, 'spatially-within')]
+            for c in sorted(self._index.contents(identifier)):
+                features = [f for f in self._part_features(c) if 'feature' in self._types.get(f, ())]
+                pairs += [(_short(b), f) for b in self._facts['best_images'].get(c, ()) for f in features]
+
+        variables = ['urn', 'label', 'l_record', 'l_media', 'l_batch', 'l_img_url', 'feature', 'l_description']
+        for image, feature in pairs:
+            for (record, media, batch, description, url), label in self._image_rows(image):
+                add((_urn(image), label, record, media, batch, url, PLOD + feature, description))
+        return records(variables, rows)
+
+    def __repr__(self):
+        return f'LocationTable({self.endpoint!r}, {len(self._located)} located components, {len(self._images)} images)'
+
+
+_table = None
+
+
+def get_location_table():
+    return _table
+
+
+def use_location_table(enabled = True, client = None):
+    # build the table from client (default: the active backend) and answer
+    # depicts_concepts, depicted_where and gather_images from it.
+    # use_location_table(False) goes back to querying.
+    global _table
+    _table = LocationTable(client) if enabled else None
+    return _table
@@ -0,0 +1,243 @@
+# Image information from the UMass LUNA server.
+#
+# images_from_luna adds the current LUNA image URL and English description to
+# every image row. The lookups share one pooled requests.Session, time out
+# instead of hanging the page render, and run concurrently; a lookup that
+# fails leaves None in its row rather than failing the whole call.
+#
+# LUNA's answer for a given collection/record/media never really changes, so
+# with use_luna_store() the answers are kept in a SQLite file and LUNA is only
+# asked about media it hasn't seen (or whose entry is older than max_age).
+
+import contextvars
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import instrument
+
+
+LUNA_SEARCH_URL = 'https://umassamherst.lunaimaging.com/luna/servlet/as/fetchMediaSearch'
+LUNA_WORKERS = 8
+LUNA_TIMEOUT = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def luna_session():
+  global _session
+  if _session is None:
+    with _session_lock:
+      if _session is None:
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_connections = 1, pool_maxsize = LUNA_WORKERS))
+        _session = session
+  return _session
+
+
+def luna_tilde_val(luna_urn):
+  if luna_urn.startswith("urn:p-lod:id:luna_img_PALP"):
+    tilde_val = "14"
+
+  if luna_urn.startswith("urn:p-lod:id:luna_img_PPM"):
+    tilde_val = "16"
+
+  return tilde_val
+
+
+def luna_mid(luna_urn, l_record, l_media):
+  # LUNA's media id, e.g. umass~14~14~12345~67890
+  tilde_val = luna_tilde_val(luna_urn)
+  return f'umass~{tilde_val}~{tilde_val}~{l_record}~{l_media}'
+
+
+def fetch_luna_info(luna_urn, l_record, l_media, timeout = None):
+  # returns (image url, english description) for one LUNA image; both None if LUNA has nothing
+  img_src = None #default if no URLs present (probably means LUNA doesn't have image though triplestore thinks it does)
+  img_description = None
+
+  tilde_val = luna_tilde_val(luna_urn)
+  mid = luna_mid(luna_urn, l_record, l_media)
+
+  with instrument.request('luna', LUNA_SEARCH_URL, mid) as timing:
+    response = luna_session().get(LUNA_SEARCH_URL, params = {'mid': mid, 'fullData': 'true'},
+                                  timeout = timeout or LUNA_TIMEOUT)
+    timing.fetched(len(response.content))
+    luna_json = json.loads(response.text)
+    timing.decoded(len(luna_json))
+
+  if len(luna_json):
+
+    img_attributes = json.loads(luna_json[0]['attributes'])
+
+    if 'image_description_english' in img_attributes.keys():
+      img_description = img_attributes['image_description_english']
+    else:
+      try:
+        if   tilde_val == '14':
+          img_description = json.loads(luna_json[0]['fieldValues'])[2]['value']
+        elif tilde_val == '16':
+          img_description = json.loads(luna_json[0]['fieldValues'])[1]['value']
+        else:
+          img_description = f"unrecognized collection {tilde_val}"
+      except:
+        img_description = "Trying to get description failed"
+
+
+    if 'urlSize4' in img_attributes.keys(): # use size 4, sure, but only if there's nothing else
+      img_src = img_attributes['urlSize4']
+    if 'urlSize2' in img_attributes.keys(): # preferred
+      img_src = img_attributes['urlSize2']
+    elif 'urlSize3' in img_attributes.keys():
+      img_src = img_attributes['urlSize3']
+    else:
+      img_src = img_attributes['urlSize1']
+
+  return img_src, img_description
+
+
+def add_luna_info(row):
+  # row is a dict or pandas row with urn, l_record and l_media
+  row['l_img_url'], row['l_current_description'] = fetch_luna_info(row['urn'], row['l_record'], row['l_media'])
+  return row
+
+
+def _record_mid(record):
+  # None for urns that aren't from a known LUNA collection
+  try:
+    return luna_mid(record['urn'], record['l_record'], record['l_media'])
+  except Exception:
+    return None
+
+
+def _fetch_all(records, workers, timeout):
+  # fetch_luna_info for each record, concurrently and in order. None where the lookup failed.
+  def fetch(record):
+    try:
+      return fetch_luna_info(record['urn'], record['l_record'], record['l_media'], timeout = timeout)
+    except Exception:
+      return None
+
+  workers = workers or LUNA_WORKERS
+  if len(records) <= 1 or workers <= 1:
+    return [fetch(r) for r in records]
+  # in the caller's context, so the lookups are attributed to its method call
+  context = contextvars.copy_context()
+  with ThreadPoolExecutor(max_workers = min(workers, len(records))) as executor:
+    return list(executor.map(lambda record: context.copy().run(fetch, record), records))
+
+
+class LunaMetadataStore(object):
+  # SQLite table of LUNA answers keyed by media id (see luna_mid)
+
+  def __init__(self, path, max_age = None):
+    # max_age: seconds after which an entry is fetched again; None keeps entries forever
+    self.path = path
+    self.max_age = max_age
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(path, check_same_thread = False)
+    self._db.execute("""CREATE TABLE IF NOT EXISTS luna_media (
+                          mid TEXT PRIMARY KEY, urn TEXT, l_record TEXT, l_media TEXT,
+                          img_url TEXT, description TEXT, fetched REAL)""")
+    self._db.commit()
+
+  def get_many(self, mids):
+    # {mid: (img_url, description)} for the fresh entries among mids
+    mids = list(set(mids))
+    oldest = 0 if self.max_age is None else time.time() - self.max_age
+    found = {}
+    with self._lock:
+      for i in range(0, len(mids), 500):
+        chunk = mids[i:i + 500]
+        rows = self._db.execute(f"SELECT mid, img_url, description FROM luna_media WHERE fetched >= ? AND mid IN ({','.join('?' * len(chunk))})",
+                                [oldest] + chunk)
+        for mid, img_url, description in rows:
+          found[mid] = (img_url, description)
+    return found
+
+  def put_many(self, rows):
+    # rows of (record, (img_url, description)); record has urn, l_record, l_media
+    now = time.time()
+    with self._lock:
+      self._db.executemany("INSERT OR REPLACE INTO luna_media VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           [(luna_mid(r['urn'], r['l_record'], r['l_media']), r['urn'], str(r['l_record']), str(r['l_media']),
+                             img_url, description, now) for r, (img_url, description) in rows])
+      self._db.commit()
+
+  def lookup(self, records, workers = None, timeout = None):
+    # (img_url, description) for each record, asking LUNA only about media not in the store
+    mids = [_record_mid(r) for r in records]
+    found = self.get_many(m for m in mids if m is not None)
+
+    missing = {}
+    for mid, record in zip(mids, records):
+      if mid is not None and mid not in found:
+        missing.setdefault(mid, record)
+    if missing:
+      fetched = _fetch_all(list(missing.values()), workers, timeout)
+      fresh = [(r, info) for r, info in zip(missing.values(), fetched) if info is not None]
+      self.put_many(fresh)
+      found.update((luna_mid(r['urn'], r['l_record'], r['l_media']), info) for r, info in fresh)
+
+    return [found.get(mid) for mid in mids]
+
+  def preload(self, records, workers = None, timeout = None):
+    # fill the store for many images at once, e.g. every luna-image in the graph.
+    # Returns how many of them are now stored.
+    return sum(info is not None for info in self.lookup(records, workers = workers, timeout = timeout))
+
+  def refresh(self, older_than, workers = None, timeout = None):
+    # fetch again every entry fetched more than older_than seconds ago
+    with self._lock:
+      rows = self._db.execute("SELECT urn, l_record, l_media FROM luna_media WHERE fetched < ?",
+                              (time.time() - older_than,)).fetchall()
+    records = [{'urn': urn, 'l_record': l_record, 'l_media': l_media} for urn, l_record, l_media in rows]
+    fetched = _fetch_all(records, workers, timeout)
+    fresh = [(r, info) for r, info in zip(records, fetched) if info is not None]
+    self.put_many(fresh)
+    return len(fresh)
+
+  def close(self):
+    self._db.close()
+
+  def __len__(self):
+    with self._lock:
+      return self._db.execute("SELECT COUNT(*) FROM luna_media").fetchone()[0]
+
+  def __repr__(self):
+    return f"LunaMetadataStore({self.path!r}, max_age={self.max_age})"
+
+
+_store = None
+
+
+def get_luna_store():
+  return _store
+
+
+def use_luna_store(path = None, max_age = None):
+  # keep LUNA answers in the SQLite file at path; use_luna_store(None) stops
+  global _store
+  if _store is not None:
+    _store.close()
+  _store = LunaMetadataStore(path, max_age = max_age) if path else None
+  return _store
+
+
+def add_luna_info_to_records(records, workers = None, timeout = None):
+  # add l_img_url and l_current_description to every record, looking them up
+  # concurrently. Records keep their order; failed lookups get None.
+  if _store is not None:
+    found = _store.lookup(records, workers = workers, timeout = timeout)
+  else:
+    found = _fetch_all(records, workers, timeout)
+
+  for record, info in zip(records, found):
+    record['l_img_url'], record['l_current_description'] = info if info is not None else (None, None)
+  return records
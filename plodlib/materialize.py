@@ -0,0 +1,155 @@
+# Precomputed results of the heavy PLODResource methods, kept in a SQLite file.
+#
+# These results only change when P-LOD is republished, so they can be
+# computed once for every resource and then read from the file:
+#
+#     python -m plodlib.materialize -o plod-results.sqlite --workers 16
+#
+#     plodlib.use_materialized('plod-results.sqlite')
+#     PLODResource('r1-i1-p1').depicts_concepts()      read from the file, no query
+#
+# What is computed for which rdf_type is in MATERIALIZED. Each result is
+# stored once per (method, identifier, arguments), as zlib-compressed JSON. In
+# read mode, calls for anything not in the file are answered by the
+# backend as usual (see materialized.py). Rebuild the file after the data is
+# republished, with read mode off, then call use_materialized() again, or
+# drop only what changed with python -m plodlib.changes (see changes.py).
+
+import inspect
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from . import PLODResource
+from .changes import DatasetSnapshot
+from .client import get_client
+from .materialized import MaterializedStore
+
+
+LEVELS_OF_DETAIL = ('feature', 'space', 'property', 'insula', 'region')
+
+SPATIAL_METHODS = {'depicts_concepts': [{}], 'gather_images': [{}], 'spatial_ancestors': [{}]}
+
+# rdf_type -> {method: [keyword arguments to compute it with]}
+MATERIALIZED = {
+    'region': SPATIAL_METHODS,
+    'insula': SPATIAL_METHODS,
+    'property': SPATIAL_METHODS,
+    'space': SPATIAL_METHODS,
+    'feature': SPATIAL_METHODS,
+    'concept': {'depicted_where': [{'level_of_detail': level} for level in LEVELS_OF_DETAIL], 'gather_images': [{}]},
+}
+
+DEFAULT_WORKERS = 8
+
+# rows written per transaction
+BATCH_SIZE = 500
+
+
+def _call(resource, method, kwargs):
+    found = getattr(resource, method)
+    return found(**kwargs) if callable(found) else found
+
+
+def _signature_arguments(method, kwargs):
+    # kwargs with every default filled in, as the result cache keys them
+    attribute = getattr(PLODResource, method)
+    function = attribute.fget if isinstance(attribute, property) else attribute
+    bound = inspect.signature(function).bind(None, **kwargs)
+    bound.apply_defaults()
+    return dict(list(bound.arguments.items())[1:])
+
+
+def instances(rdf_type, client = None):
+    # identifiers of every resource of rdf_type
+    variables, rows = (client or get_client()).select(f"""
+PREFIX p-lod: <urn:p-lod:id:>
+SELECT ?s WHERE {{ ?s a p-lod:{rdf_type} . }} ORDER BY ?s""")
+    return [s.replace('urn:p-lod:id:', '') for (s,) in rows if s.startswith('urn:p-lod:id:')]
+
+
+def materialize(path, types = None, workers = DEFAULT_WORKERS, log = sys.stderr, snapshot = True):
+    # compute MATERIALIZED (or the given {rdf_type: {method: [kwargs]}}) for every
+    # resource of each type with the active backend, into the SQLite file at path.
+    # Returns counts of what was written and what failed. The file is built
+    # beside path and moved over it at the end, so readers never see half of it.
+    # With snapshot, the dataset is snapshotted first and saved at path +
+    # '.snapshot' for python -m plodlib.changes (see changes.py).
+    types = MATERIALIZED if types is None else types
+    taken = DatasetSnapshot.take(workers = workers) if snapshot else None
+    building = path + '.building'
+    if os.path.exists(building):
+        os.remove(building)
+    store = MaterializedStore(building)
+    started = time.time()
+    counts = {'resources': 0, 'results': 0, 'failed': 0}
+
+    def compute(resource, methods):
+        # every result for one resource: (rows, failures)
+        rows, failures = [], []
+        for method, calls in methods.items():
+            for kwargs in calls:
+                try:
+                    rows.append((method, resource.identifier, _signature_arguments(method, kwargs), _call(resource, method, kwargs)))
+                except Exception as e:
+                    failures.append((method, resource.identifier, kwargs, e))
+        return rows, failures
+
+    try:
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            for rdf_type, methods in types.items():
+                identifiers = instances(rdf_type)
+                if log:
+                    print(f"{rdf_type}: {len(identifiers)} resources", file = log)
+                # loaded with one query per 200 rather than one each
+                futures = [executor.submit(compute, r, methods) for r in PLODResource.many(identifiers)]
+                pending = []
+                for future in as_completed(futures):
+                    rows, failures = future.result()
+                    counts['resources'] += 1
+                    counts['results'] += len(rows)
+                    counts['failed'] += len(failures)
+                    for method, identifier, kwargs, e in failures:
+                        if log:
+                            print(f"  {method}({identifier}, {kwargs}) failed: {type(e).__name__}: {e}", file = log)
+                    pending.extend(rows)
+                    if len(pending) >= BATCH_SIZE:
+                        store.put_many(pending)
+                        pending = []
+                store.put_many(pending)
+
+        store.set_meta(endpoint = getattr(get_client(), 'endpoint', None), built = started,
+                       seconds = time.time() - started, types = {t: list(m) for t, m in types.items()},
+                       fingerprint = taken.fingerprint if taken else None, **counts)
+    finally:
+        store.close()
+    os.replace(building, path)
+    if taken is not None:
+        taken.save(path + '.snapshot')
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from .client import configure, use_local_graph
+
+    parser = argparse.ArgumentParser(description = 'Precompute heavy PLODResource results into a SQLite file.')
+    parser.add_argument('-o', '--output', required = True, help = 'SQLite file to write')
+    parser.add_argument('-t', '--type', action = 'append', choices = list(MATERIALIZED), help = 'only resources of this type (repeatable)')
+    parser.add_argument('-w', '--workers', type = int, default = DEFAULT_WORKERS)
+    parser.add_argument('-e', '--endpoint', help = 'SPARQL query endpoint (default: $PLOD_ENDPOINT or the P-LOD Fuseki server)')
+    parser.add_argument('-l', '--local', action = 'append', metavar = 'FILE', help = 'compute from a local RDF dump (repeatable)')
+    parser.add_argument('--no-snapshot', action = 'store_true', help = "don't snapshot the dataset for python -m plodlib.changes")
+    args = parser.parse_args()
+
+    if args.local:
+        use_local_graph(*args.local)
+    else:
+        configure(endpoint = args.endpoint, pool_size = args.workers)
+
+    counts = materialize(args.output, types = {t: MATERIALIZED[t] for t in args.type} if args.type else None, workers = args.workers,
+                         snapshot = not args.no_snapshot)
+    print(f"{counts['resources']} resources, {counts['results']} results, {counts['failed']} failed", file = sys.stderr)
+    sys.exit(1 if counts['failed'] else 0)
@@ -0,0 +1,110 @@
+# Read mode for results precomputed by plodlib.materialize: a SQLite file of
+# method results per (method, identifier, arguments), stored as
+# zlib-compressed JSON.
+#
+#     plodlib.use_materialized('plod-results.sqlite')
+#     PLODResource('r1-i1-p1').depicts_concepts()      read from the file, no query
+#
+# Calls for anything not in the file are answered by the backend as usual.
+
+import json
+import sqlite3
+import threading
+import zlib
+
+
+def arguments_key(arguments):
+    return json.dumps(arguments, sort_keys = True, default = str)
+
+
+class MaterializedStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread = False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS results (
+                              method TEXT, identifier TEXT, arguments TEXT, value BLOB,
+                              PRIMARY KEY (method, identifier, arguments)) WITHOUT ROWID""")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.commit()
+        self._methods = frozenset(m for (m,) in self._db.execute("SELECT DISTINCT method FROM results"))
+        self._stats = {'hits': 0, 'misses': 0}
+
+    @property
+    def methods(self):
+        # the methods the file has results for
+        return self._methods
+
+    def get(self, method, identifier, arguments):
+        # (True, value) if the file has the result, (False, None) otherwise
+        if method not in self._methods:
+            return False, None
+        with self._lock:
+            row = self._db.execute("SELECT value FROM results WHERE method = ? AND identifier = ? AND arguments = ?",
+                                   (method, identifier, arguments_key(arguments))).fetchone()
+            self._stats['hits' if row else 'misses'] += 1
+        if row is None:
+            return False, None
+        return True, json.loads(zlib.decompress(row[0]))
+
+    def put_many(self, rows):
+        # rows of (method, identifier, arguments, value)
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                 [(method, identifier, arguments_key(arguments), zlib.compress(json.dumps(value).encode('utf-8')))
+                                  for method, identifier, arguments, value in rows])
+            self._db.commit()
+            self._methods = self._methods | set(method for method, _, _, _ in rows)
+
+    def invalidate(self, identifier = None, method = None):
+        # drop results for an identifier and/or method; returns how many went
+        where, params = [], []
+        if identifier is not None:
+            where.append("identifier = ?")
+            params.append(identifier)
+        if method is not None:
+            where.append("method = ?")
+            params.append(method)
+        with self._lock:
+            n = self._db.execute("DELETE FROM results" + (" WHERE " + " AND ".join(where) if where else ""), params).rowcount
+            self._db.commit()
+        return n
+
+    def set_meta(self, **values):
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [(k, json.dumps(v)) for k, v in values.items()])
+            self._db.commit()
+
+    def meta(self):
+        with self._lock:
+            return {k: json.loads(v) for k, v in self._db.execute("SELECT key, value FROM meta")}
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, results = len(self))
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def __repr__(self):
+        return f"MaterializedStore({self.path!r})"
+
+
+_store = None
+
+
+def get_materialized_store():
+    return _store
+
+
+def use_materialized(path = None):
+    # answer the materialized methods from the file at path; use_materialized(None) stops
+    global _store
+    if _store is not None:
+        _store.close()
+    _store = MaterializedStore(path) if path else None
+    return _store
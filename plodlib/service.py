@@ -0,0 +1,303 @@
+# HTTP service answering PLODResource methods as JSON, so many page renderers
+# can share one result cache and one connection pool to the endpoint.
+#
+#     python -m plodlib.service --port 8080 [--endpoint URL | --local plod.ttl | --index plod.index] [--cache-path cache.sqlite]
+#
+# or under any WSGI server: gunicorn 'plodlib.service:make_app()'
+# (gunicorn -w 8 'plodlib.service:make_app(index="plod.index")' has every worker
+# share one memory-mapped triple index, see tripleindex.py)
+#
+#   GET /resource/r1-i1-p1                             identifier, rdf_type, label, broader, ...
+#   GET /resource/r1-i1-p1/depicts_concepts            a method's (or query property's) result
+#   GET /resource/dog/depicted_where?level_of_detail=space
+#   GET /resource/r1-i1-p1/compare_depicts?right=r1-i1-p2
+#   GET /resource/depicts/iter_as_predicate            every row, streamed as its pages arrive
+#   GET /methods                                       the methods and their arguments
+#   GET /stats                                         cache and coalescing counters
+#
+# Argument values are read as JSON when they parse (true, 5000) and as strings
+# otherwise. Identifiers and string arguments are spliced into the queries, so
+# anything but letters, digits, '_', '.' and '-' (or an IRI, for predicate)
+# gets a 400. Responses have an ETag, so If-None-Match gets a 304, and a
+# Cache-Control max-age. Identical requests that arrive while one is being
+# answered wait for it and share its response instead of querying again.
+# With Accept: application/x-ndjson a list result comes one element per line.
+
+import hashlib
+import inspect
+import json
+import re
+import threading
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl, unquote
+from wsgiref.simple_server import WSGIServer, make_server
+
+import requests
+
+from . import PLODResource
+from .cache import get_cache, use_cache
+from .singleflight import SingleFlight
+
+
+DEFAULT_MAX_AGE = 300
+
+# response bodies are handed to the server this many bytes at a time
+CHUNK_SIZE = 64 * 1024
+
+# rows per query for the streamed methods
+STREAM_PAGE_SIZE = 5000
+
+RESOURCE_ATTRIBUTES = ('identifier', 'rdf_type', 'label', 'broader', 'p_in_p_url', 'wikidata_url', 'best_images')
+
+STREAMED = ('iter_as_object', 'iter_as_predicate')
+
+# identifiers and string arguments are spliced into SPARQL, so only these are
+# accepted: p-lod names, and for IRI arguments what SPARQL allows inside <...>
+NAME = re.compile(r'[A-Za-z0-9_.-]+')
+IRI = re.compile(r'[^\s<>"{}|^`\\]+')
+IRI_ARGUMENTS = ('predicate',)
+
+JSON = 'application/json; charset=utf-8'
+NDJSON = 'application/x-ndjson; charset=utf-8'
+
+
+def service_methods():
+    # {name: signature, or None for a property} of every method the service answers
+    found = {}
+    for name, attribute in vars(PLODResource).items():
+        if name.startswith('_'):
+            continue
+        function = attribute.fget if isinstance(attribute, property) else attribute
+        if hasattr(function, 'steps') or name in ('compare_depicts', 'compare_depicted') + STREAMED:
+            found[name] = None if isinstance(attribute, property) else inspect.signature(function)
+    return found
+
+
+def _plain(o):
+    # results holding PLODResources (e.g. broader)
+    return getattr(o, 'identifier', None) if isinstance(o, PLODResource) else str(o)
+
+
+def _argument(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def _chunks(body):
+    return [body[i:i + CHUNK_SIZE] for i in range(0, len(body), CHUNK_SIZE)] or [b'']
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Service(object):
+    # the WSGI application
+
+    def __init__(self, max_age = DEFAULT_MAX_AGE):
+        self.max_age = max_age
+        self.methods = service_methods()
+        self.flights = SingleFlight()
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'not_modified': 0, 'errors': 0}
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self._stats['requests'] += 1
+        try:
+            if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+                raise HTTPError('405 Method Not Allowed', 'only GET')
+            path = [unquote(p) for p in environ.get('PATH_INFO', '').strip('/').split('/')]
+            arguments = {k: _argument(v) for k, v in parse_qsl(environ.get('QUERY_STRING', ''))}
+            ndjson = 'application/x-ndjson' in environ.get('HTTP_ACCEPT', '')
+
+            if path == ['methods']:
+                return self._respond(environ, start_response, *self._render(self._describe_methods(), False))
+            if path == ['stats']:
+                return self._respond(environ, start_response, *self._render(self.stats(), False), max_age = 0)
+            if len(path) >= 2 and path[0] == 'resource':
+                self._check_identifier(path[1])
+            if len(path) == 2 and path[0] == 'resource':
+                key = (path[1], None, None, False)
+                return self._respond(environ, start_response, *self.flights.do(key, self._resource, path[1]))
+            if len(path) == 3 and path[0] == 'resource':
+                identifier, method = path[1], path[2]
+                self._check(method, arguments)
+                if method in STREAMED:
+                    return self._stream(start_response, identifier, method, arguments, ndjson)
+                key = (identifier, method, json.dumps(arguments, sort_keys = True), ndjson)
+                return self._respond(environ, start_response,
+                                     *self.flights.do(key, self._call, identifier, method, arguments, ndjson))
+            raise HTTPError('404 Not Found', f"no such path: {environ.get('PATH_INFO')}")
+
+        except HTTPError as e:
+            return self._error(start_response, e.status, str(e))
+        except requests.RequestException as e:
+            # the endpoint (or LUNA) failed
+            return self._error(start_response, '502 Bad Gateway', f'{type(e).__name__}: {e}')
+        except Exception as e:
+            return self._error(start_response, '500 Internal Server Error', f'{type(e).__name__}: {e}')
+
+    def _check_identifier(self, identifier):
+        if not NAME.fullmatch(identifier):
+            raise HTTPError('400 Bad Request', f'not a P-LOD identifier: {identifier!r}')
+
+    def _check(self, method, arguments):
+        if method not in self.methods:
+            raise HTTPError('404 Not Found', f'no such method: {method}')
+        for name, value in arguments.items():
+            if isinstance(value, str):
+                # '' is a default some methods take (exclude_rdf_type)
+                if value and not (IRI if name in IRI_ARGUMENTS else NAME).fullmatch(value):
+                    raise HTTPError('400 Bad Request', f'invalid value for {name}: {value!r}')
+            elif value is not None and not isinstance(value, (bool, int)):
+                raise HTTPError('400 Bad Request', f'invalid value for {name}: {value!r}')
+        signature = self.methods[method]
+        try:
+            if signature is None:
+                if arguments:
+                    raise TypeError(f'{method} takes no arguments')
+            else:
+                signature.bind(None, **arguments)
+        except TypeError as e:
+            raise HTTPError('400 Bad Request', str(e))
+
+    def _render(self, result, ndjson):
+        # (body, etag, content type)
+        if ndjson and isinstance(result, list):
+            body = b''.join(json.dumps(r, default = _plain).encode('utf-8') + b'\n' for r in result)
+            content_type = NDJSON
+        else:
+            body = json.dumps(result, default = _plain).encode('utf-8')
+            content_type = JSON
+        return body, '"' + hashlib.blake2b(body, digest_size = 16).hexdigest() + '"', content_type
+
+    def _resource(self, identifier):
+        r = PLODResource(identifier)
+        if r.identifier is None or not r._po:
+            raise HTTPError('404 Not Found', f'no such resource: {identifier}')
+        return self._render({a: getattr(r, a, None) for a in RESOURCE_ATTRIBUTES}, False)
+
+    def _call(self, identifier, method, arguments, ndjson):
+        found = getattr(PLODResource(identifier, lazy = True), method)
+        return self._render(found(**arguments) if callable(found) else found, ndjson)
+
+    def _respond(self, environ, start_response, body, etag, content_type, max_age = None):
+        max_age = self.max_age if max_age is None else max_age
+        headers = [('ETag', etag), ('Cache-Control', f'public, max-age={max_age}')]
+        match = environ.get('HTTP_IF_NONE_MATCH', '')
+        if match.strip() == '*' or etag in [m.strip().removeprefix('W/') for m in match.split(',')]:
+            with self._lock:
+                self._stats['not_modified'] += 1
+            start_response('304 Not Modified', headers)
+            return []
+        start_response('200 OK', headers + [('Content-Type', content_type), ('Content-Length', str(len(body)))])
+        return [] if environ['REQUEST_METHOD'] == 'HEAD' else _chunks(body)
+
+    def _stream(self, start_response, identifier, method, arguments, ndjson):
+        # rows are sent as each page of the query arrives; no ETag, the whole
+        # result is never held
+        arguments.setdefault('page_size', STREAM_PAGE_SIZE)
+        rows = getattr(PLODResource(identifier, lazy = True), method)(**arguments)
+        # the first page before the headers, so a failing query still gets an error status
+        first = next(rows, None)
+        start_response('200 OK', [('Content-Type', NDJSON if ndjson else JSON), ('Cache-Control', f'public, max-age={self.max_age}')])
+
+        def body():
+            if first is None:
+                yield b'' if ndjson else b'[]'
+                return
+            if ndjson:
+                yield json.dumps(first, default = _plain).encode('utf-8') + b'\n'
+                for r in rows:
+                    yield json.dumps(r, default = _plain).encode('utf-8') + b'\n'
+                return
+            yield b'[' + json.dumps(first, default = _plain).encode('utf-8')
+            for r in rows:
+                yield b',' + json.dumps(r, default = _plain).encode('utf-8')
+            yield b']'
+
+        return body()
+
+    def _error(self, start_response, status, message):
+        with self._lock:
+            self._stats['errors'] += 1
+        body = json.dumps({'error': message}).encode('utf-8')
+        start_response(status, [('Content-Type', JSON), ('Content-Length', str(len(body))), ('Cache-Control', 'no-store')])
+        return [body]
+
+    def _describe_methods(self):
+        described = {}
+        for name, signature in self.methods.items():
+            parameters = [] if signature is None else list(signature.parameters.values())[1:]
+            described[name] = {p.name: None if p.default is inspect.Parameter.empty else p.default for p in parameters}
+        return described
+
+    def stats(self):
+        cache = get_cache()
+        with self._lock:
+            stats = dict(self._stats)
+        return dict(stats, coalescing = self.flights.stats(), cache = cache.stats() if cache is not None else None)
+
+
+def make_app(max_age = DEFAULT_MAX_AGE, index = None, **cache_kwargs):
+    # the WSGI application. Turns on the result cache (with cache_kwargs, see
+    # ResultCache) unless one is already in use. index: answer queries from the
+    # triple index directory at that path.
+    if index is not None:
+        # numpy and rdflib, only when serving from an index
+        from .tripleindex import use_triple_index
+        use_triple_index(index)
+    if get_cache() is None:
+        use_cache(**cache_kwargs)
+    return Service(max_age = max_age)
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def serve(host = '127.0.0.1', port = 8080, app = None):
+    # answer requests, each on its own thread, until interrupted
+    httpd = make_server(host, port, app or make_app(), server_class = ThreadingWSGIServer)
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from .client import configure, use_local_graph
+
+    parser = argparse.ArgumentParser(description = 'Serve PLODResource methods as JSON over HTTP.')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8080)
+    parser.add_argument('-e', '--endpoint', help = 'SPARQL query endpoint (default: $PLOD_ENDPOINT or the P-LOD Fuseki server)')
+    parser.add_argument('--pool-size', type = int, help = 'connections to the endpoint')
+    parser.add_argument('-l', '--local', action = 'append', metavar = 'FILE', help = 'answer queries from a local RDF dump (repeatable)')
+    parser.add_argument('-i', '--index', metavar = 'DIR', help = 'answer queries from a triple index built by python -m plodlib.tripleindex')
+    parser.add_argument('--cache-path', help = 'SQLite file keeping results across restarts')
+    parser.add_argument('--ttl', type = float, help = 'seconds results are cached (default one day)')
+    parser.add_argument('--max-age', type = int, default = DEFAULT_MAX_AGE, help = 'Cache-Control max-age for clients')
+    args = parser.parse_args()
+
+    if args.index:
+        from .tripleindex import use_triple_index
+        use_triple_index(args.index)
+    elif args.local:
+        use_local_graph(*args.local)
+    elif args.endpoint or args.pool_size:
+        configure(endpoint = args.endpoint, pool_size = args.pool_size)
+
+    cache_kwargs = {'path': args.cache_path}
+    if args.ttl is not None:
+        cache_kwargs['ttl'] = args.ttl
+    print(f'serving on http://{args.host}:{args.port}/')
+    serve(args.host, args.port, make_app(max_age = args.max_age, **cache_kwargs))
@@ -0,0 +1,103 @@
+# Single-flight: concurrent calls with the same key share one execution.
+#
+#     flights = SingleFlight()
+#     body = flights.do(key, render, identifier, method)
+#
+# The first caller for a key runs the function; callers arriving with the
+# same key while it runs wait for it and get the same value (or exception),
+# or copy(value) when a copy function is given, so they can't change each
+# other's results. Nothing is remembered once it finishes, so this removes
+# duplicate work only among calls that overlap; keeping results is the
+# result cache's job. AsyncSingleFlight does the same for coroutines.
+
+import threading
+
+
+class _Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+
+    def __init__(self, copy = None):
+        self.copy = copy
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = {'calls': 0, 'shared': 0}
+
+    def do(self, key, function, *args, **kwargs):
+        with self._lock:
+            self._stats['calls'] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+                self._stats['shared'] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value if self.copy is None else self.copy(flight.value)
+
+        try:
+            flight.value = function(*args, **kwargs)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.value
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+    def stats(self):
+        # calls, and how many of them shared another call's execution
+        with self._lock:
+            return dict(self._stats, in_flight = len(self._flights))
+
+    def __repr__(self):
+        return f"SingleFlight({self.in_flight()} in flight)"
+
+
+class AsyncSingleFlight(object):
+    # SingleFlight for coroutines on one event loop. The shared execution runs
+    # as its own task, so a caller being cancelled doesn't cancel it for the others.
+
+    def __init__(self, copy = None):
+        self.copy = copy
+        self._flights = {}
+        self._stats = {'calls': 0, 'shared': 0}
+
+    async def do(self, key, function, *args, **kwargs):
+        import asyncio   # here, so that importing plodlib doesn't import asyncio
+        self._stats['calls'] += 1
+        task = self._flights.get(key)
+        leader = task is None
+        if leader:
+            task = self._flights[key] = asyncio.ensure_future(function(*args, **kwargs))
+            task.add_done_callback(lambda done: self._flights.pop(key, None))
+        else:
+            self._stats['shared'] += 1
+        value = await asyncio.shield(task)
+        return value if leader or self.copy is None else self.copy(value)
+
+    def in_flight(self):
+        return len(self._flights)
+
+    def stats(self):
+        return dict(self._stats, in_flight = len(self._flights))
+
+    def __repr__(self):
+        return f"AsyncSingleFlight({self.in_flight()} in flight)"
@@ -0,0 +1,325 @@
+# In-memory spatial index over the p-lod:geojson of regions, insulae,
+# properties, spaces, features ...
+#
+# Every geometry is read once from the active backend, parsed and put in a
+# uniform grid of cells over the extent of the data. Map interactions then
+# don't need SPARQL or geojson parsing at all:
+#
+#     index = use_spatial_index()
+#     index.at(14.4812, 40.7462, rdf_type = 'space')     what is at this point
+#     index.bbox(14.48, 40.745, 14.49, 40.75)            what is in this view
+#     index.nearest(14.4812, 40.7462, k = 5)             what is closest
+#
+# Coordinates are GeoJSON's (longitude, latitude). Results are records like
+# spatial_children()'s: urn, type, label and geojson, smallest area first.
+
+import heapq
+import json
+import math
+import threading
+
+from .client import get_client
+
+
+PLOD = 'urn:p-lod:id:'
+
+# metres per degree of latitude; a degree of longitude is this times cos(latitude)
+METRES_PER_DEGREE = 111320
+
+# at most this many cells along each side of the grid
+MAX_GRID = 256
+
+
+def _parts(geojson):
+    # (polygons, lines) of a GeoJSON Feature, FeatureCollection or geometry.
+    # A polygon is a list of rings, rings and lines are lists of (lon, lat);
+    # points become one-point lines.
+    polygons, lines = [], []
+
+    def walk(g):
+        if not isinstance(g, dict):
+            return
+        t = g.get('type')
+        c = g.get('coordinates')
+        if t == 'FeatureCollection':
+            for f in g.get('features') or ():
+                walk(f)
+        elif t == 'Feature':
+            walk(g.get('geometry'))
+        elif t == 'GeometryCollection':
+            for member in g.get('geometries') or ():
+                walk(member)
+        elif t == 'Polygon':
+            polygons.append([[(p[0], p[1]) for p in ring] for ring in c])
+        elif t == 'MultiPolygon':
+            polygons.extend([[(p[0], p[1]) for p in ring] for ring in polygon] for polygon in c)
+        elif t == 'LineString':
+            lines.append([(p[0], p[1]) for p in c])
+        elif t == 'MultiLineString':
+            lines.extend([(p[0], p[1]) for p in line] for line in c)
+        elif t == 'Point':
+            lines.append([(c[0], c[1])])
+        elif t == 'MultiPoint':
+            lines.extend([(p[0], p[1])] for p in c)
+
+    walk(geojson)
+    return polygons, lines
+
+
+def _in_ring(x, y, ring):
+    # even-odd ray casting
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i]
+        xj, yj = ring[j]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def _in_polygon(x, y, polygon):
+    # inside the outer ring and not in a hole
+    return _in_ring(x, y, polygon[0]) and not any(_in_ring(x, y, hole) for hole in polygon[1:])
+
+
+def _segment_distance(px, py, ax, ay, bx, by):
+    dx, dy = bx - ax, by - ay
+    length = dx * dx + dy * dy
+    t = 0.0 if length == 0 else max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length))
+    x, y = ax + t * dx - px, ay + t * dy - py
+    return math.sqrt(x * x + y * y)
+
+
+def _ring_area(ring):
+    return abs(sum(ring[i - 1][0] * ring[i][1] - ring[i][0] * ring[i - 1][1] for i in range(len(ring)))) / 2
+
+
+class _Entry(object):
+    __slots__ = ('urn', 'types', 'label', 'geojson', 'polygons', 'lines', 'bounds', 'area')
+
+    def __init__(self, urn, geojson, polygons, lines):
+        self.urn = urn
+        self.types = set()
+        self.label = None
+        self.geojson = geojson
+        self.polygons = polygons
+        self.lines = lines
+        points = [p for polygon in polygons for p in polygon[0]] + [p for line in lines for p in line]
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        self.bounds = (min(xs), min(ys), max(xs), max(ys))
+        self.area = sum(_ring_area(polygon[0]) - sum(_ring_area(hole) for hole in polygon[1:]) for polygon in polygons)
+
+    def contains(self, x, y):
+        return any(_in_polygon(x, y, polygon) for polygon in self.polygons)
+
+    def distance(self, x, y):
+        # metres from (x, y) to the geometry, 0 inside a polygon. Equirectangular
+        # around the point, which is plenty at the scale of Pompeii.
+        if self.contains(x, y):
+            return 0.0
+        kx = METRES_PER_DEGREE * math.cos(math.radians(y))
+        ky = METRES_PER_DEGREE
+        best = math.inf
+        for line in [ring for polygon in self.polygons for ring in polygon] + self.lines:
+            if len(line) == 1:
+                best = min(best, math.hypot((line[0][0] - x) * kx, (line[0][1] - y) * ky))
+            for (ax, ay), (bx, by) in zip(line, line[1:]):
+                best = min(best, _segment_distance(0, 0, (ax - x) * kx, (ay - y) * ky, (bx - x) * kx, (by - y) * ky))
+        return best
+
+    def record(self):
+        types = sorted(self.types)
+        return {'urn': self.urn,
+                'type': types[0] if len(types) == 1 else types or None,
+                'label': self.label,
+                'geojson': self.geojson}
+
+
+class SpatialIndex(object):
+
+    def __init__(self, client = None):
+        self._lock = threading.Lock()
+        self.rebuild(client)
+
+    def rebuild(self, client = None):
+        # (re)read every p-lod:geojson from client, or the active backend
+        if client is None:
+            client = get_client()
+
+        variables, rows = client.select("""
+PREFIX p-lod: <urn:p-lod:id:>
+SELECT ?urn ?geojson WHERE { ?urn p-lod:geojson ?geojson . }""")
+        entries = {}
+        for urn, text in rows:
+            try:
+                polygons, lines = _parts(json.loads(text))
+            except (TypeError, ValueError, IndexError, KeyError):
+                continue
+            if not polygons and not lines:
+                continue
+            if urn in entries:
+                # several geojson literals: index them as one geometry
+                old = entries[urn]
+                polygons, lines = old.polygons + polygons, old.lines + lines
+                text = json.dumps({"type": "FeatureCollection",
+                                   "features": [json.loads(old.geojson), json.loads(text)]})
+            entries[urn] = _Entry(urn, text, polygons, lines)
+
+        variables, rows = client.select("""
+PREFIX p-lod: <urn:p-lod:id:>
+SELECT ?urn ?type ?label WHERE {
+  ?urn p-lod:geojson [] .
+  OPTIONAL { ?urn a ?type }
+  OPTIONAL { ?urn <http://www.w3.org/2000/01/rdf-schema#label> ?label }
+}""")
+        for urn, rdf_type, label in rows:
+            entry = entries.get(urn)
+            if entry is not None:
+                if rdf_type is not None:
+                    entry.types.add(rdf_type)
+                if label is not None:
+                    entry.label = label
+
+        grid = self._grid(list(entries.values()))
+        with self._lock:
+            self.endpoint = getattr(client, 'endpoint', None)
+            self._entries = entries
+            self._extent, self._size, self._cells = grid
+        return self
+
+    @staticmethod
+    def _grid(entries):
+        # (extent, (columns, rows), {(column, row): [entries overlapping the cell]})
+        if not entries:
+            return (0.0, 0.0, 0.0, 0.0), (1, 1), {}
+        extent = (min(e.bounds[0] for e in entries), min(e.bounds[1] for e in entries),
+                  max(e.bounds[2] for e in entries), max(e.bounds[3] for e in entries))
+        n = max(1, min(MAX_GRID, int(math.sqrt(len(entries)))))
+        size = (n if extent[2] > extent[0] else 1, n if extent[3] > extent[1] else 1)
+        cells = {}
+        grid = (extent, size, cells)
+        for e in entries:
+            c0, r0 = SpatialIndex._cell(grid, e.bounds[0], e.bounds[1])
+            c1, r1 = SpatialIndex._cell(grid, e.bounds[2], e.bounds[3])
+            for c in range(c0, c1 + 1):
+                for r in range(r0, r1 + 1):
+                    cells.setdefault((c, r), []).append(e)
+        return grid
+
+    @staticmethod
+    def _cell(grid, x, y):
+        # the cell (x, y) falls in, clamped to the grid
+        (x0, y0, x1, y1), (columns, rows), cells = grid
+        c = int((x - x0) / (x1 - x0) * columns) if x1 > x0 else 0
+        r = int((y - y0) / (y1 - y0) * rows) if y1 > y0 else 0
+        return min(max(c, 0), columns - 1), min(max(r, 0), rows - 1)
+
+    @staticmethod
+    def _types(rdf_type):
+        # rdf_type filter as a set of full urns, None for no filter
+        if rdf_type is None:
+            return None
+        if isinstance(rdf_type, str):
+            rdf_type = [rdf_type]
+        return set(t if ':' in t else PLOD + t for t in rdf_type)
+
+    def _records(self, entries, rdf_type):
+        types = self._types(rdf_type)
+        if types is not None:
+            entries = [e for e in entries if e.types & types]
+        return [e.record() for e in sorted(entries, key = lambda e: (e.area, e.urn))]
+
+    def bbox(self, min_lon, min_lat, max_lon, max_lat, rdf_type = None):
+        # everything whose bounding box intersects the box
+        grid = (self._extent, self._size, self._cells)
+        c0, r0 = self._cell(grid, min_lon, min_lat)
+        c1, r1 = self._cell(grid, max_lon, max_lat)
+        found = set()
+        for c in range(c0, c1 + 1):
+            for r in range(r0, r1 + 1):
+                for e in self._cells.get((c, r), ()):
+                    b = e.bounds
+                    if b[0] <= max_lon and b[2] >= min_lon and b[1] <= max_lat and b[3] >= min_lat:
+                        found.add(e)
+        return self._records(found, rdf_type)
+
+    def at(self, lon, lat, rdf_type = None):
+        # every polygon containing the point, innermost (smallest) first
+        grid = (self._extent, self._size, self._cells)
+        found = [e for e in self._cells.get(self._cell(grid, lon, lat), ())
+                 if e.bounds[0] <= lon <= e.bounds[2] and e.bounds[1] <= lat <= e.bounds[3] and e.contains(lon, lat)]
+        return self._records(found, rdf_type)
+
+    def nearest(self, lon, lat, k = 1, rdf_type = None, max_distance = None):
+        # the k geometries closest to the point, nearest first, each record with
+        # its 'distance' in metres (0 when the point is inside it)
+        types = self._types(rdf_type)
+        (x0, y0, x1, y1), (columns, rows) = self._extent, self._size
+        grid = (self._extent, self._size, self._cells)
+        width, height = (x1 - x0) / columns, (y1 - y0) / rows
+        kx = METRES_PER_DEGREE * math.cos(math.radians(lat))
+        ky = METRES_PER_DEGREE
+
+        def cell_distance(c, r):
+            # metres from the point to the nearest edge of cell (c, r)
+            dx = max(x0 + c * width - lon, 0, lon - (x0 + (c + 1) * width))
+            dy = max(y0 + r * height - lat, 0, lat - (y0 + (r + 1) * height))
+            return math.hypot(dx * kx, dy * ky)
+
+        # cells in order of distance, starting from the point's own (or closest)
+        # cell; a neighbour is never nearer than the cell it's reached from
+        start = self._cell(grid, lon, lat)
+        queue = [(cell_distance(*start), start)]
+        queued = {start}
+        seen = set()
+        found = []
+        while queue:
+            d, (c, r) = heapq.heappop(queue)
+            if len(found) == k and d > found[-1][0]:
+                break
+            if max_distance is not None and d > max_distance:
+                break
+            for e in self._cells.get((c, r), ()):
+                if e in seen:
+                    continue
+                seen.add(e)
+                if types is None or e.types & types:
+                    found.append((e.distance(lon, lat), e.area, e.urn, e))
+            found.sort(key = lambda f: f[:3])
+            del found[k:]
+            for n in ((c - 1, r), (c + 1, r), (c, r - 1), (c, r + 1)):
+                if 0 <= n[0] < columns and 0 <= n[1] < rows and n not in queued:
+                    queued.add(n)
+                    heapq.heappush(queue, (cell_distance(*n), n))
+
+        return [dict(e.record(), distance = distance) for distance, area, urn, e in found
+                if max_distance is None or distance <= max_distance]
+
+    def geometry(self, identifier):
+        # the parsed geojson for identifier, or None if it has none
+        entry = self._entries.get(identifier if identifier.startswith(PLOD) else PLOD + identifier)
+        return None if entry is None else json.loads(entry.geojson)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f'SpatialIndex({self.endpoint!r}, {len(self._entries)} geometries, {self._size[0]}x{self._size[1]} grid)'
+
+
+_index = None
+
+
+def get_spatial_index():
+    return _index
+
+
+def use_spatial_index(enabled = True, client = None):
+    # build an index of every geojson from client (default: the active backend).
+    # Call again, or get_spatial_index().rebuild(), after the data changes.
+    global _index
+    _index = SpatialIndex(client) if enabled else None
+    return _index
@@ -0,0 +1,120 @@
+# PLODResource query methods are written once, as generators that yield what
+# they need (a SELECT, a graph query, another method's result, LUNA lookups)
+# and receive the answer back:
+#
+#     @query_method
+#     def spatial_children(self):
+#         ...
+#         return (yield Select(query_str, as_str = True))
+#
+# query_method turns that into an ordinary blocking method. The same generator
+# is driven by arun_steps() for AsyncPLODResource, so the two never drift apart.
+
+import functools
+import time
+
+from . import instrument
+from .client import get_client
+from .decode import records, select_records
+from .luna import add_luna_info_to_records
+
+
+class Select(object):
+    # SELECT query; the generator receives the decoded records
+    def __init__(self, query_str, as_str = False):
+        self.query_str = query_str
+        self.as_str = as_str
+
+    def run(self):
+        return select_records(self.query_str, as_str = self.as_str)
+
+    async def arun(self, client):
+        variables, rows = await client.select(self.query_str)
+        return records(variables, rows, as_str = self.as_str)
+
+
+class Query(object):
+    # any query (DESCRIBE, CONSTRUCT, ...); the generator receives the rdflib Result
+    def __init__(self, query_str):
+        self.query_str = query_str
+
+    def run(self):
+        return get_client().query(self.query_str)
+
+    async def arun(self, client):
+        return await client.query(self.query_str)
+
+
+class Call(object):
+    # another method (or property) of the same resource, so its caching applies
+    def __init__(self, resource, name, **kwargs):
+        self.resource = resource
+        self.name = name
+        self.kwargs = kwargs
+
+    def run(self):
+        found = getattr(self.resource, self.name)
+        return found(**self.kwargs) if callable(found) else found
+
+    async def arun(self, client):
+        found = getattr(self.resource, self.name)
+        return await (found(**self.kwargs) if callable(found) else found)
+
+
+class AddLunaInfo(object):
+    # add_luna_info_to_records; its lookups already run concurrently in threads
+    def __init__(self, records):
+        self.records = records
+
+    def run(self):
+        return add_luna_info_to_records(self.records)
+
+    async def arun(self, client):
+        import asyncio   # here, so that importing plodlib doesn't import asyncio
+        return await asyncio.to_thread(add_luna_info_to_records, self.records)
+
+
+def run_steps(steps, call = instrument._quiet):
+    # drive a query method's generator, answering each request as it comes.
+    # A failed request is raised inside the generator so its own try/except applies.
+    # call (see instrument.method_call) is told the time spent in the generator itself.
+    answer, error = None, None
+    while True:
+        start = time.perf_counter()
+        try:
+            request = steps.throw(error) if error is not None else steps.send(answer)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            call.processed(time.perf_counter() - start)
+        try:
+            answer, error = request.run(), None
+        except Exception as e:
+            answer, error = None, e
+
+
+async def arun_steps(steps, client, call = instrument._quiet):
+    answer, error = None, None
+    while True:
+        start = time.perf_counter()
+        try:
+            request = steps.throw(error) if error is not None else steps.send(answer)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            call.processed(time.perf_counter() - start)
+        try:
+            answer, error = await request.arun(client), None
+        except Exception as e:
+            answer, error = None, e
+
+
+def query_method(steps_function):
+    # decorator: a blocking method from a generator of requests
+    @functools.wraps(steps_function)
+    def method(self, *args, **kwargs):
+        with instrument.method_call(steps_function.__name__, self.identifier) as call:
+            return call.returned(run_steps(steps_function(self, *args, **kwargs), call))
+
+    method.steps = steps_function
+    return method
@@ -0,0 +1,229 @@
+# Synthetic P-LOD-shaped data for load testing.
+#
+# Generates pompeii -> regions -> insulae -> properties -> spaces -> features
+# -> artwork components (with is-part-of sub-components), a broader tree of
+# concepts the components depict, LUNA images with x-luna-* ids as
+# best-images, wall painting styles, space characterizations and geojson.
+# Identifiers follow P-LOD's: r1, r1-i1, r1-i1-p1, r1-i1-p1-space-1,
+# r1-i1-p1-space-1-feature-1, r1-i1-p1-space-1-feature-1-ac-1, concept-1, ...
+#
+# The output is the same for the same seed and settings. Triples are produced
+# one at a time, so write() can emit far more than fits in memory:
+#
+#     python -m plodlib.synthetic -o plod-x10.nt --scale 10 --seed 1
+#
+#     from plodlib import synthetic, use_local_graph
+#     use_local_graph(graph = synthetic.graph(regions = 2, insulae = 3))
+#
+# Fan-outs are means; each parent gets between half and one and a half times
+# as many children.
+
+import itertools
+import json
+import random
+
+PLOD = 'urn:p-lod:id:'
+RDF_TYPE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+RDFS_LABEL = 'http://www.w3.org/2000/01/rdf-schema#label'
+
+STYLES = ('first-style', 'second-style', 'third-style', 'fourth-style')
+CHARACTERIZATIONS = ('atrium', 'cubiculum', 'garden', 'triclinium', 'kitchen', 'shop')
+
+# roughly the real site
+DEFAULTS = dict(regions = 9, insulae = 15, properties = 12, spaces = 8, features = 4,
+                components = 3, component_depth = 2,
+                concepts = 2000, concept_roots = 20, concept_depth = 6,
+                depictions = 2, image_density = 0.5, style_density = 0.6, characterization_density = 0.5)
+
+# the site's bounding box, split between the spatial units
+EXTENT = (14.475, 40.745, 14.495, 40.755)
+
+
+def _iri(term):
+    return f'<{term}>'
+
+
+def _literal(text):
+    text = str(text).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+    return f'"{text}"'
+
+
+def _geojson(x0, y0, x1, y1):
+    return json.dumps({"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [
+        [[round(x0, 7), round(y0, 7)], [round(x1, 7), round(y0, 7)], [round(x1, 7), round(y1, 7)],
+         [round(x0, 7), round(y1, 7)], [round(x0, 7), round(y0, 7)]]]}}, separators = (',', ':'))
+
+
+def _strips(box, n, horizontal):
+    # box cut into n strips
+    x0, y0, x1, y1 = box
+    if horizontal:
+        w = (x1 - x0) / n
+        return [(x0 + i * w, y0, x0 + (i + 1) * w, y1) for i in range(n)]
+    h = (y1 - y0) / n
+    return [(x0, y0 + i * h, x1, y0 + (i + 1) * h) for i in range(n)]
+
+
+def triples(seed = 0, scale = 1, **settings):
+    # (subject, predicate, object) as N-Triples terms; see DEFAULTS for settings.
+    # scale multiplies the number of regions.
+    unknown = set(settings) - set(DEFAULTS)
+    if unknown:
+        raise TypeError(f"unknown settings: {', '.join(sorted(unknown))}")
+    s = dict(DEFAULTS, **settings)
+    rng = random.Random(seed)
+
+    def about(identifier, rdf_type, label):
+        yield _iri(PLOD + identifier), _iri(RDF_TYPE), _iri(PLOD + rdf_type)
+        yield _iri(PLOD + identifier), _iri(RDFS_LABEL), _literal(label)
+
+    def triple(identifier, predicate, value, literal = False):
+        return _iri(PLOD + identifier), _iri(PLOD + predicate), _literal(value) if literal else _iri(PLOD + value)
+
+    def fanout(mean):
+        return max(1, rng.randint(int(mean) // 2, int(mean) + int(mean) // 2)) if mean >= 1 else 1
+
+    # concepts: the first concept_roots are roots, every other one is narrower
+    # than an earlier concept that isn't yet at concept_depth
+    depth = []
+    for c in range(s['concepts']):
+        identifier = f'concept-{c + 1}'
+        yield from about(identifier, 'concept', f'Concept {c + 1}')
+        if c < s['concept_roots'] or s['concept_depth'] <= 1:
+            depth.append(1)
+        else:
+            parent = rng.randrange(c)
+            while depth[parent] >= s['concept_depth']:
+                parent = rng.randrange(c)
+            depth.append(depth[parent] + 1)
+            yield triple(identifier, 'broader', f'concept-{parent + 1}')
+        if c % 10 == 0:
+            yield triple(identifier, 'wikidata-url', f'https://www.wikidata.org/wiki/Q{100000 + c}', literal = True)
+
+    # popular concepts (low numbers) are depicted far more often, as in P-LOD:
+    # concept-n is picked with weight 1/n
+    cumulative = list(itertools.accumulate(1 / n for n in range(1, s['concepts'] + 1)))
+
+    def depicted_concepts():
+        picks = rng.choices(range(1, s['concepts'] + 1), cum_weights = cumulative, k = fanout(s['depictions']))
+        return sorted(set(f'concept-{n}' for n in picks))
+
+    for style in STYLES:
+        yield from about(style, 'pompeian-wall-painting-style', style.replace('-', ' ').title())
+    for characterization in CHARACTERIZATIONS:
+        yield from about(characterization, 'space-characterization', characterization)
+    yield _iri(PLOD + 'wikidata-url'), _iri('http://www.w3.org/2002/07/owl#equivalentProperty'), _iri('http://www.w3.org/2000/01/rdf-schema#seeAlso')
+    # P-LOD describes its classes and predicates too
+    for term in ('city', 'region', 'insula', 'property', 'space', 'feature', 'artwork-component', 'concept', 'luna-image',
+                 'spatially-within', 'created-on-surface-of', 'is-part-of', 'depicts', 'broader', 'best-image', 'geojson'):
+        yield _iri(PLOD + term), _iri(RDFS_LABEL), _literal(term)
+
+    yield from about('pompeii', 'city', 'Pompeii')
+    yield triple('pompeii', 'geojson', _geojson(*EXTENT), literal = True)
+    yield triple('pompeii', 'wikidata-url', 'https://www.wikidata.org/wiki/Q43332', literal = True)
+
+    image = 0
+    regions = s['regions'] * scale
+    for r, region_box in enumerate(_strips(EXTENT, regions, True), 1):
+        region = f'r{r}'
+        yield from about(region, 'region', f'Regio {r}')
+        yield triple(region, 'spatially-within', 'pompeii')
+        yield triple(region, 'geojson', _geojson(*region_box), literal = True)
+
+        for i, insula_box in enumerate(_strips(region_box, fanout(s['insulae']), False), 1):
+            insula = f'{region}-i{i}'
+            yield from about(insula, 'insula', f'Insula {r}.{i}')
+            yield triple(insula, 'spatially-within', region)
+            yield triple(insula, 'geojson', _geojson(*insula_box), literal = True)
+
+            for p, property_box in enumerate(_strips(insula_box, fanout(s['properties']), True), 1):
+                prop = f'{insula}-p{p}'
+                yield from about(prop, 'property', f'Property {r}.{i}.{p}')
+                yield triple(prop, 'spatially-within', insula)
+                yield triple(prop, 'geojson', _geojson(*property_box), literal = True)
+                yield triple(prop, 'p-in-p-url', f'https://pompeiiinpictures.com/r{r}/{r}%20{i:02d}%20{p:02d}.htm', literal = True)
+
+                for sp, space_box in enumerate(_strips(property_box, fanout(s['spaces']), False), 1):
+                    space = f'{prop}-space-{sp}'
+                    yield from about(space, 'space', f'Room {sp}')
+                    yield triple(space, 'spatially-within', prop)
+                    yield triple(space, 'geojson', _geojson(*space_box), literal = True)
+                    if rng.random() < s['characterization_density']:
+                        yield triple(space, 'has-space-characterization', rng.choice(CHARACTERIZATIONS))
+
+                    for f in range(1, fanout(s['features']) + 1):
+                        feature = f'{space}-feature-{f}'
+                        yield from about(feature, 'feature', f'Wall {f}')
+                        yield triple(feature, 'spatially-within', space)
+                        if rng.random() < s['style_density']:
+                            yield triple(feature, 'has-pompeian-wall-painting-style', rng.choice(STYLES))
+
+                        # components on the wall, each with a chain of parts below it
+                        for a in range(1, fanout(s['components']) + 1):
+                            component = f'{feature}-ac-{a}'
+                            parts = [(component, 'created-on-surface-of', feature)]
+                            for d in range(1, s['component_depth']):
+                                parts.append((f'{component}-{d}', 'is-part-of', parts[-1][0]))
+
+                            for part, relation, parent in parts:
+                                yield _iri(PLOD + part), _iri(RDF_TYPE), _iri(PLOD + 'artwork-component')
+                                yield triple(part, relation, parent)
+                                depicted = depicted_concepts()
+                                for c in depicted:
+                                    yield triple(part, 'depicts', c)
+
+                                if rng.random() < s['image_density']:
+                                    image += 1
+                                    collection = 'PALP' if image % 3 else 'PPM'
+                                    luna = f'luna_img_{collection}_{image}'
+                                    yield triple(part, 'best-image', luna)
+                                    yield from about(luna, 'luna-image', f'{collection} {image}')
+                                    yield triple(luna, 'depicts', feature)
+                                    for c in depicted:
+                                        yield triple(luna, 'depicts', c)
+                                    yield triple(luna, 'x-luna-record-id', str(100000 + image), literal = True)
+                                    yield triple(luna, 'x-luna-media-id', str(500000 + image), literal = True)
+                                    yield triple(luna, 'x-luna-batch-id', f'batch-{r}', literal = True)
+                                    yield triple(luna, 'x-luna-description', f'{collection} image {image} of {feature}', literal = True)
+                                    yield triple(luna, 'x-luna-url-3', f'https://example.org/luna/{image}.jpg', literal = True)
+
+
+def write(out, seed = 0, scale = 1, **settings):
+    # write N-Triples to out (a path or text file); returns the number of triples
+    if isinstance(out, str):
+        with open(out, 'w', encoding = 'utf-8') as f:
+            return write(f, seed = seed, scale = scale, **settings)
+    n = 0
+    for subject, predicate, obj in triples(seed = seed, scale = scale, **settings):
+        out.write(f'{subject} {predicate} {obj} .\n')
+        n += 1
+    return n
+
+
+def graph(seed = 0, scale = 1, **settings):
+    # the same data as an rdflib Graph, for use_local_graph(graph = ...)
+    import io
+    import rdflib as rdf
+
+    text = io.StringIO()
+    write(text, seed = seed, scale = scale, **settings)
+    g = rdf.Graph()
+    g.parse(data = text.getvalue(), format = 'nt')
+    return g
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description = 'Write a synthetic P-LOD graph as N-Triples.')
+    parser.add_argument('-o', '--output', help = 'file to write (default: stdout)')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--scale', type = int, default = 1, help = 'multiply the number of regions')
+    for name, default in DEFAULTS.items():
+        parser.add_argument('--' + name.replace('_', '-'), type = type(default), default = default)
+    args = vars(parser.parse_args())
+
+    output, seed, scale = args.pop('output'), args.pop('seed'), args.pop('scale')
+    n = write(output or sys.stdout, seed = seed, scale = scale, **args)
+    print(f'{n} triples', file = sys.stderr)
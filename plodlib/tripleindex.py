@@ -0,0 +1,255 @@
+# Memory-mapped, integer-encoded copy of an RDF dump, for serving P-LOD
+# locally from several processes without each one parsing the dump.
+#
+#     python -m plodlib.tripleindex -o plod.index plod.ttl     once, after each release
+#
+#     plodlib.use_triple_index('plod.index')                  in each process: opens in milliseconds
+#     python -m plodlib.service --index plod.index
+#
+# The index is a directory of .npy files: every distinct term, encoded and
+# sorted (terms.npy, offsets.npy), and the triples as term numbers sorted
+# three ways (spo.npy, pos.npy, osp.npy, each with the start of every term's
+# rows, *_starts.npy), so any triple pattern is a range found by a lookup and
+# a binary search. The files are opened with mmap, so processes on one
+# machine share the same pages and only what queries touch is read.
+# TripleIndexStore puts the index behind rdflib's Store interface; rdflib's
+# SPARQL engine then answers every PLODResource query from it, as LocalGraph
+# does from a parsed graph.
+
+import bisect
+import functools
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import rdflib as rdf
+from rdflib.store import Store
+
+from .client import LocalGraph, set_client
+
+
+# column order of each sorted copy of the triples
+ORDERS = {'spo': (0, 1, 2), 'pos': (1, 2, 0), 'osp': (2, 0, 1)}
+
+# where s, p and o are in each
+POSITIONS = {name: tuple(order.index(c) for c in range(3)) for name, order in ORDERS.items()}
+
+# decoded terms kept per process
+TERM_CACHE_SIZE = 256 * 1024
+
+# rows decoded at a time when a pattern matches many triples
+SCAN_CHUNK = 10000
+
+
+def _encode(term):
+    # a term as bytes; URIs, blank nodes and literals sort apart
+    if isinstance(term, rdf.Literal):
+        return b'L' + (term.language or '').encode('utf-8') + b'\x00' + \
+            (term.datatype or '').encode('utf-8') + b'\x00' + str(term).encode('utf-8')
+    if isinstance(term, rdf.BNode):
+        return b'B' + str(term).encode('utf-8')
+    return b'U' + str(term).encode('utf-8')
+
+
+def _decode(encoded):
+    kind, text = encoded[:1], encoded[1:].decode('utf-8')
+    if kind == b'L':
+        language, datatype, lexical = text.split('\x00', 2)
+        return rdf.Literal(lexical, lang = language or None, datatype = datatype or None)
+    if kind == b'B':
+        return rdf.BNode(text)
+    return rdf.URIRef(text)
+
+
+def build_triple_index(path, *sources, graph = None, format = None):
+    # write the index of the RDF dumps (or an rdflib graph) to the directory at
+    # path, replacing what is there. Built beside it and moved into place.
+    if graph is None:
+        graph = rdf.Graph()
+        for source in sources:
+            graph.parse(source, format = format)
+
+    encoded = {}
+    triples = []
+    for triple in graph:
+        triples.append(tuple(encoded.setdefault(t, _encode(t)) for t in triple))
+    terms = sorted(set(encoded.values()))
+    ids = {e: i for i, e in enumerate(terms)}
+    spo = np.array([[ids[e] for e in triple] for triple in triples], dtype = np.int32).reshape(-1, 3).T
+
+    building = path + '.building'
+    if os.path.exists(building):
+        shutil.rmtree(building)
+    os.makedirs(building)
+
+    lengths = np.array([len(e) for e in terms], dtype = np.int64)
+    np.save(os.path.join(building, 'offsets.npy'), np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+    np.save(os.path.join(building, 'terms.npy'), np.frombuffer(b''.join(terms), dtype = np.uint8))
+    for name, columns in ORDERS.items():
+        ordered = spo[list(columns)]
+        # lexsort sorts by its last key first
+        ordered = np.ascontiguousarray(ordered[:, np.lexsort(ordered[::-1])])
+        np.save(os.path.join(building, f'{name}.npy'), ordered)
+        # where each term's rows start in the first column, so that lookup is two reads
+        np.save(os.path.join(building, f'{name}_starts.npy'),
+                np.searchsorted(ordered[0], np.arange(len(terms) + 1)).astype(np.int64))
+    with open(os.path.join(building, 'meta.json'), 'w') as f:
+        json.dump({'triples': len(triples), 'terms': len(terms), 'sources': [str(s) for s in sources], 'built': time.time(),
+                   'namespaces': {prefix: str(namespace) for prefix, namespace in graph.namespaces()}}, f)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(building, path)
+    return TripleIndex(path)
+
+
+class TripleIndex(object):
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        # memoryviews of the mapped files: indexing one gives a Python int, and
+        # bisect searches one in place, at a fraction of numpy's cost per call
+        self._offsets = self._map('offsets')
+        self._terms = self._map('terms')
+        self._columns = {}
+        self._starts = {}
+        for name in ORDERS:
+            mapped = np.load(os.path.join(path, f'{name}.npy'), mmap_mode = 'r')
+            self._columns[name] = tuple(memoryview(np.asarray(mapped[row])) for row in range(3))
+            self._starts[name] = self._map(f'{name}_starts')
+        self.term = functools.lru_cache(maxsize = TERM_CACHE_SIZE)(self._term)
+        self.id = functools.lru_cache(maxsize = TERM_CACHE_SIZE)(self._id)
+
+    def _map(self, name):
+        return memoryview(np.asarray(np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode = 'r')))
+
+    def _encoded(self, i):
+        return self._terms[self._offsets[i]:self._offsets[i + 1]].tobytes()
+
+    def _term(self, i):
+        # rdflib term for a term number
+        return _decode(self._encoded(i))
+
+    def _id(self, term):
+        # term number of an rdflib term, None if the dump doesn't have it
+        target = _encode(term)
+        lo, hi = 0, len(self._offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._encoded(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self._offsets) - 1 and self._encoded(lo) == target else None
+
+    def match(self, s = None, p = None, o = None):
+        # (s, p, o) term number lists of the triples matching a pattern, None
+        # matching anything; yielded SCAN_CHUNK triples at a time
+        if s is not None:
+            name, key = ('osp', (o, s)) if p is None and o is not None else ('spo', (s, p, o))
+        elif p is not None:
+            name, key = 'pos', (p, o)
+        else:
+            name, key = 'osp', (o,)
+
+        columns = self._columns[name]
+        if key[0] is None:
+            lo, hi = 0, len(columns[0])
+        else:
+            starts = self._starts[name]
+            lo, hi = starts[key[0]], starts[key[0] + 1]
+        for column, value in zip(columns[1:], key[1:]):
+            if value is None or lo == hi:
+                break
+            lo, hi = bisect.bisect_left(column, value, lo, hi), bisect.bisect_right(column, value, lo, hi)
+        if lo == hi:
+            return
+
+        s, p, o = (columns[i] for i in POSITIONS[name])
+        for start in range(lo, hi, SCAN_CHUNK):
+            end = min(start + SCAN_CHUNK, hi)
+            yield s[start:end].tolist(), p[start:end].tolist(), o[start:end].tolist()
+
+    def triples(self, s = None, p = None, o = None):
+        # rdflib (s, p, o) terms matching a pattern of rdflib terms or None
+        ids = []
+        for t in (s, p, o):
+            i = None if t is None else self.id(t)
+            if t is not None and i is None:
+                return
+            ids.append(i)
+        term = self.term
+        for ss, ps, os_ in self.match(*ids):
+            for si, pi, oi in zip(ss, ps, os_):
+                yield term(si), term(pi), term(oi)
+
+    def __len__(self):
+        return len(self._columns['spo'][0])
+
+    def __repr__(self):
+        return f'TripleIndex({self.path!r}, {len(self)} triples, {self.meta["terms"]} terms)'
+
+
+class TripleIndexStore(Store):
+    # read-only rdflib Store over a TripleIndex
+
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+        # the dump's prefixes, for serializing DESCRIBE and CONSTRUCT results as LocalGraph does
+        self._namespaces = {prefix: rdf.URIRef(namespace) for prefix, namespace in index.meta.get('namespaces', {}).items()}
+
+    def triples(self, triple_pattern, context = None):
+        for triple in self.index.triples(*triple_pattern):
+            yield triple, iter(())
+
+    def __len__(self, context = None):
+        return len(self.index)
+
+    def contexts(self, triple = None):
+        return iter(())
+
+    def add(self, triple, context, quoted = False):
+        raise TypeError('a triple index is read-only; rebuild it with build_triple_index()')
+
+    def remove(self, triple, context = None):
+        raise TypeError('a triple index is read-only; rebuild it with build_triple_index()')
+
+    def bind(self, prefix, namespace, override = True):
+        if override or prefix not in self._namespaces:
+            self._namespaces[prefix] = namespace
+
+    def prefix(self, namespace):
+        return next((p for p, n in self._namespaces.items() if n == namespace), None)
+
+    def namespace(self, prefix):
+        return self._namespaces.get(prefix)
+
+    def namespaces(self):
+        return iter(list(self._namespaces.items()))
+
+
+def use_triple_index(path):
+    # answer every query from the triple index at path instead of the remote endpoint
+    index = TripleIndex(path)
+    graph = rdf.Graph(store = TripleIndexStore(index))
+    return set_client(LocalGraph(graph = graph, endpoint = 'index:' + os.path.abspath(path)))
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description = 'Build a memory-mapped triple index from RDF dumps.')
+    parser.add_argument('-o', '--output', required = True, help = 'index directory to write')
+    parser.add_argument('-f', '--format', help = 'RDF format of the dumps (default: from the file names)')
+    parser.add_argument('sources', nargs = '+', metavar = 'FILE')
+    args = parser.parse_args()
+
+    started = time.time()
+    index = build_triple_index(args.output, *args.sources, format = args.format)
+    print(f'{index!r} in {time.time() - started:.1f}s', file = sys.stderr)
@@ -10,9 +10,14 @@ setup(name='plodlib',
       url='https://github.com/p-lod/plodlib/',
       packages=['plodlib'],
       install_requires=[
+         'numpy',
          'pandas',
          'rdflib>=7.0.0',
          'requests'
-        ]
+        ],
+      extras_require={
+         'async': ['httpx'],
+         'sparse': ['scipy']
+        }
      )
 